@@ -2,6 +2,7 @@
 ASGI config for gotalk project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
+HTTP goes to Django, websockets to the chat (mainapp.chat).
 
 For more information on this file, see
 https://docs.djangoproject.com/en/4.0/howto/deployment/asgi/
@@ -13,4 +14,33 @@ from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'gotalk.settings')
 
-application = get_asgi_application()
+django_application = get_asgi_application()
+
+# apps are loaded by get_asgi_application()
+from mainapp.chat import ChatApplication, SessionAuthMiddleware  # noqa: E402
+from mainapp.recommendations import warm_index  # noqa: E402
+
+warm_index()
+
+chat = ChatApplication()
+chat_application = SessionAuthMiddleware(chat)
+
+
+async def lifespan(scope, receive, send):
+    while True:
+        event = await receive()
+        if event['type'] == 'lifespan.startup':
+            await send({'type': 'lifespan.startup.complete'})
+        elif event['type'] == 'lifespan.shutdown':
+            # buffered chat messages are written before the server stops
+            await chat.close()
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+async def application(scope, receive, send):
+    if scope['type'] == 'websocket':
+        return await chat_application(scope, receive, send)
+    if scope['type'] == 'lifespan':
+        return await lifespan(scope, receive, send)
+    return await django_application(scope, receive, send)
@@ -0,0 +1,102 @@
+"""
+Pub/sub of chat messages: a message published to a group is delivered to
+every connection subscribed to the group.
+
+Subscribers are the connections of this process (objects with a non-blocking
+``deliver(message)``), a layer fans a message out to them in one loop.
+Messages are JSON strings, encoded once by the publisher.
+
+Layers:
+    gotalk.chat_layers.InMemoryChannelLayer  - in-process, for development, tests and single process servers
+    gotalk.chat_layers.RedisChannelLayer     - Redis pub/sub, messages reach the connections of all
+                                               processes, one Redis subscription per group and process,
+                                               needs ``redis`` package
+"""
+import asyncio
+from collections import defaultdict
+
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+CHAT_CHANNEL_LAYER = getattr(settings, 'CHAT_CHANNEL_LAYER', 'gotalk.chat_layers.InMemoryChannelLayer')
+CHAT_REDIS_URL = getattr(settings, 'CHAT_REDIS_URL', 'redis://localhost:6379/0')
+CHAT_REDIS_PREFIX = getattr(settings, 'CHAT_REDIS_PREFIX', 'chat:')
+
+
+class BaseChannelLayer:
+    def __init__(self):
+        self.groups = defaultdict(set)     # group -> local subscribers
+
+    async def subscribe(self, group, subscriber):
+        self.groups[group].add(subscriber)
+
+    async def unsubscribe(self, group, subscriber):
+        subscribers = self.groups.get(group)
+        if subscribers is not None:
+            subscribers.discard(subscriber)
+            if not subscribers:
+                del self.groups[group]
+
+    async def publish(self, group, message):
+        raise NotImplementedError
+
+    def fan_out(self, group, message):
+        # deliver() never waits, a slow subscriber can't hold up the others
+        for subscriber in list(self.groups.get(group, ())):
+            subscriber.deliver(message)
+
+    async def close(self):
+        pass
+
+
+class InMemoryChannelLayer(BaseChannelLayer):
+    async def publish(self, group, message):
+        self.fan_out(group, message)
+
+
+class RedisChannelLayer(BaseChannelLayer):
+    def __init__(self, client=None, url=CHAT_REDIS_URL, prefix=CHAT_REDIS_PREFIX):
+        super().__init__()
+        if client is None:
+            import redis.asyncio as redis
+            client = redis.Redis.from_url(url)
+        self.client = client
+        self.prefix = prefix
+        self.pubsub = client.pubsub()
+        self.listener = None
+
+    async def subscribe(self, group, subscriber):
+        first = group not in self.groups
+        await super().subscribe(group, subscriber)
+        if first:
+            await self.pubsub.subscribe(self.prefix + group)
+            if self.listener is None:
+                self.listener = asyncio.ensure_future(self.listen())
+
+    async def unsubscribe(self, group, subscriber):
+        await super().unsubscribe(group, subscriber)
+        if group not in self.groups:
+            await self.pubsub.unsubscribe(self.prefix + group)
+
+    async def publish(self, group, message):
+        await self.client.publish(self.prefix + group, message)
+
+    async def listen(self):
+        async for item in self.pubsub.listen():
+            if item['type'] != 'message':
+                continue
+            channel, data = item['channel'], item['data']
+            if isinstance(channel, bytes):
+                channel, data = channel.decode(), data.decode()
+            self.fan_out(channel[len(self.prefix):], data)
+
+    async def close(self):
+        if self.listener is not None:
+            self.listener.cancel()
+            self.listener = None
+        await self.pubsub.close()
+
+
+def get_channel_layer():
+    # a layer belongs to one event loop, every ChatApplication makes its own
+    return import_string(CHAT_CHANNEL_LAYER)()
@@ -0,0 +1,9 @@
+from django.db import connections
+
+
+def close_old_connections():
+    # as django.db.close_old_connections, for code which runs outside of a request
+    # (websockets, task workers); connections in an atomic block belong to the caller (tests run in one)
+    for conn in connections.all():
+        if not conn.in_atomic_block:
+            conn.close_if_unusable_or_obsolete()
@@ -1,63 +1,120 @@
-from django.core.cache import cache
+import asyncio
+
+from asgiref.sync import sync_to_async
 from django.conf import settings
 from django.contrib.auth.models import User
-from django.utils.deprecation import MiddlewareMixin
+from django.utils.functional import SimpleLazyObject
 
-ONLINE_THRESHOLD = getattr(settings, 'ONLINE_THRESHOLD', 60 * 15)
-ONLINE_MAX = getattr(settings, 'ONLINE_MAX', 50)
+from gotalk.presence import get_presence
+from mainapp.current_profile import get_current_profile
 
 
-def get_online_now(self):
-    return User.objects.filter(id__in=self.online_now_ids or [])
+class SyncAndAsyncMiddleware:
+    """
+    Base of the middleware which works under WSGI and ASGI without being
+    adapted by the handler: ``__call__`` returns a coroutine (``__acall__``)
+    when the next handler is async, so async views get no thread hops here.
+    """
+    sync_capable = True
+    async_capable = True
 
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.async_mode = asyncio.iscoroutinefunction(get_response)
+        if self.async_mode:
+            # the same mark django.utils.deprecation.MiddlewareMixin puts
+            self._is_coroutine = asyncio.coroutines._is_coroutine
 
-class OnlineNowMiddleware(MiddlewareMixin):
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        return self.get_response(request)
+
+    async def __acall__(self, request):
+        return await self.get_response(request)
+
+
+class OnlineNowMiddleware(SyncAndAsyncMiddleware):
     """
     Maintains a list of users who have interacted with the website recently.
     Their user IDs are available as ``online_now_ids`` on the request object,
     and their corresponding users are available (lazily) as the
-    ``online_now`` property on the request object.
+    ``online_now`` attribute on the request object.
+    Both are evaluated on the first use only and live on the request instance.
 
        using in templates:
      {{ request.online_now }} => display all list of online users.
      {{ request.online_now_ids }} => display all online user ids.
      {{ request.online_now.count }} => display total online users.
+     {% if profile.user_id|is_online:request %} => O(1) check, see mainapp.templatetags.presence
     """
 
-    def process_request(self, request):
-        # First get the index
-        uids = cache.get('online-now', [])
+    def __init__(self, get_response, presence=None):
+        super().__init__(get_response)
+        self.presence = presence or get_presence()
 
-        # Perform the multiget on the individual online uid keys
-        online_keys = ['online-%s' % (u,) for u in uids]
-        fresh = cache.get_many(online_keys).keys()
-        online_now_ids = [int(k.replace('online-', '')) for k in fresh]
-
-        # If the user is authenticated, add their id to the list
+    def touch(self, request):
+        # anonymous users aren't tracked, authenticated ones are written once in a while
         if request.user.is_authenticated:
-            uid = request.user.id
-            # If their uid is already in the list, we want to bump it
-            # to the top, so we remove the earlier entry.
-            if uid in online_now_ids:
-                online_now_ids.remove(uid)
-            online_now_ids.append(uid)
-            if len(online_now_ids) > ONLINE_MAX:
-                del online_now_ids[0]
+            self.presence.touch(request.user.pk)
+
+    def set_online(self, request):
+        presence = self.presence
+        request.online_now_ids = SimpleLazyObject(presence.online_ids)
+        request.online_user_ids = SimpleLazyObject(lambda: frozenset(presence.online_ids(limit=None)))
+        request.online_now = SimpleLazyObject(
+            lambda: User.objects.filter(id__in=list(request.online_now_ids)))
 
-        # Attach our modifications to the request object
-        request.__class__.online_now_ids = online_now_ids
-        request.__class__.online_now = property(get_online_now)
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        self.touch(request)
+        self.set_online(request)
+        return self.get_response(request)
 
-        # Set the new cache
-        cache.set('online-%s' % (request.user.pk,), True, ONLINE_THRESHOLD)
-        cache.set('online-now', online_now_ids, ONLINE_THRESHOLD)
+    async def __acall__(self, request):
+        # request.user comes from the session and the DB, so it's resolved in a thread,
+        # requests without a session cookie (API clients) are anonymous and skip it
+        if settings.SESSION_COOKIE_NAME in request.COOKIES:
+            await sync_to_async(self.touch)(request)
+        self.set_online(request)
+        return await self.get_response(request)
 
 
-class DimonMiddleware:
-    def __init__(self, get_response):
-        self.get_response = get_response
+def get_profile(request):
+    if not hasattr(request, '_cached_profile'):
+        request._cached_profile = get_current_profile(request.user)
+    return request._cached_profile
+
+
+class CurrentProfileMiddleware(SyncAndAsyncMiddleware):
+    """
+    Profile of the logged in user as ``request.profile``, None for anonymous users.
+    Must go after AuthenticationMiddleware.
+    Sync requests resolve it on the first use, once per request. A lazy object would
+    query the DB from the event loop (SynchronousOnlyOperation), so async requests
+    get it resolved in a thread before the view, requests without a session cookie
+    are anonymous and skip the thread.
+    """
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        request.profile = SimpleLazyObject(lambda: get_profile(request))
+        return self.get_response(request)
+
+    async def __acall__(self, request):
+        if settings.SESSION_COOKIE_NAME in request.COOKIES:
+            request.profile = await sync_to_async(get_profile)(request)
+        else:
+            request.profile = None
+        return await self.get_response(request)
+
 
+class DimonMiddleware(SyncAndAsyncMiddleware):
     def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
         #print("custom middleware before next middleware/view")
         # Code to be executed for each request before
         # the view (and later middleware) are called.
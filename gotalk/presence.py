@@ -0,0 +1,159 @@
+"""
+Presence of logged in users: who was active during the last ONLINE_THRESHOLD seconds.
+
+Presence is a set of user ids scored by the time of the last request. Every
+request costs at most one atomic write. A user is written at most once per
+PRESENCE_TOUCH_INTERVAL seconds, and reading the online ids is one range query.
+
+Backends:
+    gotalk.presence.LocalPresenceBackend  - in-process, for development, tests and single process servers
+    gotalk.presence.RedisPresenceBackend  - sorted set in Redis (or anything speaking its protocol),
+                                            shared by all workers, needs ``redis`` package
+"""
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+ONLINE_THRESHOLD = getattr(settings, 'ONLINE_THRESHOLD', 60 * 15)
+ONLINE_MAX = getattr(settings, 'ONLINE_MAX', 50)
+PRESENCE_TOUCH_INTERVAL = getattr(settings, 'PRESENCE_TOUCH_INTERVAL', 60)
+PRESENCE_BACKEND = getattr(settings, 'PRESENCE_BACKEND', 'gotalk.presence.LocalPresenceBackend')
+PRESENCE_REDIS_URL = getattr(settings, 'PRESENCE_REDIS_URL', 'redis://localhost:6379/0')
+PRESENCE_KEY = getattr(settings, 'PRESENCE_KEY', 'online-now')
+
+
+class BasePresenceBackend:
+    def __init__(self, threshold=ONLINE_THRESHOLD, touch_interval=PRESENCE_TOUCH_INTERVAL):
+        self.threshold = threshold
+        self.touch_interval = touch_interval
+        # user id -> time of the last write from this process
+        self._touched = {}
+        self._touched_lock = threading.Lock()
+        self._next_prune = 0
+
+    def touch(self, user_id, now=None):
+        """
+        Marks the user as online. Returns False if the write was throttled.
+        """
+        now = now or time.time()
+        last = self._touched.get(user_id)
+        if last is not None and now - last < self.touch_interval:
+            return False
+        with self._touched_lock:
+            self._touched[user_id] = now
+            if now >= self._next_prune:
+                # forget users who aren't throttled anymore
+                self._touched = {uid: ts for uid, ts in self._touched.items()
+                                 if now - ts < self.touch_interval}
+                self._next_prune = now + self.touch_interval
+        self.write(user_id, now)
+        return True
+
+    def write(self, user_id, now):
+        raise NotImplementedError
+
+    def online_ids(self, now=None, limit=ONLINE_MAX):
+        """
+        Ids of users seen during the last ``threshold`` seconds, the most recent first.
+        """
+        raise NotImplementedError
+
+    def clear(self):
+        with self._touched_lock:
+            self._touched = {}
+
+
+class LocalPresenceBackend(BasePresenceBackend):
+    """
+    Timestamps only grow, so an OrderedDict with the touched key moved
+    to the end stays sorted by score: writes and expiring are O(1).
+    Every process has its own presence, use it with a single worker only.
+    """
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._scores = OrderedDict()
+        self._lock = threading.Lock()
+
+    def write(self, user_id, now):
+        with self._lock:
+            self._scores[user_id] = now
+            self._scores.move_to_end(user_id)
+            self._expire(now)
+
+    def _expire(self, now):
+        cutoff = now - self.threshold
+        while self._scores:
+            user_id, ts = next(iter(self._scores.items()))
+            if ts >= cutoff:
+                break
+            self._scores.popitem(last=False)
+
+    def online_ids(self, now=None, limit=ONLINE_MAX):
+        now = now or time.time()
+        with self._lock:
+            self._expire(now)
+            ids = []
+            for user_id in reversed(self._scores):
+                ids.append(user_id)
+                if limit and len(ids) >= limit:
+                    break
+        return ids
+
+    def clear(self):
+        super().clear()
+        with self._lock:
+            self._scores.clear()
+
+
+class RedisPresenceBackend(BasePresenceBackend):
+    """
+    ZADD of the user's timestamp and removal of the expired members
+    go in one MULTI/EXEC round trip.
+    """
+    def __init__(self, *args, client=None, url=PRESENCE_REDIS_URL, key=PRESENCE_KEY, **kwargs):
+        super().__init__(*args, **kwargs)
+        if client is None:
+            import redis
+            client = redis.Redis.from_url(url)
+        self.client = client
+        self.key = key
+
+    def write(self, user_id, now):
+        pipe = self.client.pipeline(transaction=True)
+        pipe.zadd(self.key, {user_id: now})
+        pipe.zremrangebyscore(self.key, '-inf', now - self.threshold)
+        pipe.expire(self.key, int(self.threshold))
+        pipe.execute()
+
+    def online_ids(self, now=None, limit=ONLINE_MAX):
+        now = now or time.time()
+        page = {'start': 0, 'num': limit} if limit else {}
+        members = self.client.zrevrangebyscore(self.key, '+inf', now - self.threshold, **page)
+        return [int(member) for member in members]
+
+    def clear(self):
+        super().clear()
+        self.client.delete(self.key)
+
+
+_presence = None
+
+
+def get_presence():
+    global _presence
+    if _presence is None:
+        _presence = import_string(PRESENCE_BACKEND)()
+    return _presence
+
+
+def get_online_user_ids(request):
+    """
+    Set of all online user ids, read from the backend once per request.
+    """
+    ids = getattr(request, 'online_user_ids', None)
+    if ids is None:
+        ids = request.online_user_ids = frozenset(get_presence().online_ids(limit=None))
+    return ids
@@ -51,6 +51,8 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    # Custom middleware to provide request.profile
+    'gotalk.middleware.CurrentProfileMiddleware',
     # Custom middleware to tracking online users
     'gotalk.middleware.OnlineNowMiddleware',
     # Custom in education order
@@ -144,6 +146,19 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 AUTH_PROFILE_MODULE = 'mainapp.Profile'
 SESSION_COOKIE_AGE = 30 * 60
 
+# Sessions are read from the cache and written through to the DB.
+# 'django.contrib.sessions.backends.cache' drops the DB writes too, if the cache is persistent.
+SESSION_ENGINE = 'django.contrib.sessions.backends.cached_db'
+SESSION_CACHE_ALIAS = 'default'
+
+# Local memory cache is a stand-in for development and tests,
+# production should point 'default' to a shared cache (Redis, Memcached)
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    }
+}
+
 REST_FRAMEWORK = {
     'DEFAULT_RENDERER_CLASSES': [
         'rest_framework.renderers.JSONRenderer',
@@ -0,0 +1,95 @@
+"""
+Content addressed storage of uploaded avatars.
+
+A file is named by the SHA-256 of its bytes: avatars/9f/86/9f86d081...0a08.jpeg
+The same image uploaded again (or by another user) is the same name and one file,
+and a name never gets other bytes, so its url can be cached forever. Uploads are
+hashed in chunks, a large upload spooled to a temporary file is never read into memory.
+
+Which files are in use is counted by mainapp.models.AvatarFile, ``collect_avatars``
+deletes the rest.
+
+Django serves media with the immutable Cache-Control in DEBUG (``serve_media``),
+the same for nginx:
+
+    location ~ "^/media/(thumbs/)?avatars/" {
+        add_header Cache-Control "public, max-age=31536000, immutable";
+    }
+"""
+import hashlib
+import os
+import posixpath
+import re
+
+from django.conf import settings
+from django.core.files import File
+from django.core.files.storage import FileSystemStorage
+from django.core.files.utils import validate_file_name
+from django.utils.cache import patch_cache_control
+from django.utils.module_loading import import_string
+from django.views.static import serve
+
+AVATAR_STORAGE = getattr(settings, 'AVATAR_STORAGE', 'gotalk.storage.ContentAddressedStorage')
+# a year, the longest time browsers and proxies keep anything
+IMMUTABLE_MAX_AGE = 60 * 60 * 24 * 365
+
+# <2 hex>/<2 hex>/<64 hex> followed by the extension or a thumbnail suffix
+CONTENT_NAME_RE = re.compile(r'(^|/)([0-9a-f]{2})/([0-9a-f]{2})/\2\3[0-9a-f]{60}[-.@]')
+
+
+def is_content_addressed(name):
+    return CONTENT_NAME_RE.search(name) is not None
+
+
+class ContentAddressedStorage(FileSystemStorage):
+    def content_name(self, name, content):
+        # the directory of upload_to, the hash, the extension of the uploaded name
+        digest = hashlib.sha256()
+        for chunk in content.chunks():
+            digest.update(chunk)
+        digest = digest.hexdigest()
+        extension = posixpath.splitext(name)[1].lower()
+        if not re.fullmatch(r'\.\w{1,10}', extension):
+            extension = ''
+        return posixpath.join(posixpath.dirname(name), digest[:2], digest[2:4], digest + extension)
+
+    def save(self, name, content, max_length=None):
+        if name is None:
+            name = content.name
+        if not hasattr(content, 'chunks'):
+            content = File(content, name)
+        name = self.content_name(name, content)
+        validate_file_name(name, allow_relative_path=True)
+        if self.exists(name):
+            # the same bytes are there, a fresh modification time keeps them
+            # from ``collect_avatars`` until the new reference is counted
+            os.utime(self.path(name))
+            return name
+        try:
+            return self._save(name, content)
+        except FileExistsError:
+            # saved by a parallel upload of the same file meanwhile
+            return name
+
+    def get_available_name(self, name, max_length=None):
+        # _save asks for another name when the file exists, but a taken name has these bytes already
+        raise FileExistsError(name)
+
+
+_avatar_storage = None
+
+
+def get_avatar_storage():
+    # callable storage= of Profile.avatar, the class is a setting
+    global _avatar_storage
+    if _avatar_storage is None:
+        _avatar_storage = import_string(AVATAR_STORAGE)()
+    return _avatar_storage
+
+
+def serve_media(request, path, document_root=None, show_indexes=False):
+    # django.views.static.serve for DEBUG, content addressed files are cached forever
+    response = serve(request, path, document_root, show_indexes)
+    if response.status_code == 200 and is_content_addressed(path):
+        patch_cache_control(response, public=True, max_age=IMMUTABLE_MAX_AGE, immutable=True)
+    return response
@@ -19,6 +19,7 @@ from django.contrib.staticfiles.urls import staticfiles_urlpatterns
 from django.urls import path, include
 
 from gotalk import settings
+from gotalk.storage import serve_media
 from mainapp.views import *
 
 urlpatterns = [
@@ -29,6 +30,6 @@ urlpatterns = [
 
 if settings.DEBUG:
     if settings.MEDIA_ROOT:
-        urlpatterns += static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
+        urlpatterns += static(settings.MEDIA_URL, view=serve_media, document_root=settings.MEDIA_ROOT)
 
 urlpatterns += staticfiles_urlpatterns()
@@ -14,3 +14,8 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'gotalk.settings')
 
 application = get_wsgi_application()
+
+# apps are loaded by get_wsgi_application(), recommendations are ready before the first visitors
+from mainapp.recommendations import warm_index  # noqa: E402
+
+warm_index()
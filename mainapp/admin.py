@@ -9,3 +9,10 @@ admin.site.register(Tag)
 admin.site.register(Profile)
 admin.site.register(LanguageLevel)
 admin.site.register(Partner)
+admin.site.register(Recommendation)
+admin.site.register(ProfileSummary)
+admin.site.register(Conversation)
+admin.site.register(Message)
+admin.site.register(AvatarFile)
+admin.site.register(Task)
+admin.site.register(ProfileViewHour)
@@ -0,0 +1,54 @@
+"""
+Async versions of the hot read-only endpoints for ASGI servers (uvicorn, daphne):
+
+    /api/async/profiles/                   the same JSON as /api/v1/profiles/
+    /api/async/profiles/<profile_id>/      the same JSON as /api/v1/profiles/<id>/
+    /api/async/reference/<name>/           the same response as /api/v1/reference/<name>/
+
+Django 4.0 has no async ORM yet (aget(), async for, ... come with 4.1), so each
+view does all of its DB/cache work in one sync_to_async call. The event loop
+keeps the connections of idle clients, a thread is taken for the query only.
+With the middleware of gotalk.middleware the request gets no other thread hops.
+"""
+from asgiref.sync import sync_to_async
+from django.http import Http404, JsonResponse
+
+from .filters import filter_profiles
+from .models import ProfileSummary
+from .pagination import InvalidCursor, PROFILES_PAGE_SIZE, paginate_by_cursor
+from .reference import REFERENCE_DATA, get_reference_blob
+from .serializers import ProfileSummarySerializer
+from .views import reference_response
+
+
+def serialize(summaries, request):
+    return ProfileSummarySerializer(summaries, many=True, context={'request': request}).data
+
+
+async def profiles(request):
+    queryset = filter_profiles(ProfileSummary.objects.all(), request.GET)
+    try:
+        page = await sync_to_async(paginate_by_cursor)(queryset, request.GET.get('cursor'),
+                                                       PROFILES_PAGE_SIZE, 'last_login')
+    except InvalidCursor:
+        raise Http404('Invalid cursor')
+    next_link = None
+    if page.has_next():
+        query = request.GET.copy()
+        query['cursor'] = page.next_cursor
+        next_link = request.build_absolute_uri('?' + query.urlencode())
+    return JsonResponse({'next': next_link, 'results': serialize(page.object_list, request)})
+
+
+async def profile(request, profile_id):
+    summary = await sync_to_async(ProfileSummary.objects.filter(pk=profile_id).first)()
+    if summary is None:
+        raise Http404()
+    return JsonResponse(ProfileSummarySerializer(summary, context={'request': request}).data)
+
+
+async def reference(request, name):
+    if name not in REFERENCE_DATA:
+        raise Http404()
+    blob = await sync_to_async(get_reference_blob)(name)
+    return reference_response(request, blob)
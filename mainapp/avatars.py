@@ -0,0 +1,206 @@
+"""
+Avatar thumbnails of profiles (mainapp.thumbnails), made off the request path.
+
+A profile saved with a new avatar drops its old thumbnails, templates show the
+original meanwhile. The save enqueues a background task (mainapp.tasks) which
+makes the new ones and saves them to Profile.avatar_thumbnails, which refreshes
+the summary and the cards by the usual signals.
+``build_thumbnails`` does the avatars uploaded before, with a process pool.
+
+Avatar files are content addressed (gotalk.storage) and shared by the profiles
+which uploaded the same image, AvatarFile counts them: +1 for the new avatar,
+-1 for the replaced or deleted one, each a single statement. A delete releases
+the file in its own transaction. post_save runs after the save has committed,
+unless the caller has opened a transaction: the profile edit view and the admin
+do, other savers of an avatar should. A count lost in between never deletes
+a used file, collect_avatars checks the profiles before deleting.
+An avatar which is in use already reuses its thumbnails.
+"""
+import posixpath
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Case, DateTimeField, F, Value, When
+from django.db.models.functions import Greatest
+from django.utils import timezone
+
+from gotalk.storage import get_avatar_storage, is_content_addressed
+from .cards import bump_card_version
+from .current_profile import invalidate_current_profile
+from .models import AvatarFile, Profile
+from .summaries import refresh_summaries
+from .tasks import enqueue
+from .thumbnails import THUMBNAIL_ERRORS, delete_thumbnails, make_thumbnails
+
+# seconds an unused file is kept, longer than an upload takes to be saved
+AVATAR_GC_GRACE = getattr(settings, 'AVATAR_GC_GRACE', 60 * 60 * 24)
+
+
+def stored_avatar(profile):
+    # name of the avatar in the database, '' for a new profile
+    if profile._state.adding:
+        return ''
+    return Profile.objects.filter(pk=profile.pk).values_list('avatar', flat=True).first() or ''
+
+
+def avatar_changed(profile, stored):
+    # a new upload, a cleared avatar or another file name
+    return not profile.avatar._committed or stored != profile.avatar.name
+
+
+def use_avatar(name, count=1):
+    """
+    INSERT ... ON CONFLICT DO UPDATE of the reference count of the file,
+    parallel uploads of the same image can't lose a reference.
+    """
+    qn = connection.ops.quote_name
+    sql = ('INSERT INTO {table} ({name}, {refcount}, {released}) VALUES (%s, %s, NULL) '
+           'ON CONFLICT ({name}) DO UPDATE SET {refcount} = {table}.{refcount} + %s, {released} = NULL').format(
+        table=qn(AvatarFile._meta.db_table), name=qn('name'), refcount=qn('refcount'), released=qn('released'))
+    with connection.cursor() as cursor:
+        cursor.execute(sql, [name, count, count])
+
+
+def release_avatar(name, count=1):
+    # one UPDATE, the time it is unused from is kept for collect_avatars
+    now = Value(timezone.now(), output_field=DateTimeField())
+    AvatarFile.objects.filter(name=name, refcount__gt=0).update(
+        refcount=Greatest(F('refcount') - count, 0),
+        released=Case(When(refcount__lte=count, then=now), default=F('released')))
+
+
+def replace_avatar(old, new):
+    if old == new:
+        return
+    if new:
+        use_avatar(new)
+    if old:
+        release_avatar(old)
+
+
+def known_thumbnails(name):
+    # thumbnails of the same file used by another profile
+    return (Profile.objects.filter(avatar=name).exclude(avatar_thumbnails={})
+            .values_list('avatar_thumbnails', flat=True).first())
+
+
+def save_thumbnails(profile_id, name, thumbnails):
+    # nothing is saved if the avatar has been changed again meanwhile
+    profile = Profile.objects.filter(pk=profile_id, avatar=name).first()
+    if profile is None:
+        return False
+    profile.avatar_thumbnails = thumbnails
+    profile.save(update_fields=['avatar_thumbnails'])
+    return True
+
+
+def build_profile_thumbnails(profile_id, name):
+    thumbnails = known_thumbnails(name)
+    if thumbnails:
+        return save_thumbnails(profile_id, name, thumbnails)
+    try:
+        thumbnails = make_thumbnails(name)
+    except THUMBNAIL_ERRORS:
+        # the original stays in use
+        return False
+    return save_thumbnails(profile_id, name, thumbnails)
+
+
+def schedule_thumbnails(profile_id, name):
+    # a task of the transaction of the save, the file and the row exist when it runs
+    enqueue(build_profile_thumbnails, profile_id, name)
+
+
+def profiles_updated(profiles):
+    # what signals would refresh after a save of [(pk, user_id), ...]: summaries, cards, cached profiles
+    profile_ids = [pk for pk, user_id in profiles]
+    refresh_summaries(profile_ids)
+    bump_card_version(*profile_ids)
+    for pk, user_id in profiles:
+        invalidate_current_profile(user_id)
+
+
+def update_thumbnails(thumbnails_by_name):
+    """
+    Saves {avatar name: thumbnails} to the profiles with these avatars, one UPDATE
+    per name. Returns the number of profiles.
+    """
+    profiles = list(Profile.objects.filter(avatar__in=list(thumbnails_by_name)).values_list('pk', 'user_id'))
+    with transaction.atomic():
+        for name, thumbnails in thumbnails_by_name.items():
+            Profile.objects.filter(avatar=name).update(avatar_thumbnails=thumbnails)
+    profiles_updated(profiles)
+    return len(profiles)
+
+
+def rehash_avatars():
+    """
+    Moves the avatars uploaded before content addressing to content addressed names,
+    byte-identical uploads become one file. The old files are left to collect_avatars,
+    thumbnails of the new names to build_thumbnails.
+    Returns {old name: new name} of the moved files.
+    """
+    storage = get_avatar_storage()
+    upload_to = Profile._meta.get_field('avatar').upload_to
+    names = Profile.objects.exclude(avatar='').values_list('avatar', flat=True).distinct().order_by()
+    moved = {}
+    for name in [name for name in names if not is_content_addressed(name)]:
+        try:
+            with storage.open(name, 'rb') as file:
+                new = storage.save(posixpath.join(upload_to, posixpath.basename(name)), file)
+        except OSError:
+            continue
+        with transaction.atomic():
+            profiles = list(Profile.objects.filter(avatar=name).values_list('pk', 'user_id'))
+            Profile.objects.filter(avatar=name).update(avatar=new, avatar_thumbnails=known_thumbnails(new) or {})
+            use_avatar(new, len(profiles))
+            release_avatar(name, len(profiles))
+        profiles_updated(profiles)
+        moved[name] = new
+    return moved
+
+
+def walk(storage, path):
+    # names of all files under the directory
+    try:
+        directories, files = storage.listdir(path)
+    except FileNotFoundError:
+        return
+    for file in files:
+        yield posixpath.join(path, file)
+    for directory in directories:
+        yield from walk(storage, posixpath.join(path, directory))
+
+
+def collect_avatars(grace=AVATAR_GC_GRACE, scan=(), dry_run=False):
+    """
+    Deletes the avatar files and their thumbnails which no profile has used for
+    ``grace`` seconds. Those are the counted files released before that, and with
+    ``scan`` (directories of the avatar storage) the files there without a count too:
+    uploads of a save which was rolled back, old uploads replaced before counting.
+    Returns the deleted names.
+    """
+    storage = get_avatar_storage()
+    cutoff = timezone.now() - timedelta(seconds=grace)
+    candidates = list(AvatarFile.objects.filter(refcount=0, released__lt=cutoff).values_list('name', flat=True))
+    if scan:
+        used = set(AvatarFile.objects.filter(refcount__gt=0).values_list('name', flat=True))
+        used.update(Profile.objects.exclude(avatar='').values_list('avatar', flat=True))
+        candidates += [name for directory in scan for name in walk(storage, directory)
+                       if name not in used and name not in candidates]
+    deleted = []
+    for name in candidates:
+        exists = storage.exists(name)
+        # modified: uploaded again since it was released
+        if exists and storage.get_modified_time(name) >= cutoff:
+            continue
+        if Profile.objects.filter(avatar=name).exists():
+            continue
+        if not dry_run:
+            AvatarFile.objects.filter(name=name, refcount=0).delete()
+            if exists:
+                storage.delete(name)
+            delete_thumbnails(name)
+        deleted.append(name)
+    return deleted
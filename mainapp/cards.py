@@ -0,0 +1,109 @@
+"""
+Cache of rendered profile cards.
+
+Every profile has a version key, signals bump it when anything shown on the card
+changes (renamed countries, languages and tags in the background task
+``summaries.rebuild_renamed_summaries``). Cards are cached under the current
+version, so a bump makes the old ones unreachable and there is nothing to delete. Online status and "last seen" change
+every minute and stay out of the cached part.
+"""
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.template.loader import render_to_string
+from django.utils.safestring import mark_safe
+
+from .models import Profile
+
+# ages in cards become stale once a year, a day is short enough
+CARD_CACHE_TIMEOUT = getattr(settings, 'CARD_CACHE_TIMEOUT', 60 * 60 * 24)
+
+CARD_TEMPLATES = {'small': 'mainapp/profile-card-small.html'}
+
+HITS_KEY = 'profile-card-hits'
+MISSES_KEY = 'profile-card-misses'
+
+
+def version_key(profile_id):
+    return 'profile-card-version-%s' % profile_id
+
+
+def card_key(kind, profile_id, version):
+    return 'profile-card-{}-{}-{}'.format(kind, profile_id, version)
+
+
+def new_version():
+    # never repeats, so a lost version key can't bring back an old card
+    return time.time_ns()
+
+
+def bump_card_version(*profile_ids):
+    cache.set_many({version_key(pk): new_version() for pk in profile_ids}, None)
+
+
+def get_versions(profile_ids):
+    keys = {pk: version_key(pk) for pk in profile_ids}
+    found = cache.get_many(keys.values())
+    versions = {}
+    missing = {}
+    for pk, key in keys.items():
+        if key in found:
+            versions[pk] = found[key]
+        else:
+            versions[pk] = missing[key] = new_version()
+    if missing:
+        cache.set_many(missing, None)
+    return versions
+
+
+def incr_counter(key, delta):
+    if not delta:
+        return
+    try:
+        cache.incr(key, delta)
+    except ValueError:
+        if not cache.add(key, delta, None):
+            cache.incr(key, delta)
+
+
+def render_cards(profile_ids, kind='small'):
+    """
+    Rendered cards of ``profile_ids`` in the same order.
+    Cached cards come with one get_many, missing ones are fetched in one bulk query.
+    """
+    versions = get_versions(profile_ids)
+    keys = {pk: card_key(kind, pk, version) for pk, version in versions.items()}
+    cards = cache.get_many(keys.values())
+
+    missing = [pk for pk in profile_ids if keys[pk] not in cards]
+    if missing:
+        rendered = {}
+        for profile in Profile.objects.for_cards().filter(pk__in=missing):
+            rendered[keys[profile.pk]] = render_to_string(CARD_TEMPLATES[kind], {'profile': profile})
+        cache.set_many(rendered, CARD_CACHE_TIMEOUT)
+        cards.update(rendered)
+
+    incr_counter(HITS_KEY, len(profile_ids) - len(missing))
+    incr_counter(MISSES_KEY, len(missing))
+    return [mark_safe(cards.get(keys[pk], '')) for pk in profile_ids]
+
+
+def with_cards(profiles, kind='small'):
+    """
+    [(profile, card html), ...] for templates
+    """
+    profiles = list(profiles)
+    return list(zip(profiles, render_cards([profile.pk for profile in profiles], kind)))
+
+
+def card_cache_stats():
+    stats = cache.get_many([HITS_KEY, MISSES_KEY])
+    hits = stats.get(HITS_KEY, 0)
+    misses = stats.get(MISSES_KEY, 0)
+    total = hits + misses
+    return {'hits': hits, 'misses': misses, 'hit_rate': hits / total if total else 0.0}
+
+
+def reset_card_cache_stats():
+    cache.delete_many([HITS_KEY, MISSES_KEY])
@@ -0,0 +1,289 @@
+"""
+WebSocket chat between partners (profiles with an accepted Partner row).
+
+A connection to ``/ws/chat/<profile id>/`` joins the conversation of the
+logged in profile with that partner. Every text frame ``{"text": ...}`` is
+published to the conversation's group of the channel layer (gotalk.chat_layers)
+and comes back to the connections of both profiles as
+``{"sender": id, "text": ..., "created": iso time}``, ``ref`` of the frame is
+passed through so a client can match its own messages.
+
+Messages are persisted by MessageWriter: buffered in memory and written with
+one bulk_create every CHAT_FLUSH_INTERVAL seconds or CHAT_FLUSH_SIZE messages,
+the unread counters of the batch are raised in the same transaction
+(mainapp.conversations.save_messages).
+
+Partnership is checked when a connection opens and again by every flush: messages
+of profiles which aren't partners any more are not saved and their connections
+are closed with 4403, as a connection which isn't allowed.
+
+Backpressure: a connection has a queue of at most CHAT_QUEUE_SIZE messages
+waiting to be sent. A client which can't keep up is disconnected with code
+1013 (try again later) instead of growing the queue, it reconnects and reads
+what it missed from the history.
+
+No Channels: ChatApplication is a plain ASGI application, gotalk.asgi routes
+websocket connections to it.
+"""
+import asyncio
+import json
+import logging
+import re
+from collections import defaultdict
+from importlib import import_module
+from types import SimpleNamespace
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib import auth
+from django.db import DatabaseError
+from django.http import parse_cookie
+from django.http.request import split_domain_port, validate_host
+from django.utils import timezone
+
+from gotalk.chat_layers import get_channel_layer
+from gotalk.db import close_old_connections
+
+from .conversations import open_conversation, save_messages, unread_field
+from .models import Message, Profile
+
+CHAT_QUEUE_SIZE = getattr(settings, 'CHAT_QUEUE_SIZE', 100)
+CHAT_FLUSH_INTERVAL = getattr(settings, 'CHAT_FLUSH_INTERVAL', 0.5)
+CHAT_FLUSH_SIZE = getattr(settings, 'CHAT_FLUSH_SIZE', 500)
+CHAT_MAX_LENGTH = Message._meta.get_field('text').max_length
+
+CHAT_PATH = re.compile(r'^/ws/chat/(?P<profile_id>\d+)/$')
+CLOSE_FORBIDDEN = 4403
+CLOSE_NOT_FOUND = 4404
+CLOSE_TRY_AGAIN_LATER = 1013
+
+logger = logging.getLogger(__name__)
+
+
+def database_sync_to_async(func):
+    # a websocket lives longer than a request, stale connections are closed as request_finished does
+    def run(*args, **kwargs):
+        close_old_connections()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            close_old_connections()
+    return sync_to_async(run)
+
+
+def conversation_group(a, b):
+    return 'chat-{}-{}'.format(min(a, b), max(a, b))
+
+
+class MessageWriter:
+    """
+    Buffers messages and writes them with one bulk_create every ``interval``
+    seconds, at once when ``size`` messages are waiting.
+    ``on_ended(conversation ids)`` is called for conversations of profiles which
+    aren't partners any more, their messages are dropped.
+    """
+    def __init__(self, interval=CHAT_FLUSH_INTERVAL, size=CHAT_FLUSH_SIZE, on_ended=None):
+        self.interval = interval
+        self.size = size
+        self.on_ended = on_ended
+        self.buffer = []
+        self.timer = None
+        self.flushing = False
+        self.tasks = set()
+        self.written = 0
+        self.flushes = 0
+
+    def add(self, conversation_id, sender_id, text, created, unread_field):
+        # rows are kept as tuples, models are made in the writing thread, not in the event loop
+        self.buffer.append((conversation_id, sender_id, text, created, unread_field))
+        if len(self.buffer) >= self.size:
+            if not self.flushing:
+                self.flush_soon()
+        elif self.timer is None:
+            self.timer = asyncio.get_running_loop().call_later(self.interval, self.flush_soon)
+
+    def flush_soon(self):
+        self.flushing = True
+        task = asyncio.ensure_future(self.flush())
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+    async def flush(self):
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+        self.flushing = False
+        batch, self.buffer = self.buffer, []
+        if not batch:
+            return 0
+        try:
+            ended = await database_sync_to_async(save_messages)(batch, batch_size=self.size)
+        except DatabaseError:
+            # e.g. a profile was deleted meanwhile, the connections have got the messages anyway
+            logger.exception('%s chat messages were not saved', len(batch))
+            return 0
+        if ended and self.on_ended:
+            self.on_ended(ended)
+        written = sum(1 for row in batch if row[0] not in ended)
+        self.written += written
+        self.flushes += 1
+        return written
+
+    async def close(self):
+        await self.flush()
+        if self.tasks:
+            await asyncio.gather(*self.tasks)
+
+
+class ChatConnection:
+    def __init__(self, app, send, profile_id, partner_id, conversation_id):
+        self.app = app
+        self.send = send
+        self.profile_id = profile_id
+        self.partner_id = partner_id
+        self.conversation_id = conversation_id
+        # the partner's counter goes up with every message of this connection
+        self.unread_field = unread_field(partner_id, profile_id)
+        self.group = conversation_group(profile_id, partner_id)
+        self.queue = asyncio.Queue(app.queue_size)
+        self.closing = False
+
+    def deliver(self, message):
+        # called by the channel layer with a JSON string, never waits
+        if self.closing:
+            return
+        try:
+            self.queue.put_nowait(message)
+        except asyncio.QueueFull:
+            # slow consumer: its backlog is dropped and it is disconnected
+            self.app.dropped += 1
+            self.close(CLOSE_TRY_AGAIN_LATER)
+
+    def close(self, code):
+        # the backlog is dropped, the sender closes the websocket with ``code``
+        if self.closing:
+            return
+        self.closing = True
+        while not self.queue.empty():
+            self.queue.get_nowait()
+        self.queue.put_nowait(code)
+
+    async def sender(self):
+        while True:
+            message = await self.queue.get()
+            if isinstance(message, int):
+                await self.send({'type': 'websocket.close', 'code': message})
+                return
+            await self.send({'type': 'websocket.send', 'text': message})
+
+    async def receive_text(self, text):
+        try:
+            data = json.loads(text)
+            body = data['text'].strip()
+        except (ValueError, TypeError, KeyError, AttributeError):
+            self.deliver(json.dumps({'error': 'Expected {"text": "..."}'}))
+            return
+        if not body or len(body) > CHAT_MAX_LENGTH:
+            self.deliver(json.dumps({'error': 'A message is 1 to %s characters long' % CHAT_MAX_LENGTH}))
+            return
+        created = timezone.now()
+        self.app.writer.add(self.conversation_id, self.profile_id, body, created, self.unread_field)
+        payload = {'sender': self.profile_id, 'text': body, 'created': created.isoformat()}
+        if 'ref' in data:
+            payload['ref'] = data['ref']
+        # encoded once for all the connections of the group
+        await self.app.layer.publish(self.group, json.dumps(payload))
+
+    async def run(self, receive):
+        await self.send({'type': 'websocket.accept'})
+        await self.app.layer.subscribe(self.group, self)
+        self.app.connections[self.conversation_id].add(self)
+        sender = asyncio.ensure_future(self.sender())
+        try:
+            while True:
+                event = await receive()
+                if event['type'] == 'websocket.disconnect':
+                    break
+                if event['type'] == 'websocket.receive' and not self.closing:
+                    await self.receive_text(event.get('text') or (event.get('bytes') or b'').decode('utf-8', 'replace'))
+        finally:
+            connections = self.app.connections[self.conversation_id]
+            connections.discard(self)
+            if not connections:
+                del self.app.connections[self.conversation_id]
+            await self.app.layer.unsubscribe(self.group, self)
+            sender.cancel()
+
+
+class ChatApplication:
+    """
+    ASGI application of ``/ws/chat/<profile id>/``, the connecting profile is
+    ``scope['profile_id']`` set by SessionAuthMiddleware.
+    """
+    def __init__(self, layer=None, writer=None, queue_size=CHAT_QUEUE_SIZE):
+        self.layer = layer or get_channel_layer()
+        self.writer = writer or MessageWriter()
+        self.writer.on_ended = self.end_conversations
+        self.queue_size = queue_size
+        self.dropped = 0     # slow consumers disconnected
+        # conversation id -> its connections to this process
+        self.connections = defaultdict(set)
+
+    def end_conversations(self, conversation_ids):
+        # the profiles aren't partners any more, found by a flush of the writer
+        for conversation_id in conversation_ids:
+            for connection in list(self.connections.get(conversation_id, ())):
+                connection.close(CLOSE_FORBIDDEN)
+
+    async def __call__(self, scope, receive, send):
+        event = await receive()
+        if event['type'] != 'websocket.connect':
+            return
+        match = CHAT_PATH.match(scope['path'])
+        if match is None:
+            await send({'type': 'websocket.close', 'code': CLOSE_NOT_FOUND})
+            return
+        profile_id, partner_id = scope.get('profile_id'), int(match['profile_id'])
+        conversation_id = None
+        if profile_id is not None:
+            conversation_id = await database_sync_to_async(open_conversation)(profile_id, partner_id)
+        if conversation_id is None:
+            await send({'type': 'websocket.close', 'code': CLOSE_FORBIDDEN})
+            return
+        await ChatConnection(self, send, profile_id, partner_id, conversation_id).run(receive)
+
+    async def close(self):
+        await self.writer.close()
+        await self.layer.close()
+
+
+def session_profile_id(scope):
+    """
+    Profile id of the user logged in by the session cookie of a websocket handshake, or None.
+    Browsers send cookies to websockets of any origin, so the origin must be one of ALLOWED_HOSTS.
+    """
+    headers = {name.decode('latin1').lower(): value.decode('latin1') for name, value in scope.get('headers', ())}
+    origin = headers.get('origin', '').split('://', 1)[-1]
+    allowed_hosts = settings.ALLOWED_HOSTS
+    if settings.DEBUG and not allowed_hosts:
+        # as HttpRequest.get_host() does
+        allowed_hosts = ['.localhost', '127.0.0.1', '[::1]']
+    if not origin or not validate_host(split_domain_port(origin)[0], allowed_hosts):
+        return None
+    cookies = parse_cookie(headers.get('cookie', ''))
+    session = import_module(settings.SESSION_ENGINE).SessionStore(cookies.get(settings.SESSION_COOKIE_NAME))
+    user = auth.get_user(SimpleNamespace(session=session))
+    if not user.is_authenticated:
+        return None
+    return Profile.objects.filter(user_id=user.pk).values_list('pk', flat=True).first()
+
+
+class SessionAuthMiddleware:
+    # sets scope['profile_id'] of websocket connections from the session cookie
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'websocket':
+            scope = dict(scope, profile_id=await database_sync_to_async(session_profile_id)(scope))
+        return await self.app(scope, receive, send)
@@ -0,0 +1,107 @@
+"""
+Conversations of partners: message history and unread counters.
+
+A conversation is the (min_profile, max_profile) pair of two partners, created
+when one of them opens the chat. History is read backwards by the
+(conversation, created, id) index (mainapp.pagination.paginate_backwards), a page
+costs the same at any depth. Unread messages are counters on the Conversation row:
+increased with every saved batch of messages, reset when the profile reads the
+conversation, so an unread badge never counts messages.
+
+The history is read by partners only: after unpartnering (partners.reject_request)
+the conversation stays, but neither side can read it or write to it until they
+are partners again.
+"""
+from collections import Counter, defaultdict
+
+from django.db import transaction
+from django.db.models import Case, Exists, F, OuterRef, Q, When
+
+from . import partners
+from .models import Conversation, Message, Partner
+
+
+def conversation_key(a, b):
+    return (a, b) if a < b else (b, a)
+
+
+def unread_field(profile_id, partner_id):
+    # counter of the messages ``profile_id`` hasn't read
+    return 'unread_min' if profile_id < partner_id else 'unread_max'
+
+
+def accepted_rows(a, b):
+    return Partner.objects.filter(partners.pair_q(a, b), response_date__isnull=False)
+
+
+def partners_now(a, b):
+    # Exists() of the accepted Partner row of the pair, checked by the query which uses the conversation
+    return Exists(accepted_rows(a, b))
+
+
+def get_conversation(profile_id, partner_id):
+    # conversation of two current partners, the partner rows are checked by the same query
+    a, b = conversation_key(profile_id, partner_id)
+    return Conversation.objects.filter(partners_now(a, b), min_profile_id=a, max_profile_id=b).first()
+
+
+def open_conversation(profile_id, partner_id):
+    """
+    Id of the conversation of two partners, created on the first use.
+    None if they aren't partners.
+    """
+    a, b = conversation_key(profile_id, partner_id)
+    if a == b or not accepted_rows(a, b).exists():
+        return None
+    conversation, _ = Conversation.objects.get_or_create(min_profile_id=a, max_profile_id=b)
+    return conversation.pk
+
+
+def save_messages(rows, batch_size=None):
+    """
+    Writes [(conversation id, sender id, text, created, unread field of the recipient), ...]
+    with one bulk_create and raises the unread counters by one UPDATE per distinct
+    (field, number of messages), usually a handful for a batch of hundreds of conversations.
+    Messages of conversations whose profiles aren't partners any more are dropped,
+    returns the ids of those conversations.
+    """
+    with transaction.atomic():
+        ids = {row[0] for row in rows}
+        current = set(Conversation.objects
+                      .filter(partners_now(OuterRef('min_profile_id'), OuterRef('max_profile_id')),
+                              pk__in=ids)
+                      .values_list('pk', flat=True))
+        rows = [row for row in rows if row[0] in current]
+        counts = Counter((conversation_id, field) for conversation_id, sender_id, text, created, field in rows)
+        groups = defaultdict(list)
+        for (conversation_id, field), count in counts.items():
+            groups[field, count].append(conversation_id)
+        Message.objects.bulk_create([Message(conversation_id=conversation_id, sender_id=sender_id,
+                                             text=text, created=created)
+                                     for conversation_id, sender_id, text, created, field in rows],
+                                    batch_size=batch_size)
+        for (field, count), conversation_ids in groups.items():
+            Conversation.objects.filter(pk__in=conversation_ids).update(**{field: F(field) + count})
+    return ids - current
+
+
+def mark_read(profile_id, partner_id):
+    # False unless they are partners, as get_conversation
+    a, b = conversation_key(profile_id, partner_id)
+    field = unread_field(profile_id, partner_id)
+    return bool(Conversation.objects.filter(partners_now(a, b), min_profile_id=a, max_profile_id=b)
+                .update(**{field: 0}))
+
+
+def unread_counts(profile_id):
+    """
+    [{'profile': partner id, 'unread': messages the profile hasn't read}, ...]
+    of all conversations of the profile, one query over the counters
+    """
+    mine = Q(min_profile_id=profile_id)
+    return list(Conversation.objects
+                .filter(mine | Q(max_profile_id=profile_id))
+                .annotate(profile=Case(When(mine, then=F('max_profile_id')), default=F('min_profile_id')),
+                          unread=Case(When(mine, then=F('unread_min')), default=F('unread_max')))
+                .order_by('-unread', 'profile')
+                .values('profile', 'unread'))
@@ -0,0 +1,34 @@
+from django.conf import settings
+from django.core.cache import cache
+
+from .models import Profile
+
+PROFILE_CACHE_TIMEOUT = getattr(settings, 'PROFILE_CACHE_TIMEOUT', 60)
+
+
+def profile_cache_key(user_id):
+    return 'profile-of-user-%s' % user_id
+
+
+def get_current_profile(user):
+    """
+    Profile of the logged in ``user`` or None.
+    Cached by user id for PROFILE_CACHE_TIMEOUT seconds, signals drop it on save/delete.
+    """
+    if not user.is_authenticated:
+        return None
+    key = profile_cache_key(user.pk)
+    profile = cache.get(key)
+    if profile is None:
+        try:
+            profile = Profile.objects.get(user_id=user.pk)
+        except Profile.DoesNotExist:
+            return None
+        cache.set(key, profile, PROFILE_CACHE_TIMEOUT)
+    # the user is already loaded by the auth middleware
+    profile.user = user
+    return profile
+
+
+def invalidate_current_profile(user_id):
+    cache.delete(profile_cache_key(user_id))
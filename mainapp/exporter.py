@@ -0,0 +1,103 @@
+"""
+Streaming export of profiles with their languages, tags and partners.
+
+Profiles are read as values() tuples through a server side cursor
+(``.iterator(chunk_size)``), related rows are fetched once per chunk,
+so memory doesn't grow with the table. The CSV layout is the one
+``load_profiles`` reads.
+"""
+import csv
+from collections import defaultdict
+from itertools import islice
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Q
+
+from .importer import LIST_SEPARATOR
+from .models import LanguageLevel, Partner, Profile
+
+EXPORT_CHUNK_SIZE = getattr(settings, 'EXPORT_CHUNK_SIZE', 2000)
+
+PROFILE_FIELDS = ('pk', 'user__username', 'user__email', 'user__first_name', 'user__last_name',
+                  'date_of_birth', 'gender', 'phone', 'country__name')
+COLUMNS = ('id', 'username', 'email', 'first_name', 'last_name',
+           'date_of_birth', 'gender', 'phone', 'country',
+           'native_in', 'study', 'tags', 'partners', 'requested')
+
+
+def group(rows):
+    grouped = defaultdict(list)
+    for profile_id, *value in rows:
+        grouped[profile_id].append(value[0] if len(value) == 1 else tuple(value))
+    return grouped
+
+
+def related_rows(profile_ids):
+    native_in = group(Profile.native_in.through.objects.filter(profile_id__in=profile_ids)
+                      .values_list('profile_id', 'language__name'))
+    study = group(LanguageLevel.objects.filter(profile_id__in=profile_ids)
+                  .values_list('profile_id', 'language__name', 'level'))
+    tags = group(Profile.tags.through.objects.filter(profile_id__in=profile_ids)
+                 .values_list('profile_id', 'tag__tag'))
+    partners = defaultdict(list)
+    requested = defaultdict(list)
+    links = (Partner.objects.filter(Q(follower_id__in=profile_ids) | Q(followed_id__in=profile_ids))
+             .values_list('follower_id', 'followed_id', 'response_date'))
+    for follower_id, followed_id, response_date in links:
+        if response_date is not None:
+            partners[follower_id].append(followed_id)
+            partners[followed_id].append(follower_id)
+        else:
+            requested[follower_id].append(followed_id)
+    return native_in, study, tags, partners, requested
+
+
+def export_rows(chunk_size=EXPORT_CHUNK_SIZE):
+    """
+    Yields a dict per profile, ordered by id.
+    """
+    profiles = Profile.objects.order_by('pk').values_list(*PROFILE_FIELDS).iterator(chunk_size=chunk_size)
+    while True:
+        chunk = list(islice(profiles, chunk_size))
+        if not chunk:
+            return
+        native_in, study, tags, partners, requested = related_rows([row[0] for row in chunk])
+        for row in chunk:
+            data = dict(zip(COLUMNS, row))
+            pk = data['id']
+            data['native_in'] = native_in.get(pk, [])
+            data['study'] = dict(study.get(pk, []))
+            data['tags'] = tags.get(pk, [])
+            data['partners'] = sorted(set(partners.get(pk, [])))
+            data['requested'] = requested.get(pk, [])
+            yield data
+
+
+def render_jsonl(rows):
+    encoder = DjangoJSONEncoder()
+    for row in rows:
+        yield encoder.encode(row) + '\n'
+
+
+class Echo:
+    # file-like object which returns what is written, for csv.writer
+    def write(self, value):
+        return value
+
+
+def render_csv(rows):
+    writer = csv.writer(Echo())
+    yield writer.writerow(COLUMNS)
+    for row in rows:
+        row = dict(row)
+        row['native_in'] = LIST_SEPARATOR.join(row['native_in'])
+        row['study'] = LIST_SEPARATOR.join('{}:{}'.format(name, level) for name, level in row['study'].items())
+        row['tags'] = LIST_SEPARATOR.join(row['tags'])
+        row['partners'] = LIST_SEPARATOR.join(str(pk) for pk in row['partners'])
+        row['requested'] = LIST_SEPARATOR.join(str(pk) for pk in row['requested'])
+        yield writer.writerow([row[column] if row[column] is not None else '' for column in COLUMNS])
+
+
+RENDERERS = {'jsonl': (render_jsonl, 'application/x-ndjson'),
+             'csv': (render_csv, 'text/csv')}
@@ -0,0 +1,110 @@
+import hashlib
+import time
+from datetime import date
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Case, CharField, Count, Value, When
+
+from .filters import AGE_GROUPS, filter_profiles, selected_filters, years_ago
+from .models import LanguageLevel, Profile
+
+FACETS_TIMEOUT = getattr(settings, 'FACETS_TIMEOUT', 60 * 5)
+# facets are cached under this version, summaries.create_summaries/refresh_summaries
+# and profile deletes bump it, so cached counts never disagree with the listed rows
+FACETS_VERSION_KEY = 'profile-facets-version'
+
+
+def age_group_case(today=None):
+    """
+    SQL expression putting a profile into one of AGE_GROUPS by its date_of_birth.
+    Somebody is not older than ``age`` while born after ``age + 1`` years ago.
+    """
+    today = today or date.today()
+    whens = [When(date_of_birth__gt=years_ago(today, age + 1), then=Value(label))
+             for label, age in AGE_GROUPS if age is not None]
+    return Case(*whens, default=Value(AGE_GROUPS[-1][0]), output_field=CharField())
+
+
+def language_facet(profile_ids):
+    rows = (LanguageLevel.objects
+            .filter(profile__in=profile_ids)
+            .values('language__name')
+            .annotate(count=Count('profile', distinct=True))
+            .order_by('language__name'))
+    return [{'value': row['language__name'], 'label': row['language__name'], 'count': row['count']}
+            for row in rows]
+
+
+def tag_facet(profile_ids):
+    rows = (Profile.tags.through.objects
+            .filter(profile__in=profile_ids)
+            .values('tag__tag')
+            .annotate(count=Count('profile', distinct=True))
+            .order_by('tag__tag'))
+    return [{'value': row['tag__tag'], 'label': row['tag__tag'], 'count': row['count']}
+            for row in rows]
+
+
+def gender_facet(queryset):
+    counts = dict(queryset.order_by().values_list('gender').annotate(count=Count('pk')))
+    return [{'value': value, 'label': label, 'count': counts[value]}
+            for value, label in Profile.GENDER_CHOICES if counts.get(value)]
+
+
+def age_group_facet(queryset):
+    counts = dict(queryset.order_by()
+                  .filter(date_of_birth__isnull=False)
+                  .annotate(age_group=age_group_case())
+                  .values_list('age_group')
+                  .annotate(count=Count('pk')))
+    return [{'value': label, 'label': label, 'count': counts[label]}
+            for label, age in AGE_GROUPS if counts.get(label)]
+
+
+def compute_facets(queryset, params):
+    # every facet is counted with all filters applied but its own,
+    # so the choices of an already filtered facet don't disappear
+    def filtered(exclude):
+        return filter_profiles(queryset, params, exclude=exclude)
+
+    return {'languages': language_facet(filtered('language').order_by().values('pk')),
+            'tags': tag_facet(filtered('tag').order_by().values('pk')),
+            'genders': gender_facet(filtered('gender')),
+            'age_groups': age_group_facet(filtered('age_group'))}
+
+
+def facets_version():
+    version = cache.get(FACETS_VERSION_KEY)
+    if version is None:
+        version = time.time_ns()
+        if not cache.add(FACETS_VERSION_KEY, version, None):
+            version = cache.get(FACETS_VERSION_KEY, version)
+    return version
+
+
+def invalidate_facets():
+    # never repeats, as the versions of profile cards
+    cache.set(FACETS_VERSION_KEY, time.time_ns(), None)
+
+
+def facets_cache_key(params, version):
+    items = ['{}={}'.format(key, ','.join(sorted(values)))
+             for key, values in sorted(selected_filters(params).items()) if values]
+    digest = hashlib.md5('&'.join(items).encode()).hexdigest()
+    return 'profile-facets-{}-{}'.format(version, digest)
+
+
+def get_facets(queryset, params=None):
+    """
+    Facet counts for the whole ``queryset`` (ProfileSummary rows, what the index lists)
+    filtered by the query string ``params``, one aggregate query per facet.
+    Cached per filter combination until the summaries change.
+    """
+    params = params or {}
+    key = facets_cache_key(params, facets_version())
+    facets = cache.get(key)
+    if facets is None:
+        facets = compute_facets(queryset, params)
+        cache.set(key, facets, FACETS_TIMEOUT)
+    return facets
@@ -0,0 +1,101 @@
+from datetime import date
+
+from django.db.models import Exists, OuterRef, Q
+
+from .models import LanguageLevel, Profile
+
+FILTER_PARAMS = ('gender', 'age_group', 'language', 'tag', 'min_age', 'max_age')
+
+# (label, oldest age in the group), youngest group first
+AGE_GROUPS = (('<25', 25),
+              ('25-35', 35),
+              ('35-45', 45),
+              ('45-60', 60),
+              ('60+', None))
+AGE_GROUP_LABELS = [label for label, max_age in AGE_GROUPS]
+
+
+def years_ago(today, years):
+    try:
+        return today.replace(year=today.year - years)
+    except ValueError:
+        # 29 February in a non-leap year
+        return today.replace(year=today.year - years, day=28)
+
+
+def get_param_list(params, key):
+    if hasattr(params, 'getlist'):
+        values = params.getlist(key)
+    else:
+        values = params.get(key, [])
+        if isinstance(values, str):
+            values = [values]
+    return [value for value in values if value]
+
+
+def get_param_int(params, key):
+    try:
+        return int(params.get(key))
+    except (TypeError, ValueError):
+        return None
+
+
+def age_range_q(min_age=None, max_age=None, today=None):
+    # somebody is at least ``min_age`` years old while born before ``min_age`` years ago
+    # and isn't older than ``max_age`` while born after ``max_age + 1`` years ago
+    today = today or date.today()
+    q = Q()
+    if min_age is not None:
+        q &= Q(date_of_birth__lte=years_ago(today, min_age))
+    if max_age is not None:
+        q &= Q(date_of_birth__gt=years_ago(today, max_age + 1))
+    return q
+
+
+def age_groups_q(labels, today=None):
+    q = Q()
+    min_age = None
+    for label, max_age in AGE_GROUPS:
+        if label in labels:
+            q |= age_range_q(min_age, max_age, today)
+        min_age = max_age + 1 if max_age is not None else None
+    return q
+
+
+def selected_filters(params):
+    return {key: get_param_list(params, key) for key in FILTER_PARAMS}
+
+
+def filter_profiles(queryset, params, exclude=None):
+    """
+    Filters profiles by the index sidebar query string:
+    ?gender=f&age_group=25-35&language=English&tag=Youtube&min_age=18&max_age=30
+
+    Several values of one param match any of them. Languages and tags are
+    checked with EXISTS subqueries, so there is no join to ``.distinct()`` away.
+    ``exclude`` skips one param, this is how facets count the other choices.
+    """
+    genders = get_param_list(params, 'gender')
+    if genders and exclude != 'gender':
+        queryset = queryset.filter(gender__in=genders)
+
+    age_groups = get_param_list(params, 'age_group')
+    # all the groups are no filter, not "has a date of birth"
+    if age_groups and exclude != 'age_group' and not set(AGE_GROUP_LABELS) <= set(age_groups):
+        queryset = queryset.filter(age_groups_q(age_groups))
+
+    min_age = get_param_int(params, 'min_age')
+    max_age = get_param_int(params, 'max_age')
+    if min_age is not None or max_age is not None:
+        queryset = queryset.filter(age_range_q(min_age, max_age))
+
+    languages = get_param_list(params, 'language')
+    if languages and exclude != 'language':
+        queryset = queryset.filter(Exists(LanguageLevel.objects.filter(profile=OuterRef('pk'),
+                                                                       language__name__in=languages)))
+
+    tags = get_param_list(params, 'tag')
+    if tags and exclude != 'tag':
+        queryset = queryset.filter(Exists(Profile.tags.through.objects.filter(profile=OuterRef('pk'),
+                                                                              tag__tag__in=tags)))
+    return queryset
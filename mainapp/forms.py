@@ -21,7 +21,7 @@ class RegisterUserForm(UserCreationForm):
 class ProfileEditForm(ModelForm):
     class Meta:
         model = Profile
-        exclude = ['user', 'study']
+        exclude = ['user', 'study', 'avatar_thumbnails']
 
 
 class LanguageLevelForm(ModelForm):
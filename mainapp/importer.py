@@ -0,0 +1,287 @@
+"""
+Bulk import of users with their profiles, languages and tags.
+
+Input rows (CSV columns or JSONL keys):
+    username, email, first_name, last_name, password,
+    date_of_birth (YYYY-MM-DD), gender (m/f/n), phone, country (abbreviation or name),
+    native_in  - languages, "English;Greek" in CSV or a list in JSONL
+    study      - language:level pairs, "English:B1;Greek:A2" in CSV, {"English": "B1"} or a list in JSONL
+    tags       - tag names, "Tennis;Youtube" in CSV or a list in JSONL
+
+Rows are inserted by batches with bulk_create inside one transaction per batch,
+so no post_save signals (post_save_create_profile, cards, ...) run per row,
+profile summaries of the batch are written at once.
+Unknown languages are created, unknown tags are created in the ``tag_area`` area,
+a missing or unknown level is A1.
+
+Invalid rows (unreadable JSON, bad dates, phones which are taken, ...) are checked
+before anything of their batch is inserted, they are skipped and reported to
+``error(row number, message)``; one bad row doesn't fail its batch.
+
+Every password is hashed with its own salt, ~100ms a row by design. With
+``processes`` > 1 the passwords of a batch are hashed by a pool of processes.
+Rows without a password get an unusable one, which costs nothing.
+"""
+import csv
+import json
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.db import connections, transaction
+from django.utils.dateparse import parse_date
+
+from .models import Country, Language, LanguageLevel, Profile, Tag, TagsArea
+from .summaries import create_summaries
+
+LIST_SEPARATOR = ';'
+LEVELS = {level for level, name in LanguageLevel.LEVEL_CHOICES}
+GENDERS = {gender for gender, name in Profile.GENDER_CHOICES}
+USER_FIELDS = ('username', 'email', 'first_name', 'last_name')
+LANGUAGE_LENGTH = Language._meta.get_field('name').max_length
+TAG_LENGTH = Tag._meta.get_field('tag').max_length
+
+
+class RowError(ValueError):
+    pass
+
+
+def read_rows(file, fmt):
+    # dicts, or a RowError for a line which can't be read
+    if fmt == 'csv':
+        yield from csv.DictReader(file)
+    elif fmt == 'jsonl':
+        for line in file:
+            line = line.strip()
+            if line:
+                try:
+                    yield json.loads(line)
+                except ValueError as error:
+                    yield RowError('invalid JSON: %s' % error)
+    else:
+        raise ValueError('Unknown format: %s' % fmt)
+
+
+def as_list(value, key, max_length=None):
+    if not value:
+        return []
+    if isinstance(value, str):
+        value = [item.strip() for item in value.split(LIST_SEPARATOR) if item.strip()]
+    if not isinstance(value, list) or not all(isinstance(item, str) and item for item in value):
+        raise RowError('%s must be a list of names' % key)
+    if max_length is not None and any(len(item) > max_length for item in value):
+        raise RowError('%s has a name longer than %s characters' % (key, max_length))
+    return value
+
+
+def as_levels(value):
+    # [(language name, level), ...]
+    if not value:
+        return []
+    if isinstance(value, dict):
+        items = list(value.items())
+    elif isinstance(value, str):
+        items = [item.partition(':')[::2] for item in as_list(value, 'study')]
+    elif isinstance(value, list) and all(isinstance(item, (list, tuple)) and 1 <= len(item) <= 2 for item in value):
+        items = [(item[0], item[1] if len(item) > 1 else None) for item in value]
+    else:
+        raise RowError('study must be language:level pairs')
+    pairs = []
+    for name, level in items:
+        if (not isinstance(name, str) or not name.strip() or len(name.strip()) > LANGUAGE_LENGTH
+                or not isinstance(level, (str, type(None)))):
+            raise RowError('invalid study pair: %r' % ((name, level),))
+        level = (level or '').strip().upper()
+        pairs.append((name.strip(), level if level in LEVELS else 'A1'))
+    return pairs
+
+
+def as_date(value):
+    if not value:
+        return None
+    try:
+        parsed = parse_date(value) if isinstance(value, str) else None
+    except ValueError:
+        # well formed, but not a date: 2000-02-30
+        parsed = None
+    if parsed is None:
+        raise RowError('invalid date_of_birth: %r' % value)
+    return parsed
+
+
+def as_text(row, key, max_length=None):
+    value = row.get(key) or ''
+    if not isinstance(value, str):
+        raise RowError('%s must be a string' % key)
+    if max_length is not None and len(value) > max_length:
+        raise RowError('%s is longer than %s characters' % (key, max_length))
+    return value
+
+
+class ProfileImporter:
+    def __init__(self, batch_size=1000, tag_area='Other', processes=1):
+        self.batch_size = batch_size
+        self.processes = processes
+        self.pool = None
+        self.tag_area_name = tag_area
+        self.tag_area = None
+        self.languages = dict(Language.objects.values_list('name', 'pk'))
+        self.tags = dict(Tag.objects.values_list('tag', 'pk'))
+        self.countries = {}
+        for pk, abbreviation, name in Country.objects.values_list('pk', 'abbreviation', 'name'):
+            self.countries[abbreviation.upper()] = pk
+            self.countries[name.lower()] = pk
+        self.created = 0
+        self.skipped = 0
+
+    def batches(self, rows):
+        rows = iter(rows)
+        while True:
+            batch = list(islice(rows, self.batch_size))
+            if not batch:
+                return
+            yield batch
+
+    def run(self, rows, progress=None, error=None):
+        """
+        Imports ``rows``, calls ``progress(created, skipped)`` after every batch
+        and ``error(row number, message)`` for every invalid row.
+        """
+        if self.processes > 1:
+            # forked hashers must not share the database connections of this process
+            connections.close_all()
+            self.pool = ProcessPoolExecutor(self.processes, mp_context=multiprocessing.get_context('fork'))
+        try:
+            for batch in self.batches(enumerate(rows, 1)):
+                with transaction.atomic():
+                    self.import_batch(batch, error)
+                if progress:
+                    progress(self.created, self.skipped)
+        finally:
+            if self.pool:
+                self.pool.shutdown()
+                self.pool = None
+        return self.created, self.skipped
+
+    def clean_row(self, row):
+        if isinstance(row, RowError):
+            raise row
+        if not isinstance(row, dict):
+            raise RowError('a row must be an object')
+        cleaned = {key: as_text(row, key, User._meta.get_field(key).max_length) for key in USER_FIELDS}
+        if not cleaned['username']:
+            raise RowError('username is missing')
+        password = row.get('password') or None
+        if password is not None and not isinstance(password, str):
+            raise RowError('password must be a string')
+        phone = as_text(row, 'phone', Profile._meta.get_field('phone').max_length).strip() or None
+        if phone is not None and not Profile.phoneNumberRegex.regex.match(phone):
+            raise RowError('invalid phone: %r' % phone)
+        country = as_text(row, 'country')
+        gender = as_text(row, 'gender') or 'n'
+        cleaned.update(password=password, phone=phone,
+                       date_of_birth=as_date(row.get('date_of_birth')),
+                       gender=gender if gender in GENDERS else 'n',
+                       country_id=self.countries.get(country.upper()) or self.countries.get(country.lower()),
+                       native_in=as_list(row.get('native_in'), 'native_in', LANGUAGE_LENGTH),
+                       study=as_levels(row.get('study')),
+                       tags=as_list(row.get('tags'), 'tags', TAG_LENGTH))
+        return cleaned
+
+    def hash_passwords(self, passwords):
+        # a salt of its own for every password, None is an unusable one (no hashing)
+        if self.pool is None:
+            return [make_password(password) for password in passwords]
+        chunksize = max(1, len(passwords) // (self.processes * 4))
+        return list(self.pool.map(make_password, passwords, chunksize=chunksize))
+
+    def language_ids(self, names):
+        missing = {name for name in names if name not in self.languages}
+        if missing:
+            Language.objects.bulk_create(Language(name=name) for name in missing)
+            self.languages.update(Language.objects.filter(name__in=missing).values_list('name', 'pk'))
+        return self.languages
+
+    def tag_ids(self, names):
+        missing = {name for name in names if name not in self.tags}
+        if missing:
+            if self.tag_area is None:
+                self.tag_area, created = TagsArea.objects.get_or_create(area=self.tag_area_name)
+            Tag.objects.bulk_create(Tag(tag=name, tag_area=self.tag_area) for name in missing)
+            self.tags.update(Tag.objects.filter(tag__in=missing).values_list('tag', 'pk'))
+        return self.tags
+
+    def import_batch(self, batch, error=None):
+        # [(row number, row), ...]
+        def invalid(number, message):
+            self.skipped += 1
+            if error:
+                error(number, message)
+
+        cleaned = []
+        for number, row in batch:
+            try:
+                cleaned.append((number, self.clean_row(row)))
+            except RowError as row_error:
+                invalid(number, str(row_error))
+        existing = set(User.objects.filter(username__in=[row['username'] for number, row in cleaned])
+                       .values_list('username', flat=True))
+        phones = set(Profile.objects.filter(phone__in=[row['phone'] for number, row in cleaned if row['phone']])
+                     .values_list('phone', flat=True))
+        rows = []
+        seen = set()
+        for number, row in cleaned:
+            username = row['username']
+            if username in existing or username in seen:
+                self.skipped += 1
+                continue
+            if row['phone'] in phones:
+                # unique, it would fail the bulk_create of the whole batch
+                invalid(number, 'phone %s is taken' % row['phone'])
+                continue
+            seen.add(username)
+            if row['phone']:
+                phones.add(row['phone'])
+            rows.append(row)
+        if not rows:
+            return
+
+        users = []
+        for row, password in zip(rows, self.hash_passwords([row['password'] for row in rows])):
+            user = User(**{key: row[key] for key in USER_FIELDS})
+            user.password = password
+            users.append(user)
+        User.objects.bulk_create(users)
+        user_ids = dict(User.objects.filter(username__in=[u.username for u in users]).values_list('username', 'pk'))
+
+        Profile.objects.bulk_create([Profile(user_id=user_ids[row['username']], date_of_birth=row['date_of_birth'],
+                                             gender=row['gender'], phone=row['phone'], country_id=row['country_id'])
+                                     for row in rows])
+        profile_ids = dict(Profile.objects.filter(user_id__in=user_ids.values()).values_list('user_id', 'pk'))
+
+        natives = {}
+        levels = {}
+        tags = {}
+        for row in rows:
+            profile_id = profile_ids[user_ids[row['username']]]
+            natives[profile_id] = row['native_in']
+            levels[profile_id] = row['study']
+            tags[profile_id] = row['tags']
+
+        languages = self.language_ids({name for names in natives.values() for name in names}
+                                      | {name for pairs in levels.values() for name, level in pairs})
+        tag_ids = self.tag_ids({name for names in tags.values() for name in names})
+
+        Profile.native_in.through.objects.bulk_create(
+            [Profile.native_in.through(profile_id=profile_id, language_id=languages[name])
+             for profile_id, names in natives.items() for name in set(names)])
+        LanguageLevel.objects.bulk_create(
+            [LanguageLevel(profile_id=profile_id, language_id=languages[name], level=level)
+             for profile_id, pairs in levels.items() for name, level in dict(pairs).items()])
+        Profile.tags.through.objects.bulk_create(
+            [Profile.tags.through(profile_id=profile_id, tag_id=tag_ids[name])
+             for profile_id, names in tags.items() for name in set(names)])
+        create_summaries(profile_ids.values())
+        self.created += len(rows)
@@ -0,0 +1,94 @@
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from asgiref.sync import ThreadSensitiveContext
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test import AsyncClient, Client, override_settings
+
+from mainapp.models import ProfileSummary
+
+# name, sync endpoint (DRF / View), async twin, see mainapp.async_views
+ENDPOINTS = (('profiles', '/api/v1/profiles/', '/api/async/profiles/'),
+             ('profile', '/api/v1/profiles/{id}/', '/api/async/profiles/{id}/'),
+             ('reference', '/api/v1/reference/languages/', '/api/async/reference/languages/'))
+
+
+class Command(BaseCommand):
+    # requests/sec with N concurrent clients: a threaded WSGI server vs one ASGI event loop,
+    # handlers are called in-process, --client-delay emulates slow mobile connections:
+    # under WSGI a worker thread waits for them, under ASGI the event loop does
+    # command:            python manage.py bench_asgi --concurrency 1 10 100 --threads 8
+    help = 'Benchmarks sync endpoints under WSGI against their async twins under ASGI'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 10, 100])
+        parser.add_argument('--requests', type=int, default=400, help='requests per endpoint and run')
+        parser.add_argument('--threads', type=int, default=8, help='worker threads of the WSGI server')
+        parser.add_argument('--client-delay', type=float, default=20, help='ms a request holds its connection')
+
+    def run_wsgi(self, url, concurrency):
+        local = threading.local()
+        delay = self.client_delay
+
+        def request(_):
+            if not hasattr(local, 'client'):
+                local.client = Client(HTTP_ACCEPT='application/json')
+            time.sleep(delay)
+            response = local.client.get(url)
+            assert response.status_code == 200, response.status_code
+
+        def close(_):
+            connection.close()
+
+        workers = min(concurrency, self.threads)
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            start = time.perf_counter()
+            list(pool.map(request, range(self.requests)))
+            elapsed = time.perf_counter() - start
+            list(pool.map(close, range(workers)))
+        return self.requests / elapsed
+
+    def run_asgi(self, url, concurrency):
+        client = AsyncClient()
+        delay = self.client_delay
+
+        async def clients():
+            semaphore = asyncio.Semaphore(concurrency)
+
+            async def request():
+                # as ASGIHandler does, sync code of a request runs in a thread of its own
+                async with semaphore, ThreadSensitiveContext():
+                    await asyncio.sleep(delay)
+                    response = await client.get(url, accept='application/json')
+                    assert response.status_code == 200, response.status_code
+
+            start = time.perf_counter()
+            await asyncio.gather(*(request() for _ in range(self.requests)))
+            return time.perf_counter() - start
+
+        return self.requests / asyncio.run(clients())
+
+    def handle(self, *args, **options):
+        self.requests = options['requests']
+        self.threads = options['threads']
+        self.client_delay = options['client_delay'] / 1000
+        profile_id = ProfileSummary.objects.values_list('pk', flat=True).first()
+        # host of the test clients
+        with override_settings(ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, 'testserver']):
+            self.run_all(profile_id, options['concurrency'])
+
+    def run_all(self, profile_id, concurrency_levels):
+        self.stdout.write('{:<10} {:>11} {:>14} {:>14} {:>14}'.format(
+            'endpoint', 'concurrency', 'WSGI sync', 'ASGI sync', 'ASGI async'))
+        for name, sync_url, async_url in ENDPOINTS:
+            sync_url, async_url = sync_url.format(id=profile_id), async_url.format(id=profile_id)
+            for concurrency in concurrency_levels:
+                rates = (self.run_wsgi(sync_url, concurrency),
+                         self.run_asgi(sync_url, concurrency),
+                         self.run_asgi(async_url, concurrency))
+                self.stdout.write('{:<10} {:>11} {:>10.0f} r/s {:>10.0f} r/s {:>10.0f} r/s'.format(
+                    name, concurrency, *rates))
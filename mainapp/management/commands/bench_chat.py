@@ -0,0 +1,127 @@
+import asyncio
+import json
+import random
+import time
+from datetime import date
+
+from django.core.management.base import BaseCommand
+from django.db.models import Max
+
+from mainapp.chat import ChatApplication, MessageWriter
+from mainapp.models import Conversation, Message, Partner, Profile
+
+
+def percentile(values, p):
+    values = sorted(values)
+    if not values:
+        return 0
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+class Command(BaseCommand):
+    # every simulated connection is a partner of the next one, each sends --messages
+    # messages with --interval ms pauses, latency is from the send to the delivery
+    # to the partner's connection; the chat app is called in-process, without sockets
+    # command:            python manage.py bench_chat --connections 2000 --messages 10 --slow 5
+    help = 'Benchmarks the websocket chat: messages/sec and delivery latency'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--connections', type=int, default=2000)
+        parser.add_argument('--messages', type=int, default=10, help='messages sent by every connection')
+        parser.add_argument('--interval', type=float, default=100, help='ms between messages of a connection')
+        parser.add_argument('--slow', type=float, default=0, help='percent of connections reading slowly')
+        parser.add_argument('--slow-delay', type=float, default=50, help='ms a slow connection takes for a message')
+        parser.add_argument('--queue-size', type=int, default=100)
+
+    def setup_partners(self, connections):
+        profile_ids = list(Profile.objects.order_by('pk').values_list('pk', flat=True)[:connections // 2 * 2])
+        pairs = list(zip(profile_ids[::2], profile_ids[1::2]))
+        existing = set(Partner.objects.filter(follower_id__in=profile_ids, followed_id__in=profile_ids)
+                       .values_list('follower_id', 'followed_id'))
+        Partner.objects.bulk_create([Partner(follower_id=a, followed_id=b, response_date=date.today())
+                                     for a, b in pairs if (a, b) not in existing and (b, a) not in existing])
+        # pairs with a pending request are left out, they can't chat
+        accepted = set(Partner.objects.filter(follower_id__in=profile_ids, followed_id__in=profile_ids,
+                                              response_date__isnull=False).values_list('follower_id', 'followed_id'))
+        return [(a, b) for a, b in pairs if (a, b) in accepted or (b, a) in accepted]
+
+    async def run(self, pairs, options):
+        app = ChatApplication(writer=MessageWriter(), queue_size=options['queue_size'])
+        latencies = []
+        loop = asyncio.get_running_loop()
+        slow_delay = options['slow_delay'] / 1000
+        interval = options['interval'] / 1000
+
+        def connection(profile_id, partner_id, slow):
+            incoming = asyncio.Queue()
+            accepted = loop.create_future()
+
+            async def send(event):
+                if event['type'] == 'websocket.accept':
+                    accepted.set_result(True)
+                elif event['type'] == 'websocket.close':
+                    if not accepted.done():
+                        accepted.set_result(False)
+                else:
+                    if slow:
+                        await asyncio.sleep(slow_delay)
+                    message = json.loads(event['text'])
+                    if message['sender'] != profile_id:
+                        latencies.append(time.perf_counter() - message['ref'])
+
+            scope = {'type': 'websocket', 'path': '/ws/chat/%s/' % partner_id, 'headers': [],
+                     'profile_id': profile_id}
+            task = asyncio.ensure_future(app(scope, incoming.get, send))
+            incoming.put_nowait({'type': 'websocket.connect'})
+            return incoming, accepted, task
+
+        async def client(incoming):
+            await asyncio.sleep(random.random() * interval)
+            for _ in range(options['messages']):
+                incoming.put_nowait({'type': 'websocket.receive',
+                                     'text': json.dumps({'text': 'hello', 'ref': time.perf_counter()})})
+                await asyncio.sleep(interval)
+
+        slow = options['slow'] / 100
+        connections = []
+        start = time.perf_counter()
+        for a, b in pairs:
+            connections.append(connection(a, b, random.random() < slow))
+            connections.append(connection(b, a, random.random() < slow))
+        accepted = await asyncio.gather(*(accepted for incoming, accepted, task in connections))
+        self.stdout.write('{} connections accepted in {:.1f}s'.format(sum(accepted), time.perf_counter() - start))
+
+        start = time.perf_counter()
+        await asyncio.gather(*(client(incoming) for incoming, accepted, task in connections))
+        # the last messages are delivered
+        expected = len(connections) * options['messages']
+        for _ in range(100):
+            if len(latencies) + app.dropped * options['messages'] >= expected:
+                break
+            await asyncio.sleep(0.05)
+        elapsed = time.perf_counter() - start
+
+        for incoming, accepted, task in connections:
+            incoming.put_nowait({'type': 'websocket.disconnect', 'code': 1000})
+        await asyncio.gather(*(task for incoming, accepted, task in connections))
+        await app.close()
+        return {'sent': expected, 'delivered': len(latencies), 'elapsed': elapsed, 'latencies': latencies,
+                'dropped': app.dropped, 'written': app.writer.written, 'flushes': app.writer.flushes}
+
+    def handle(self, *args, **options):
+        # rows added by the benchmark are deleted afterwards
+        last_ids = {model: model.objects.aggregate(last=Max('pk'))['last'] or 0 for model in (Message, Conversation, Partner)}
+        try:
+            pairs = self.setup_partners(options['connections'])
+            result = asyncio.run(self.run(pairs, options))
+        finally:
+            for model, last_id in last_ids.items():
+                model.objects.filter(pk__gt=last_id).delete()
+        latencies = result['latencies']
+        self.stdout.write('{} messages sent, {} delivered to partners in {:.2f}s: {:.0f} msgs/sec'.format(
+            result['sent'], result['delivered'], result['elapsed'], result['delivered'] / result['elapsed']))
+        self.stdout.write('latency p50 {:.1f}ms  p99 {:.1f}ms  max {:.1f}ms'.format(
+            percentile(latencies, 0.5) * 1000, percentile(latencies, 0.99) * 1000,
+            max(latencies or [0]) * 1000))
+        self.stdout.write('{} slow consumers disconnected, {} messages written by {} bulk_create'.format(
+            result['dropped'], result['written'], result['flushes']))
@@ -0,0 +1,79 @@
+import random
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from mainapp.recommendations import LEVEL_WEIGHTS, MatchIndex
+
+
+class Command(BaseCommand):
+    # profiles/sec of the batch scoring, MatchIndex loops vs NumPy blocks, on synthetic profiles
+    # command:            python manage.py bench_match_scoring --profiles 10000 100000
+    help = 'Benchmarks top-K scoring of every profile in Python and with NumPy'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--profiles', type=int, nargs='+', default=[10000, 100000])
+        parser.add_argument('--languages', type=int, default=40)
+        parser.add_argument('--tags', type=int, default=60)
+        parser.add_argument('--count', type=int, default=10)
+        parser.add_argument('--python-sample', type=int, default=200,
+                            help='profiles scored by MatchIndex, the total is extrapolated')
+        parser.add_argument('--seed', type=int, default=1)
+
+    def synthetic(self, profiles, languages, tags, rng):
+        # every profile is native in 1-2 languages, studies 1-3 and has 0-5 tags
+        levels = list(LEVEL_WEIGHTS)
+        natives, study, tagged = [], [], []
+        for pk in range(1, profiles + 1):
+            spoken = rng.sample(range(languages), rng.randint(2, 5))
+            natives.extend((pk, language) for language in spoken[:rng.randint(1, 2)])
+            study.extend((pk, language, rng.choice(levels)) for language in spoken[2:])
+            tagged.extend((pk, tag) for tag in rng.sample(range(tags), rng.randint(0, 5)))
+        return natives, study, tagged
+
+    def handle(self, *args, **options):
+        try:
+            import numpy as np
+            from mainapp.match_scoring import MatchMatrices
+        except ImportError as e:
+            raise CommandError('bench_match_scoring needs numpy: {}'.format(e))
+
+        k = options['count']
+        for profiles in options['profiles']:
+            rng = random.Random(options['seed'])
+            natives, study, tagged = self.synthetic(profiles, options['languages'], options['tags'], rng)
+
+            index = MatchIndex()
+            for pk, language in natives:
+                index.add_native(pk, language)
+            for pk, language, level in study:
+                index.add_level(pk, language, level)
+            for pk, tag in tagged:
+                index.profile_tags[pk].add(tag)
+                index.tagged[tag].add(pk)
+            sample = rng.sample(range(1, profiles + 1), min(options['python_sample'], profiles))
+            start = time.perf_counter()
+            for pk in sample:
+                scores = index.scores(pk)
+                sorted(scores.items(), key=lambda item: (-item[1], item[0]))[:k]
+            python_rate = len(sample) / (time.perf_counter() - start)
+
+            natives_matrix = np.zeros((profiles, options['languages']), dtype=np.float32)
+            study_matrix = np.zeros((profiles, options['languages']), dtype=np.float32)
+            tags_matrix = np.zeros((profiles, options['tags']), dtype=np.float32)
+            for pk, language in natives:
+                natives_matrix[pk - 1, language] = 1
+            for pk, language, level in study:
+                study_matrix[pk - 1, language] = LEVEL_WEIGHTS[level]
+            for pk, tag in tagged:
+                tags_matrix[pk - 1, tag] = 1
+            matrices = MatchMatrices(range(1, profiles + 1), natives_matrix, study_matrix, tags_matrix)
+            start = time.perf_counter()
+            done = sum(len(block) for block in matrices.blocks(k))
+            elapsed = time.perf_counter() - start
+
+            self.stdout.write('{} profiles, block of {}:'.format(profiles, matrices.block_size()))
+            self.stdout.write('  MatchIndex  {:>10.0f} profiles/sec, all profiles in ~{:.1f}s'.format(
+                python_rate, profiles / python_rate))
+            self.stdout.write('  NumPy       {:>10.0f} profiles/sec, all profiles in {:.1f}s'.format(
+                done / elapsed, elapsed))
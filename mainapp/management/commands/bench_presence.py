@@ -0,0 +1,77 @@
+import random
+import time
+from types import SimpleNamespace
+
+from django.core.cache import cache
+from django.core.management.base import BaseCommand
+from django.http import HttpResponse
+from django.test import RequestFactory
+
+from gotalk.middleware import OnlineNowMiddleware
+from gotalk.presence import ONLINE_MAX, ONLINE_THRESHOLD, LocalPresenceBackend
+
+
+def legacy_process_request(request):
+    # OnlineNowMiddleware.process_request before the presence backends, kept to compare with
+    uids = cache.get('online-now', [])
+    online_keys = ['online-%s' % (u,) for u in uids]
+    fresh = cache.get_many(online_keys).keys()
+    online_now_ids = [int(k.replace('online-', '')) for k in fresh]
+    if request.user.is_authenticated:
+        uid = request.user.id
+        if uid in online_now_ids:
+            online_now_ids.remove(uid)
+        online_now_ids.append(uid)
+        if len(online_now_ids) > ONLINE_MAX:
+            del online_now_ids[0]
+    request.online_now_ids = online_now_ids
+    cache.set('online-%s' % (request.user.pk,), True, ONLINE_THRESHOLD)
+    cache.set('online-now', online_now_ids, ONLINE_THRESHOLD)
+
+
+class Command(BaseCommand):
+    # requests/sec of the online users tracking, the old cache list vs presence backend
+    # command:            python manage.py bench_presence --requests 50000 --users 1000
+    help = 'Benchmarks OnlineNowMiddleware against the old cache list implementation'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=50000)
+        parser.add_argument('--users', type=int, default=1000)
+        parser.add_argument('--anonymous', type=float, default=0.3,
+                            help='share of anonymous requests')
+
+    def make_requests(self, options):
+        factory = RequestFactory()
+        rnd = random.Random(0)
+        anonymous = SimpleNamespace(is_authenticated=False, id=None, pk=None)
+        requests = []
+        for _ in range(options['requests']):
+            request = factory.get('/')
+            if rnd.random() < options['anonymous']:
+                request.user = anonymous
+            else:
+                uid = rnd.randint(1, options['users'])
+                request.user = SimpleNamespace(is_authenticated=True, id=uid, pk=uid)
+            requests.append(request)
+        return requests
+
+    def run(self, name, handle, requests):
+        start = time.perf_counter()
+        for request in requests:
+            handle(request)
+        elapsed = time.perf_counter() - start
+        self.stdout.write('{:<30} {:>10.0f} requests/sec'.format(name, len(requests) / elapsed))
+
+    def handle(self, *args, **options):
+        requests = self.make_requests(options)
+        cache.clear()
+        self.run('legacy cache list', legacy_process_request, requests)
+
+        middleware = OnlineNowMiddleware(lambda request: HttpResponse(), presence=LocalPresenceBackend())
+
+        def handle_presence(request):
+            middleware(request)
+            # templates read the online ids once per request
+            len(request.online_now_ids)
+
+        self.run('presence (local backend)', handle_presence, requests)
@@ -0,0 +1,69 @@
+import threading
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from mainapp.models import Profile, ProfileViewHour, Task
+from mainapp.popularity import ViewCounter
+from mainapp.tasks import run_pending
+
+
+class Command(BaseCommand):
+    # views/sec of threads viewing a few hot profiles: a task per view (flush interval 0)
+    # against counters flushed every --interval seconds, and the tasks both take
+    # (the database task backend, run by this command after the views)
+    # command:            python manage.py bench_profile_views --threads 8 --views 500
+    help = 'Measures profile view counting with and without buffering'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, default=8)
+        parser.add_argument('--views', type=int, default=500, help='views of every thread')
+        parser.add_argument('--hot', type=int, default=3, help='profiles all threads view')
+        parser.add_argument('--interval', type=float, default=1.0)
+
+    def run(self, counter, profile_ids, threads, views):
+        errors = []
+
+        def view():
+            try:
+                for i in range(views):
+                    counter.add(profile_ids[i % len(profile_ids)])
+            except Exception as e:
+                errors.append(e)
+            finally:
+                connections.close_all()
+
+        workers = [threading.Thread(target=view) for _ in range(threads)]
+        start = time.perf_counter()
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        counter.flush()
+        return time.perf_counter() - start, errors
+
+    def handle(self, *args, **options):
+        profile_ids = list(Profile.objects.order_by('pk').values_list('pk', flat=True)[:options['hot']])
+        start = ProfileViewHour.objects.order_by('-pk').values_list('pk', flat=True).first() or 0
+        first_task = Task.objects.order_by('-pk').values_list('pk', flat=True).first() or 0
+        total = options['threads'] * options['views']
+        try:
+            for name, interval in (('task per view', 0), ('buffered', options['interval'])):
+                ProfileViewHour.objects.filter(pk__gt=start).delete()
+                counter = ViewCounter(interval)
+                writes = []
+                original_save = counter.save
+                counter.save = lambda counts: (writes.append(len(counts)), original_save(counts))
+                seconds, errors = self.run(counter, profile_ids, options['threads'], options['views'])
+                tasks_start = time.perf_counter()
+                run_pending()
+                task_seconds = time.perf_counter() - tasks_start
+                saved = sum(ProfileViewHour.objects.filter(pk__gt=start).values_list('views', flat=True))
+                self.stdout.write('{:15} {:8.0f} views/sec, {} flushes of {} rows, tasks run in {:.2f}s, '
+                                  '{} of {} views saved{}'.format(
+                    name, total / seconds, len([w for w in writes if w]), sum(writes), task_seconds, saved, total,
+                    ', {} errors: {}'.format(len(errors), errors[0]) if errors else ''))
+        finally:
+            ProfileViewHour.objects.filter(pk__gt=start).delete()
+            Task.objects.filter(pk__gt=first_task).delete()
@@ -0,0 +1,47 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.test import RequestFactory
+from rest_framework.test import APIRequestFactory
+
+from mainapp.models import Country
+from mainapp.views import CountryAPIViewSet, ReferenceDataView
+
+
+class Command(BaseCommand):
+    # requests/sec of the countries list, CountrySerializer viewset vs cached reference data
+    # command:            python manage.py bench_reference --requests 2000 --countries 250
+    help = 'Benchmarks /api/v1/country/ against /api/v1/reference/countries/'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=2000)
+        parser.add_argument('--countries', type=int, default=250,
+                            help='countries to create for the run, they are rolled back')
+
+    def run(self, name, view, request):
+        start = time.perf_counter()
+        for _ in range(self.requests):
+            response = view(request)
+            if hasattr(response, 'render'):
+                response.render()
+        elapsed = time.perf_counter() - start
+        self.stdout.write('{:<40} {:>10.0f} requests/sec'.format(name, self.requests / elapsed))
+        return response
+
+    def handle(self, *args, **options):
+        self.requests = options['requests']
+        with transaction.atomic():
+            Country.objects.bulk_create(Country(abbreviation='%02d' % (i % 100), name='Country %s' % i)
+                                        for i in range(options['countries']))
+
+            viewset = CountryAPIViewSet.as_view({'get': 'list'})
+            self.run('CountrySerializer viewset', viewset,
+                     APIRequestFactory().get('/api/v1/country/', HTTP_ACCEPT='application/json'))
+
+            reference = ReferenceDataView.as_view(name='countries')
+            factory = RequestFactory()
+            response = self.run('reference data, 200', reference, factory.get('/api/v1/reference/countries/'))
+            self.run('reference data, 304', reference,
+                     factory.get('/api/v1/reference/countries/', HTTP_IF_NONE_MATCH=response['ETag']))
+            transaction.set_rollback(True)
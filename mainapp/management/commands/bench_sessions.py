@@ -0,0 +1,76 @@
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test import Client, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from mainapp.models import Profile
+
+LEGACY_MIDDLEWARE = 'mainapp.management.commands.bench_sessions.LegacyVisitedProfilesMiddleware'
+
+# (name, engine, emulate visited_profiles kept in the session)
+ENGINES = (('db, before', 'django.contrib.sessions.backends.db', True),
+           ('db', 'django.contrib.sessions.backends.db', False),
+           ('cached_db', 'django.contrib.sessions.backends.cached_db', False),
+           ('cache', 'django.contrib.sessions.backends.cache', False))
+
+
+class LegacyVisitedProfilesMiddleware:
+    # what the old SessionMixin did to the session on every profile view
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        response = self.get_response(request)
+        profile_id = request.resolver_match.kwargs.get('profile_id') if request.resolver_match else None
+        if profile_id:
+            visited = request.session.get('visited_profiles', [])
+            request.session['visited_profiles'] = ([profile_id] + [pk for pk in visited if pk != profile_id])[:6]
+            request.session.modified = True
+        return response
+
+
+class Command(BaseCommand):
+    # session table reads/writes per request for every session engine
+    # command:            python manage.py bench_sessions --requests 200
+    help = 'Reports django_session queries per request for the session engines'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=200)
+        parser.add_argument('--profiles', type=int, default=20,
+                            help='profiles to create for the run, they are rolled back')
+
+    def run(self, engine, legacy, profile_ids, requests):
+        middleware = list(settings.MIDDLEWARE)
+        if legacy:
+            # inside SessionMiddleware, so the session is changed before it's saved
+            middleware.insert(middleware.index('django.contrib.sessions.middleware.SessionMiddleware') + 1,
+                              LEGACY_MIDDLEWARE)
+        with override_settings(SESSION_ENGINE=engine, MIDDLEWARE=middleware):
+            cache.clear()
+            client = Client(SERVER_NAME='localhost')
+            client.force_login(self.user)
+            urls = [reverse('index')] + [reverse('profile', kwargs={'profile_id': pk}) for pk in profile_ids]
+            with CaptureQueriesContext(connection) as queries:
+                for i in range(requests):
+                    client.get(urls[i % len(urls)])
+        session_queries = [q['sql'] for q in queries if 'django_session' in q['sql']]
+        writes = [sql for sql in session_queries if not sql.lstrip().startswith('SELECT')]
+        return len(session_queries) - len(writes), len(writes)
+
+    def handle(self, *args, **options):
+        requests = options['requests']
+        with transaction.atomic():
+            self.user = User.objects.create_user(username='bench-sessions-viewer')
+            for i in range(options['profiles']):
+                User.objects.create_user(username='bench-sessions-%s' % i)
+            profile_ids = list(Profile.objects.values_list('pk', flat=True)[:options['profiles']])
+
+            self.stdout.write('{:<12} {:>18} {:>18}'.format('engine', 'DB reads/request', 'DB writes/request'))
+            for name, engine, legacy in ENGINES:
+                reads, writes = self.run(engine, legacy, profile_ids, requests)
+                self.stdout.write('{:<12} {:>18.3f} {:>18.3f}'.format(name, reads / requests, writes / requests))
+            transaction.set_rollback(True)
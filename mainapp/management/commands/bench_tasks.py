@@ -0,0 +1,67 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from mainapp.models import Task
+from mainapp.tasks import DatabaseBackend, Worker
+
+NOOP = 'mainapp.management.commands.bench_tasks.noop'
+SLEEP = 'mainapp.management.commands.bench_tasks.sleep'
+
+
+def noop(i):
+    pass
+
+
+def sleep(i, seconds):
+    # I/O of a task: e-mail, HTTP, storage
+    time.sleep(seconds)
+
+
+class Command(BaseCommand):
+    # tasks/sec of the database backend: enqueueing one by one and in bulk, workers of
+    # 1..N threads draining a queue of no-op tasks and of tasks waiting on I/O
+    # command:            python manage.py bench_tasks --tasks 2000 --threads 1 4 8
+    help = 'Measures enqueue and worker throughput of the task queue'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--tasks', type=int, default=2000)
+        parser.add_argument('--threads', type=int, nargs='+', default=[1, 4, 8])
+        parser.add_argument('--batch-size', type=int, nargs='+', default=[1, 50])
+        parser.add_argument('--sleep', type=float, default=0.01, help='seconds of an I/O task')
+
+    def drain(self, threads, batch_size):
+        worker = Worker(threads, batch_size)
+        start = time.perf_counter()
+        worker.run(once=True)
+        return worker.done, time.perf_counter() - start
+
+    def handle(self, *args, **options):
+        count = options['tasks']
+        backend = DatabaseBackend()
+        start = Task.objects.order_by('-pk').values_list('pk', flat=True).first() or 0
+        try:
+            begin = time.perf_counter()
+            for i in range(count):
+                backend.enqueue(NOOP, [i], {})
+            self.stdout.write('enqueue one by one   {:8.0f} tasks/sec'.format(count / (time.perf_counter() - begin)))
+            Task.objects.filter(pk__gt=start).delete()
+            begin = time.perf_counter()
+            backend.enqueue_many(NOOP, [(i,) for i in range(count)])
+            self.stdout.write('enqueue_many         {:8.0f} tasks/sec'.format(count / (time.perf_counter() - begin)))
+            Task.objects.filter(pk__gt=start).delete()
+
+            for batch_size in options['batch_size']:
+                for threads in options['threads']:
+                    backend.enqueue_many(NOOP, [(i,) for i in range(count)])
+                    done, seconds = self.drain(threads, batch_size)
+                    self.stdout.write('no-op  batch {:3} threads {:2} {:8.0f} tasks/sec'.format(
+                        batch_size, threads, done / seconds))
+            io_count = max(1, min(count, int(20 / options['sleep'])) // 4)
+            for threads in options['threads']:
+                backend.enqueue_many(SLEEP, [(i, options['sleep']) for i in range(io_count)])
+                done, seconds = self.drain(threads, max(options['batch_size']))
+                self.stdout.write('{:.0f}ms I/O batch {:3} threads {:2} {:8.0f} tasks/sec'.format(
+                    options['sleep'] * 1000, max(options['batch_size']), threads, done / seconds))
+        finally:
+            Task.objects.filter(pk__gt=start).delete()
@@ -0,0 +1,29 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+
+class Command(BaseCommand):
+    # nightly top matches of every profile for the email digests, needs numpy
+    # command:            python manage.py build_recommendations --count 10
+    help = 'Scores all profiles with NumPy and stores their top matches into Recommendation'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--count', type=int, default=10, help='matches to keep per profile')
+        parser.add_argument('--block-size', type=int,
+                            help='profiles scored at once, by default from RECOMMENDATIONS_BLOCK_MEMORY')
+
+    def handle(self, *args, **options):
+        try:
+            from mainapp.match_scoring import build_recommendations
+        except ImportError as e:
+            raise CommandError('build_recommendations needs numpy: {}'.format(e))
+        start = time.perf_counter()
+
+        def progress(done, total):
+            self.stdout.write('{}/{} profiles, {:.0f} profiles/sec'.format(
+                done, total, done / (time.perf_counter() - start)))
+
+        done = build_recommendations(options['count'], options['block_size'], progress)
+        self.stdout.write(self.style.SUCCESS('Done: {} profiles in {:.1f}s'.format(
+            done, time.perf_counter() - start)))
@@ -0,0 +1,51 @@
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from mainapp.avatars import update_thumbnails
+from mainapp.models import Profile
+from mainapp.thumbnails import process_avatar
+
+
+class Command(BaseCommand):
+    # thumbnails of the avatars uploaded before mainapp.avatars (or of all with --force),
+    # images are processed by a pool of worker processes, this one writes the database
+    # command:            python manage.py build_thumbnails --workers 4
+    help = 'Makes thumbnails of the existing avatars in parallel'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=os.cpu_count())
+        parser.add_argument('--force', action='store_true', help='also avatars which have thumbnails')
+        parser.add_argument('--batch-size', type=int, default=100, help='avatars saved per transaction')
+
+    def handle(self, *args, **options):
+        profiles = Profile.objects.exclude(avatar='')
+        if not options['force']:
+            profiles = profiles.filter(avatar_thumbnails={})
+        names = sorted(set(profiles.values_list('avatar', flat=True)))
+        self.stdout.write('{} avatars'.format(len(names)))
+        # forked workers must not share the database connections of this process
+        connections.close_all()
+
+        start = time.perf_counter()
+        batch, done, failed, updated = {}, 0, 0, 0
+        with ProcessPoolExecutor(max_workers=options['workers']) as pool:
+            for name, thumbnails in pool.map(process_avatar, names):
+                done += 1
+                if thumbnails is None:
+                    failed += 1
+                    self.stderr.write('{}: missing or not an image'.format(name))
+                    continue
+                batch[name] = thumbnails
+                if len(batch) >= options['batch_size']:
+                    updated += update_thumbnails(batch)
+                    batch = {}
+                    self.stdout.write('{} avatars, {:.1f} avatars/sec'.format(
+                        done, done / (time.perf_counter() - start)))
+        if batch:
+            updated += update_thumbnails(batch)
+        self.stdout.write(self.style.SUCCESS('Done: {} avatars of {} profiles in {:.1f}s, {} failed'.format(
+            done - failed, updated, time.perf_counter() - start, failed)))
@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+
+from mainapp.cards import card_cache_stats, reset_card_cache_stats
+
+
+class Command(BaseCommand):
+    # hits and misses of the rendered profile cards cache
+    # command:            python manage.py card_cache_stats [--reset]
+    help = 'Shows hit/miss counters of the profile cards cache'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--reset', action='store_true', help='reset counters after showing')
+
+    def handle(self, *args, **options):
+        stats = card_cache_stats()
+        self.stdout.write('hits: {hits}, misses: {misses}, hit rate: {hit_rate:.1%}'.format(**stats))
+        if options['reset']:
+            reset_card_cache_stats()
@@ -1,13 +1,15 @@
 from django.core.management.base import BaseCommand
-from mainapp.models import Profile
 from django.contrib.sessions.models import Session
 
+from mainapp.sessions import SESSIONS_DELETE_BATCH, delete_sessions
+
 
 class Command(BaseCommand):
     # to close all active sessions
-    # command:            python manage.py close_sessions
-    def handle(self, *args, **options):
-        sessions = Session.objects.all()
-        print(str(len(sessions)), ' active sessions were closed')
-        sessions.delete()
+    # command:            python manage.py close_sessions [--batch-size 1000]
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=SESSIONS_DELETE_BATCH)
 
+    def handle(self, *args, **options):
+        deleted = delete_sessions(Session.objects.all(), options['batch_size'])
+        self.stdout.write('{} active sessions were closed'.format(deleted))
@@ -0,0 +1,34 @@
+from django.core.management.base import BaseCommand
+
+from mainapp.avatars import AVATAR_GC_GRACE, collect_avatars, rehash_avatars
+from mainapp.models import Profile
+
+
+class Command(BaseCommand):
+    # deletes avatar files (with their thumbnails) which no profile uses, run it periodically (cron);
+    # --scan also deletes files without a reference count under the avatar directories,
+    # --rehash moves avatars of the old users/%Y/%m/%d names to content addressed ones first
+    # command:            python manage.py collect_avatars [--scan [--path users]] [--rehash] [--dry-run]
+    help = 'Deletes unused avatar files'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--grace', type=int, default=AVATAR_GC_GRACE,
+                            help='seconds a file is kept after it was used last')
+        parser.add_argument('--scan', action='store_true', help='look for files without a reference count')
+        parser.add_argument('--path', action='append', default=[],
+                            help='directory to scan, the upload directory of avatars by default')
+        parser.add_argument('--rehash', action='store_true', help='move old avatars to content addressed names')
+        parser.add_argument('--dry-run', action='store_true')
+
+    def handle(self, *args, **options):
+        if options['rehash'] and not options['dry_run']:
+            moved = rehash_avatars()
+            self.stdout.write('{} avatars moved to {} files, run build_thumbnails for their thumbnails'.format(
+                len(moved), len(set(moved.values()))))
+        scan = ()
+        if options['scan']:
+            scan = options['path'] or [Profile._meta.get_field('avatar').upload_to]
+        deleted = collect_avatars(options['grace'], scan, options['dry_run'])
+        for name in deleted:
+            self.stdout.write(name)
+        self.stdout.write('{} unused files {}'.format(len(deleted), 'found' if options['dry_run'] else 'deleted'))
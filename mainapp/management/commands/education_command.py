@@ -8,7 +8,7 @@ class Command(BaseCommand):
     help = "I'm learning"
 
     def handle(self, *args, **options):
-        profiles = Profile.objects.all()
+        profiles = Profile.objects.select_related('user')
 
         for profile in profiles:
             print(profile.user)
@@ -0,0 +1,39 @@
+import sys
+import time
+
+from django.core.management.base import BaseCommand
+
+from mainapp.exporter import EXPORT_CHUNK_SIZE, RENDERERS, export_rows
+
+
+class Command(BaseCommand):
+    # streaming export of profiles with languages, tags and partners
+    # command:            python manage.py export_profiles --format jsonl --output profiles.jsonl
+    help = 'Exports profiles to CSV or JSONL with constant memory, see mainapp.exporter'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--format', choices=sorted(RENDERERS), default='jsonl')
+        parser.add_argument('--output', help='file to write, stdout by default')
+        parser.add_argument('--chunk-size', type=int, default=EXPORT_CHUNK_SIZE)
+
+    def handle(self, *args, **options):
+        render, content_type = RENDERERS[options['format']]
+        output = open(options['output'], 'w', newline='', encoding='utf-8') if options['output'] else sys.stdout
+        start = time.perf_counter()
+        count = 0
+
+        def counted(rows):
+            nonlocal count
+            for row in rows:
+                count += 1
+                yield row
+
+        try:
+            for line in render(counted(export_rows(options['chunk_size']))):
+                output.write(line)
+        finally:
+            if output is not sys.stdout:
+                output.close()
+        elapsed = time.perf_counter() - start
+        self.stderr.write('{} profiles exported in {:.1f}s, {:.0f} rows/sec'.format(
+            count, elapsed, count / elapsed if elapsed else 0))
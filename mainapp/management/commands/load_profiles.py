@@ -0,0 +1,43 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from mainapp.importer import ProfileImporter, read_rows
+
+
+class Command(BaseCommand):
+    # bulk import of users with profiles, languages and tags from CSV or JSONL
+    # command:            python manage.py load_profiles users.jsonl --batch-size 1000 [--processes 4]
+    help = 'Loads users and their profiles from a CSV or JSONL file, see mainapp.importer'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path')
+        parser.add_argument('--format', choices=('csv', 'jsonl'),
+                            help='by default it comes from the file extension')
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--tag-area', default='Other', help='area for new tags')
+        parser.add_argument('--processes', type=int, default=1, help='processes hashing passwords')
+
+    def handle(self, *args, **options):
+        path = options['path']
+        fmt = options['format'] or path.rsplit('.', 1)[-1].lower()
+        if fmt not in ('csv', 'jsonl'):
+            raise CommandError('Unknown format, use --format csv|jsonl')
+
+        importer = ProfileImporter(batch_size=options['batch_size'], tag_area=options['tag_area'],
+                                   processes=options['processes'])
+        start = time.perf_counter()
+
+        def progress(created, skipped):
+            elapsed = time.perf_counter() - start
+            self.stdout.write('{} created, {} skipped, {:.0f} rows/sec'.format(
+                created, skipped, (created + skipped) / elapsed))
+
+        def error(number, message):
+            self.stderr.write('row {}: {}'.format(number, message))
+
+        with open(path, newline='', encoding='utf-8') as file:
+            created, skipped = importer.run(read_rows(file, fmt), progress, error)
+        elapsed = time.perf_counter() - start
+        self.stdout.write(self.style.SUCCESS('Done: {} profiles created, {} rows skipped in {:.1f}s'.format(
+            created, skipped, elapsed)))
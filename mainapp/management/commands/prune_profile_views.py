@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from mainapp.popularity import VIEWS_KEEP_DAYS, prune_views
+
+
+class Command(BaseCommand):
+    # deletes hourly profile view rollups older than --days, run it daily (cron)
+    # command:            python manage.py prune_profile_views [--days 30]
+    help = 'Deletes old profile view counts'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=VIEWS_KEEP_DAYS)
+
+    def handle(self, *args, **options):
+        self.stdout.write('{} hourly view counts deleted'.format(prune_views(options['days'])))
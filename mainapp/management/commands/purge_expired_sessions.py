@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from mainapp.sessions import SESSIONS_DELETE_BATCH, delete_sessions, expired_sessions
+
+
+class Command(BaseCommand):
+    # to delete expired sessions, run it periodically (cron)
+    # command:            python manage.py purge_expired_sessions [--batch-size 1000]
+    help = 'Deletes expired sessions by batches'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=SESSIONS_DELETE_BATCH)
+
+    def handle(self, *args, **options):
+        count = expired_sessions().count()
+        deleted = delete_sessions(expired_sessions(), options['batch_size'])
+        self.stdout.write('{} of {} expired sessions were deleted'.format(deleted, count))
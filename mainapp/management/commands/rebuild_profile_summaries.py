@@ -0,0 +1,24 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from mainapp.summaries import rebuild_summaries
+
+
+class Command(BaseCommand):
+    # refills the ProfileSummary read model, e.g. after the migration or raw SQL updates
+    # command:            python manage.py rebuild_profile_summaries --batch-size 1000
+    help = 'Rebuilds ProfileSummary rows of all profiles'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        start = time.perf_counter()
+
+        def progress(done):
+            self.stdout.write('{} profiles, {:.0f} profiles/sec'.format(done, done / (time.perf_counter() - start)))
+
+        done = rebuild_summaries(batch_size=options['batch_size'], progress=progress)
+        self.stdout.write(self.style.SUCCESS('Done: {} summaries in {:.1f}s'.format(
+            done, time.perf_counter() - start)))
@@ -0,0 +1,40 @@
+import random
+import time
+
+from django.core.management.base import BaseCommand
+
+from mainapp.models import Profile
+from mainapp.recommendations import MatchIndex, bump_index_version, recommend
+
+
+class Command(BaseCommand):
+    # builds the recommendations index and makes every process build it again
+    # command:            python manage.py rebuild_recommendations --sample 200
+    help = 'Rebuilds the partner recommendations index, reports build time and top-K latency'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sample', type=int, default=100,
+                            help='profiles to time recommendations for, 0 to skip')
+        parser.add_argument('--count', type=int, default=10)
+
+    def handle(self, *args, **options):
+        start = time.perf_counter()
+        index = MatchIndex.build()
+        self.stdout.write('index built in {:.3f}s: {} natives, {} learners, {} tagged profiles'.format(
+            time.perf_counter() - start, len(index.profile_natives), len(index.profile_study), len(index.profile_tags)))
+        bump_index_version()
+
+        profile_ids = list(Profile.objects.values_list('pk', flat=True))
+        sample = random.sample(profile_ids, min(options['sample'], len(profile_ids)))
+        if not sample:
+            return
+        recommend(sample[0], options['count'])  # builds the index of this process
+        timings = []
+        for profile_id in sample:
+            start = time.perf_counter()
+            recommend(profile_id, options['count'])
+            timings.append(time.perf_counter() - start)
+        timings.sort()
+        self.stdout.write('top {} for {} profiles: median {:.2f}ms, p95 {:.2f}ms, max {:.2f}ms'.format(
+            options['count'], len(timings), timings[len(timings) // 2] * 1000,
+            timings[int(len(timings) * 0.95)] * 1000, timings[-1] * 1000))
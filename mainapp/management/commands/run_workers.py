@@ -0,0 +1,55 @@
+import multiprocessing
+import signal
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from mainapp.tasks import TASK_BATCH_SIZE, TASK_LEASE, TASK_POLL_INTERVAL, Worker
+
+
+def run_worker(options):
+    worker = Worker(options['threads'], options['batch_size'], options['poll_interval'], options['lease'])
+    # stops after the batch it is running
+    signal.signal(signal.SIGTERM, lambda *args: worker.stop())
+    signal.signal(signal.SIGINT, lambda *args: worker.stop())
+    worker.run(once=options['once'])
+    return worker
+
+
+class Command(BaseCommand):
+    # runs the background tasks of mainapp.tasks (the database backend), keep it running as a service,
+    # or from cron with --once; SIGTERM finishes the current batches and stops
+    # command:            python manage.py run_workers --threads 4 [--processes 2] [--once]
+    help = 'Runs background tasks'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, default=4, help='tasks run in parallel by a process')
+        parser.add_argument('--processes', type=int, default=1,
+                            help='worker processes, for tasks which hold the GIL')
+        parser.add_argument('--batch-size', type=int, default=TASK_BATCH_SIZE, help='tasks claimed at once')
+        parser.add_argument('--poll-interval', type=float, default=TASK_POLL_INTERVAL,
+                            help='seconds to wait when no task is due')
+        parser.add_argument('--lease', type=int, default=TASK_LEASE)
+        parser.add_argument('--once', action='store_true', help='run the due tasks and exit')
+
+    def handle(self, *args, **options):
+        start = time.perf_counter()
+        if options['processes'] <= 1:
+            worker = run_worker(options)
+            self.stdout.write('{} tasks done, {} failed in {:.1f}s'.format(
+                worker.done, worker.failed, time.perf_counter() - start))
+            return
+        # forked workers must not share the database connections of this process
+        connections.close_all()
+        processes = [multiprocessing.Process(target=run_worker, args=(options,), daemon=True)
+                     for _ in range(options['processes'])]
+        for process in processes:
+            process.start()
+        # the children got SIGINT of the terminal too, SIGTERM is passed to them
+        signal.signal(signal.SIGTERM, lambda *args: [process.terminate() for process in processes])
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+        for process in processes:
+            process.join()
+        self.stdout.write('{} worker processes stopped after {:.1f}s'.format(
+            len(processes), time.perf_counter() - start))
@@ -0,0 +1,161 @@
+"""
+Batch scoring of partner recommendations for all profiles with NumPy.
+
+Same score as ``mainapp.recommendations.MatchIndex.scores``, computed with
+matrix products instead of Python loops. Profiles are rows, languages and
+tags are columns:
+
+    natives  P x L  1 where the profile is native in the language
+    study    P x L  level weight where the profile studies the language
+    tags     P x T  1 where the profile has the tag
+
+For a block of viewers B:
+
+    teach = (study[B] > 0) @ natives.T   candidates native in what B studies
+    learn = natives[B] @ study.T         candidates studying what B is native in
+
+Only B x P scores live in memory at once, the block size comes from
+RECOMMENDATIONS_BLOCK_MEMORY. Needs the ``numpy`` package.
+"""
+import numpy as np
+from django.conf import settings
+from django.db import transaction
+
+from .models import LanguageLevel, Partner, Profile, Recommendation
+from .recommendations import LEVEL_WEIGHTS, NATIVE_LEVEL, RECIPROCAL_BONUS, RECOMMENDATIONS_COUNT, TAG_WEIGHT
+
+RECOMMENDATIONS_BLOCK_MEMORY = getattr(settings, 'RECOMMENDATIONS_BLOCK_MEMORY', 64 * 1024 * 1024)
+# float32 B x P matrices alive while a block is scored
+BLOCK_MATRICES = 4
+
+
+def column_index(values):
+    # {value: column}
+    return {value: i for i, value in enumerate(sorted(set(values)))}
+
+
+class MatchMatrices:
+    def __init__(self, profile_ids, natives, study, tags, partners=()):
+        self.profile_ids = np.asarray(profile_ids, dtype=np.int64)
+        self.natives = natives
+        self.study = study
+        self.learns = (study > 0).astype(np.float32)
+        self.tags = tags
+        # row -> rows of its partners, they are never recommended
+        self.partners = {}
+        rows = {pk: i for i, pk in enumerate(self.profile_ids.tolist())}
+        for a, b in partners:
+            if a in rows and b in rows:
+                self.partners.setdefault(rows[a], []).append(rows[b])
+                self.partners.setdefault(rows[b], []).append(rows[a])
+
+    @classmethod
+    def from_db(cls):
+        profile_ids = list(Profile.objects.order_by('pk').values_list('pk', flat=True))
+        rows = {pk: i for i, pk in enumerate(profile_ids)}
+        native_pairs = list(Profile.native_in.through.objects.values_list('profile_id', 'language_id'))
+        levels = list(LanguageLevel.objects.values_list('profile_id', 'language_id', 'level'))
+        tag_pairs = list(Profile.tags.through.objects.values_list('profile_id', 'tag_id'))
+        languages = column_index([language_id for profile_id, language_id in native_pairs]
+                                 + [language_id for profile_id, language_id, level in levels])
+        tag_columns = column_index([tag_id for profile_id, tag_id in tag_pairs])
+
+        natives = np.zeros((len(profile_ids), len(languages)), dtype=np.float32)
+        study = np.zeros((len(profile_ids), len(languages)), dtype=np.float32)
+        tags = np.zeros((len(profile_ids), len(tag_columns)), dtype=np.float32)
+        for profile_id, language_id in native_pairs:
+            natives[rows[profile_id], languages[language_id]] = 1
+        for profile_id, language_id, level in levels:
+            if level == NATIVE_LEVEL:
+                natives[rows[profile_id], languages[language_id]] = 1
+            else:
+                study[rows[profile_id], languages[language_id]] = LEVEL_WEIGHTS.get(level, 0.5)
+        for profile_id, tag_id in tag_pairs:
+            tags[rows[profile_id], tag_columns[tag_id]] = 1
+        partners = Partner.objects.values_list('follower_id', 'followed_id')
+        return cls(profile_ids, natives, study, tags, partners)
+
+    def __len__(self):
+        return len(self.profile_ids)
+
+    def block_size(self, memory=RECOMMENDATIONS_BLOCK_MEMORY):
+        return max(1, memory // (max(len(self), 1) * 4 * BLOCK_MATRICES))
+
+    def score_block(self, start, stop):
+        """
+        B x P float32 scores of the rows start:stop against every profile
+        """
+        teach = self.learns[start:stop] @ self.natives.T
+        learn = self.natives[start:stop] @ self.study.T
+        teaches, learns = teach > 0, learn > 0
+        scores = teach + learn
+        scores += np.float32(RECIPROCAL_BONUS) * (teaches & learns)
+        if self.tags.shape[1]:
+            scores += np.float32(TAG_WEIGHT) * (self.tags[start:stop] @ self.tags.T)
+        # shared tags count only for language matches, multiplying is faster than a mask
+        scores *= teaches | learns
+        rows = np.arange(stop - start)
+        scores[rows, rows + start] = 0
+        for row in range(start, stop):
+            if row in self.partners:
+                scores[row - start, self.partners[row]] = 0
+        return scores
+
+    def top(self, scores, k):
+        """
+        [(column indexes, scores), ...] of the best k columns with a score per row,
+        ties go to the lower profile id as in ``recommend`` (columns are ordered by id)
+        """
+        k = min(k, scores.shape[1])
+        if not k:
+            return [(np.empty(0, dtype=np.int64), np.empty(0, dtype=scores.dtype))] * scores.shape[0]
+        # the k-th best score of every row, argpartition alone would cut its ties at random
+        kth = -np.partition(-scores, k - 1, axis=1)[:, k - 1:k]
+        candidates = (scores >= kth) & (scores > 0)
+        result = []
+        for row_scores, row_candidates in zip(scores, candidates):
+            columns = np.flatnonzero(row_candidates)
+            values = row_scores[columns]
+            # lexsort: the last key is the primary one
+            order = np.lexsort((columns, -values))[:k]
+            result.append((columns[order], values[order]))
+        return result
+
+    def blocks(self, k=RECOMMENDATIONS_COUNT, block_size=None):
+        """
+        Yields [(profile id, [(candidate id, score), ...]), ...] per block of profiles.
+        """
+        block_size = block_size or self.block_size()
+        for start in range(0, len(self), block_size):
+            stop = min(start + block_size, len(self))
+            scores = self.score_block(start, stop)
+            block = []
+            for row, (best, values) in enumerate(self.top(scores, k), start):
+                block.append((int(self.profile_ids[row]),
+                              list(zip(self.profile_ids[best].tolist(), values.tolist()))))
+            yield block
+
+
+def save_block(block, batch_size=1000):
+    # recommendations of the block's profiles are replaced in one transaction
+    with transaction.atomic():
+        Recommendation.objects.filter(profile_id__in=[profile_id for profile_id, matches in block]).delete()
+        Recommendation.objects.bulk_create(
+            [Recommendation(profile_id=profile_id, candidate_id=candidate_id, score=score)
+             for profile_id, matches in block for candidate_id, score in matches],
+            batch_size=batch_size)
+
+
+def build_recommendations(k=RECOMMENDATIONS_COUNT, block_size=None, progress=None):
+    """
+    Scores every profile and stores the top ``k`` into Recommendation,
+    calls ``progress(profiles done, profiles)`` after every block.
+    """
+    matrices = MatchMatrices.from_db()
+    done = 0
+    for block in matrices.blocks(k, block_size):
+        save_block(block)
+        done += len(block)
+        if progress:
+            progress(done, len(matrices))
+    return done
@@ -0,0 +1,32 @@
+# Generated by Django 4.0.10 on 2026-10-18 17:33
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mainapp', '0014_alter_partner_unique_together'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='profile',
+            name='partner',
+            field=models.ManyToManyField(blank=True, through='mainapp.Partner', to='mainapp.profile'),
+        ),
+        migrations.AddIndex(
+            model_name='languagelevel',
+            index=models.Index(fields=['language', 'level'], name='mainapp_lan_languag_ba979f_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='profile',
+            index=models.Index(fields=['date_of_birth'], name='mainapp_pro_date_of_034e07_idx'),
+        ),
+        # auto-created m2m table has unique (profile_id, tag_id) only,
+        # the tag filter looks profiles up by tag
+        migrations.RunSQL(
+            'CREATE INDEX mainapp_profile_tags_tag_profile_idx ON mainapp_profile_tags (tag_id, profile_id)',
+            'DROP INDEX mainapp_profile_tags_tag_profile_idx',
+        ),
+    ]
@@ -0,0 +1,31 @@
+from django.conf import settings
+from django.db import migrations
+
+INDEX_NAME = 'auth_user_last_login_id_idx'
+
+
+def create_index(apps, schema_editor):
+    # profiles are paged by (user.last_login, user.id), newest first,
+    # users who never logged in go last
+    table = schema_editor.quote_name(apps.get_model(settings.AUTH_USER_MODEL)._meta.db_table)
+    if schema_editor.connection.vendor == 'postgresql':
+        columns = 'last_login DESC NULLS LAST, id DESC'
+    else:
+        columns = 'last_login, id'
+    schema_editor.execute('CREATE INDEX {} ON {} ({})'.format(INDEX_NAME, table, columns))
+
+
+def drop_index(apps, schema_editor):
+    schema_editor.execute('DROP INDEX {}'.format(INDEX_NAME))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('mainapp', '0015_profile_filter_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_index, drop_index)
+    ]
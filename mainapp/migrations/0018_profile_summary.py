@@ -0,0 +1,81 @@
+# Generated by Django 4.0.10 on 2026-10-18 17:56
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+KEYSET_INDEX_NAME = 'profile_summary_keyset_idx'
+
+
+def create_keyset_index(apps, schema_editor):
+    # index pages go by (last_login, user_id), newest first, see mainapp.pagination
+    table = schema_editor.quote_name(apps.get_model('mainapp', 'ProfileSummary')._meta.db_table)
+    if schema_editor.connection.vendor == 'postgresql':
+        columns = 'last_login DESC NULLS LAST, user_id DESC'
+    else:
+        columns = 'last_login, user_id'
+    schema_editor.execute('CREATE INDEX {} ON {} ({})'.format(KEYSET_INDEX_NAME, table, columns))
+
+
+def drop_keyset_index(apps, schema_editor):
+    schema_editor.execute('DROP INDEX {}'.format(KEYSET_INDEX_NAME))
+
+
+def fill_summaries(apps, schema_editor):
+    # the same rows mainapp.summaries writes, with the models of this migration
+    Profile = apps.get_model('mainapp', 'Profile')
+    ProfileSummary = apps.get_model('mainapp', 'ProfileSummary')
+    genders = dict(Profile._meta.get_field('gender').choices)
+    profiles = Profile.objects.select_related('user', 'country').prefetch_related('study', 'native_in', 'tags')
+    profile_ids = list(Profile.objects.order_by('pk').values_list('pk', flat=True))
+    for start in range(0, len(profile_ids), 1000):
+        summaries = []
+        for profile in profiles.filter(pk__in=profile_ids[start:start + 1000]):
+            user = profile.user
+            summaries.append(ProfileSummary(
+                profile_id=profile.pk, user_id=profile.user_id,
+                first_name=user.first_name, last_name=user.last_name, last_login=user.last_login,
+                date_of_birth=profile.date_of_birth, gender=profile.gender,
+                gender_display=str(genders.get(profile.gender, '')),
+                country=profile.country.name if profile.country else '',
+                avatar=profile.avatar.url if profile.avatar else '',
+                study=sorted(language.name for language in profile.study.all()),
+                native_in=sorted(language.name for language in profile.native_in.all()),
+                tags=sorted(tag.tag for tag in profile.tags.all())))
+        ProfileSummary.objects.bulk_create(summaries)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('mainapp', '0017_recommendation'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProfileSummary',
+            fields=[
+                ('profile', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='summary', serialize=False, to='mainapp.profile')),
+                ('first_name', models.CharField(blank=True, max_length=150)),
+                ('last_name', models.CharField(blank=True, max_length=150)),
+                ('last_login', models.DateTimeField(blank=True, null=True)),
+                ('date_of_birth', models.DateField(blank=True, null=True)),
+                ('gender', models.CharField(blank=True, max_length=1)),
+                ('gender_display', models.CharField(blank=True, max_length=50)),
+                ('country', models.CharField(blank=True, max_length=50)),
+                ('avatar', models.CharField(blank=True, max_length=200)),
+                ('study', models.JSONField(default=list)),
+                ('native_in', models.JSONField(default=list)),
+                ('tags', models.JSONField(default=list)),
+                ('updated', models.DateTimeField(auto_now=True)),
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='profilesummary',
+            index=models.Index(fields=['date_of_birth'], name='mainapp_pro_date_of_71fd11_idx'),
+        ),
+        migrations.RunPython(create_keyset_index, drop_keyset_index),
+        migrations.RunPython(fill_summaries, migrations.RunPython.noop),
+    ]
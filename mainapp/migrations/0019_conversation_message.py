@@ -0,0 +1,51 @@
+# Generated by Django 4.0.10 on 2026-10-18 19:02
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    replaces = [('mainapp', '0019_message'), ('mainapp', '0020_conversation')]
+
+    dependencies = [
+        ('mainapp', '0018_profile_summary'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Conversation',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('unread_min', models.PositiveIntegerField(default=0)),
+                ('unread_max', models.PositiveIntegerField(default=0)),
+                ('max_profile', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='mainapp.profile')),
+                ('min_profile', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='mainapp.profile')),
+            ],
+            options={
+                'unique_together': {('min_profile', 'max_profile')},
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='conversation',
+            constraint=models.CheckConstraint(check=models.Q(('min_profile__lt', models.F('max_profile'))), name='conversation_profiles_order'),
+        ),
+        migrations.CreateModel(
+            name='Message',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('text', models.TextField(max_length=2000)),
+                ('created', models.DateTimeField(default=django.utils.timezone.now)),
+                ('conversation', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='messages', to='mainapp.conversation')),
+                ('sender', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='mainapp.profile')),
+            ],
+            options={
+                'ordering': ['created', 'id'],
+            },
+        ),
+        migrations.AddIndex(
+            model_name='message',
+            index=models.Index(fields=['conversation', 'created', 'id'], name='message_conversation_idx'),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 4.0.10 on 2026-10-18 19:24
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mainapp', '0019_conversation_message'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='profile',
+            name='avatar_thumbnails',
+            field=models.JSONField(blank=True, default=dict),
+        ),
+        migrations.AddField(
+            model_name='profilesummary',
+            name='avatar_thumbnails',
+            field=models.JSONField(default=dict),
+        ),
+    ]
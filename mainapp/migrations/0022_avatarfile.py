@@ -0,0 +1,40 @@
+# Generated by Django 4.0.10 on 2026-10-18 20:05
+
+from django.db import migrations, models
+from django.db.models import Count
+
+import gotalk.storage
+
+
+def count_references(apps, schema_editor):
+    # avatars uploaded before are counted under their old names
+    Profile = apps.get_model('mainapp', 'Profile')
+    AvatarFile = apps.get_model('mainapp', 'AvatarFile')
+    counts = Profile.objects.exclude(avatar='').values('avatar').annotate(refcount=Count('pk')).order_by()
+    AvatarFile.objects.bulk_create([AvatarFile(name=row['avatar'], refcount=row['refcount']) for row in counts],
+                                   batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mainapp', '0021_avatar_thumbnails'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AvatarFile',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100, unique=True)),
+                ('refcount', models.PositiveIntegerField(default=0)),
+                ('released', models.DateTimeField(blank=True, null=True)),
+            ],
+        ),
+        migrations.AlterField(
+            model_name='profile',
+            name='avatar',
+            field=models.ImageField(blank=True, db_index=True, storage=gotalk.storage.get_avatar_storage, upload_to='avatars'),
+        ),
+        migrations.RunPython(count_references, migrations.RunPython.noop),
+    ]
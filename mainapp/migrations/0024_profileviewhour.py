@@ -0,0 +1,30 @@
+# Generated by Django 4.0.10 on 2026-10-18 21:12
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mainapp', '0023_task'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProfileViewHour',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('hour', models.DateTimeField()),
+                ('views', models.PositiveIntegerField(default=0)),
+                ('profile', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='mainapp.profile')),
+            ],
+            options={
+                'unique_together': {('profile', 'hour')},
+            },
+        ),
+        migrations.AddIndex(
+            model_name='profileviewhour',
+            index=models.Index(fields=['hour'], name='profile_view_hour_idx'),
+        ),
+    ]
@@ -1,9 +1,13 @@
 from django.core.validators import RegexValidator
 from django.contrib.auth.models import AbstractUser, User
 from django.urls import reverse
+from django.utils import timezone
 from django.utils.translation import gettext as _
 from django.db import models
-from datetime import datetime
+from django.db.models import Prefetch
+
+from gotalk.storage import get_avatar_storage
+from datetime import date, datetime
 
 
 class Country(models.Model):
@@ -47,6 +51,9 @@ class LanguageLevel(models.Model):
     def get_absolute_url(self):
         return reverse('profile-language-level', kwargs={'id': self.pk})
 
+    class Meta:
+        indexes = [models.Index(fields=['language', 'level'])]
+
 
 class TagsArea(models.Model):
     area = models.CharField(max_length=100, null=False)
@@ -63,6 +70,17 @@ class Tag(models.Model):
         return self.tag
 
 
+class ProfileQuerySet(models.QuerySet):
+    def for_cards(self):
+        # everything a profile card touches, so a page of cards costs
+        # a fixed number of queries regardless of the page size
+        return self.select_related('user', 'country').prefetch_related(
+            Prefetch('study', queryset=Language.objects.only('id', 'name')),
+            Prefetch('tags', queryset=Tag.objects.only('id', 'tag')),
+            Prefetch('native_in', queryset=Language.objects.only('id', 'name')),
+        )
+
+
 class Profile(models.Model):
     GENDER_CHOICES = (('m', _('male')),
                       ('f', _('female')),
@@ -72,7 +90,10 @@ class Profile(models.Model):
 
     user = models.OneToOneField(User, on_delete=models.CASCADE)
     date_of_birth = models.DateField(blank=True, null=True)
-    avatar = models.ImageField(upload_to='users/%Y/%m/%d', blank=True)
+    # stored by content, avatars/ab/cd/<sha256>.jpeg (gotalk.storage), older uploads keep users/%Y/%m/%d names
+    avatar = models.ImageField(upload_to='avatars', storage=get_avatar_storage, blank=True, db_index=True)
+    # urls of the resized copies of the avatar, made by mainapp.avatars
+    avatar_thumbnails = models.JSONField(default=dict, blank=True)
     phone = models.CharField(validators=[phoneNumberRegex], max_length=16, unique=True, null=True)
     gender = models.CharField(max_length=1, choices=GENDER_CHOICES, default='n', blank=True)
     country = models.ForeignKey(Country, on_delete=models.CASCADE, blank=True, null=True)
@@ -81,6 +102,8 @@ class Profile(models.Model):
     study = models.ManyToManyField(Language, blank=True, through=LanguageLevel)
     partner = models.ManyToManyField('Profile', blank=True, through='Partner', symmetrical=False)
 
+    objects = ProfileQuerySet.as_manager()
+
     def __str__(self):
         return str(self.pk) + ' ' + self.user.first_name + ' ' + self.user.last_name
 
@@ -94,6 +117,7 @@ class Profile(models.Model):
 
     class Meta:
         ordering = ['-user__last_login']
+        indexes = [models.Index(fields=['date_of_birth'])]
 
 
 class Partner(models.Model):
@@ -107,3 +131,150 @@ class Partner(models.Model):
 
     def __str__(self):
         return f'{self.follower.user.first_name}-{self.followed.user.first_name}'
+
+
+class Recommendation(models.Model):
+    # top matches of a profile computed by the nightly build_recommendations batch
+    profile = models.ForeignKey('Profile', on_delete=models.CASCADE, related_name='recommendations')
+    candidate = models.ForeignKey('Profile', on_delete=models.CASCADE, related_name='+')
+    score = models.FloatField()
+    created = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ['profile', '-score']
+        unique_together = [['profile', 'candidate']]
+
+    def __str__(self):
+        return f'{self.profile_id}-{self.candidate_id}: {self.score:.2f}'
+
+
+class AvatarFile(models.Model):
+    """
+    Number of profiles using a stored avatar file. Counted by signals (mainapp.avatars),
+    files which nobody has used for a while are deleted by ``collect_avatars``.
+    """
+    name = models.CharField(max_length=100, unique=True)
+    refcount = models.PositiveIntegerField(default=0)
+    # when refcount became 0
+    released = models.DateTimeField(blank=True, null=True)
+
+    def __str__(self):
+        return '{} ({})'.format(self.name, self.refcount)
+
+
+class ProfileSummary(models.Model):
+    """
+    Listing-ready copy of a profile, kept up to date by signals (see mainapp.summaries),
+    so a page of the index or of the profiles API is a single query without joins.
+    """
+    profile = models.OneToOneField(Profile, on_delete=models.CASCADE, primary_key=True, related_name='summary')
+    user = models.OneToOneField(User, on_delete=models.CASCADE, related_name='+')
+    first_name = models.CharField(max_length=150, blank=True)
+    last_name = models.CharField(max_length=150, blank=True)
+    last_login = models.DateTimeField(blank=True, null=True)
+    date_of_birth = models.DateField(blank=True, null=True)
+    gender = models.CharField(max_length=1, blank=True)
+    gender_display = models.CharField(max_length=50, blank=True)
+    country = models.CharField(max_length=50, blank=True)
+    avatar = models.CharField(max_length=200, blank=True)
+    avatar_thumbnails = models.JSONField(default=dict)
+    study = models.JSONField(default=list)
+    native_in = models.JSONField(default=list)
+    tags = models.JSONField(default=list)
+    updated = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        # (last_login, user_id) index of the keyset pagination is created by migration 0018
+        indexes = [models.Index(fields=['date_of_birth'])]
+
+    def __str__(self):
+        return str(self.profile_id) + ' ' + self.first_name + ' ' + self.last_name
+
+    def get_absolute_url(self):
+        return reverse('profile', kwargs={'profile_id': self.profile_id})
+
+    @property
+    def age(self):
+        # not stored, it would be stale on the next birthday
+        if self.date_of_birth:
+            today = date.today()
+            return today.year - self.date_of_birth.year - (
+                (today.month, today.day) < (self.date_of_birth.month, self.date_of_birth.day))
+
+
+class Conversation(models.Model):
+    """
+    Chat of two partners, the pair is stored in canonical order (min_profile < max_profile).
+    unread_* are counters of messages the profile hasn't read, kept by mainapp.conversations.
+    """
+    min_profile = models.ForeignKey(Profile, on_delete=models.CASCADE, related_name='+')
+    max_profile = models.ForeignKey(Profile, on_delete=models.CASCADE, related_name='+')
+    unread_min = models.PositiveIntegerField(default=0)
+    unread_max = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        unique_together = [['min_profile', 'max_profile']]
+        constraints = [models.CheckConstraint(check=models.Q(min_profile__lt=models.F('max_profile')),
+                                              name='conversation_profiles_order')]
+
+    def __str__(self):
+        return f'{self.min_profile_id}-{self.max_profile_id}'
+
+
+class Message(models.Model):
+    # chat message, written in batches by mainapp.chat.MessageWriter
+    # message_conversation_idx starts with the column, an index of its own would only slow down writes
+    conversation = models.ForeignKey(Conversation, on_delete=models.CASCADE, related_name='messages', db_index=False)
+    sender = models.ForeignKey(Profile, on_delete=models.CASCADE, related_name='+')
+    text = models.TextField(max_length=2000)
+    # the time the server got the message, not the time it was written
+    created = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        ordering = ['created', 'id']
+        # history of a conversation is read backwards by (created, id), see mainapp.conversations
+        indexes = [models.Index(fields=['conversation', 'created', 'id'], name='message_conversation_idx')]
+
+    def __str__(self):
+        return f'{self.conversation_id} {self.sender_id}: {self.text[:20]}'
+
+
+class Task(models.Model):
+    # background task of mainapp.tasks, deleted when it is done
+    QUEUED = 'queued'
+    FAILED = 'failed'
+    STATE_CHOICES = ((QUEUED, 'queued'), (FAILED, 'failed'))
+
+    name = models.CharField(max_length=200)     # dotted path of the function
+    args = models.JSONField(default=list)
+    kwargs = models.JSONField(default=dict)
+    state = models.CharField(max_length=6, choices=STATE_CHOICES, default=QUEUED)
+    # due time, moved by the lease while a worker runs the task
+    run_at = models.DateTimeField(default=timezone.now)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    lease = models.CharField(max_length=32, blank=True)
+    error = models.TextField(blank=True)
+    created = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        # workers look for (state='queued', run_at <= now)
+        indexes = [models.Index(fields=['state', 'run_at'], name='task_due_idx')]
+
+    def __str__(self):
+        return f'{self.name} {self.state} {self.attempts}'
+
+
+class ProfileViewHour(models.Model):
+    # views of a profile during an hour, written by batches by mainapp.popularity
+    # the unique (profile, hour) index starts with the column, an index of its own would only slow down writes
+    profile = models.ForeignKey(Profile, on_delete=models.CASCADE, related_name='+', db_index=False)
+    hour = models.DateTimeField()
+    views = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        unique_together = [['profile', 'hour']]
+        # "popular this week" reads and pruning go by time
+        indexes = [models.Index(fields=['hour'], name='profile_view_hour_idx')]
+
+    def __str__(self):
+        return f'{self.profile_id} {self.hour:%Y-%m-%d %H}h: {self.views}'
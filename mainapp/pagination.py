@@ -0,0 +1,167 @@
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from binascii import Error as BinasciiError
+from operator import attrgetter
+
+from django.conf import settings
+from django.db.models import F, Q
+from django.utils.dateparse import parse_datetime
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+PROFILES_PAGE_SIZE = getattr(settings, 'PROFILES_PAGE_SIZE', 20)
+MESSAGES_PAGE_SIZE = getattr(settings, 'MESSAGES_PAGE_SIZE', 50)
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+# a cursor is (datetime or None, id): (last_login, user_id) of profiles, (created, id) of messages
+def encode_cursor(last_login, user_id):
+    value = '{}|{}'.format(last_login.isoformat() if last_login else '', user_id)
+    return urlsafe_b64encode(value.encode()).decode()
+
+
+def decode_cursor(cursor):
+    try:
+        last_login, user_id = urlsafe_b64decode(cursor.encode()).decode().split('|')
+        user_id = int(user_id)
+        if last_login:
+            last_login = parse_datetime(last_login)
+            if last_login is None:
+                raise InvalidCursor(cursor)
+        return last_login or None, user_id
+    except (BinasciiError, UnicodeError, ValueError):
+        raise InvalidCursor(cursor)
+
+
+def keyset_order(queryset, last_login='user__last_login'):
+    # the same order as Profile.Meta.ordering, never logged in users go last,
+    # user_id makes it unique. Backed by the auth_user (last_login, id) index
+    # or by profile_summary_keyset_idx for ProfileSummary (last_login='last_login')
+    return queryset.order_by(F(last_login).desc(nulls_last=True), '-user_id')
+
+
+def after_q(last_login, user_id, field='user__last_login'):
+    if last_login is None:
+        return Q(**{field + '__isnull': True, 'user_id__lt': user_id})
+    return (Q(**{field + '__lte': last_login}) & (Q(**{field + '__lt': last_login}) | Q(user_id__lt=user_id))
+            | Q(**{field + '__isnull': True}))
+
+
+class CursorPage:
+    """
+    A page of the keyset pagination, looks like a ``Page`` for templates
+    but knows only the way forward, so there is no COUNT(*) and no OFFSET.
+    """
+    def __init__(self, object_list, next_cursor, cursor):
+        self.object_list = object_list
+        self.next_cursor = next_cursor
+        self.cursor = cursor
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def has_next(self):
+        return self.next_cursor is not None
+
+    def has_previous(self):
+        return self.cursor is not None
+
+    def has_other_pages(self):
+        return self.has_next() or self.has_previous()
+
+
+def paginate_by_cursor(queryset, cursor=None, page_size=PROFILES_PAGE_SIZE, last_login='user__last_login'):
+    """
+    Fetches ``page_size`` profiles after ``cursor`` ordered by (last_login, user_id).
+    Page cost doesn't depend on how deep the cursor is.
+    Raises InvalidCursor if the cursor is broken.
+    """
+    queryset = keyset_order(queryset, last_login)
+    if cursor:
+        queryset = queryset.filter(after_q(*decode_cursor(cursor), field=last_login))
+    object_list = list(queryset[:page_size + 1])
+    next_cursor = None
+    if len(object_list) > page_size:
+        object_list = object_list[:page_size]
+        last = object_list[-1]
+        next_cursor = encode_cursor(attrgetter(last_login.replace('__', '.'))(last), last.user_id)
+    return CursorPage(object_list, next_cursor, cursor)
+
+
+class ProfileCursorPagination(BasePagination):
+    cursor_query_param = 'cursor'
+    page_size = PROFILES_PAGE_SIZE
+    last_login = 'last_login'  # the API lists ProfileSummary
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        try:
+            self.page = paginate_by_cursor(queryset, request.query_params.get(self.cursor_query_param),
+                                           self.page_size, self.last_login)
+        except InvalidCursor:
+            raise NotFound('Invalid cursor')
+        return self.page.object_list
+
+    def get_next_link(self):
+        if not self.page.has_next():
+            return None
+        url = self.request.build_absolute_uri()
+        return replace_query_param(url, self.cursor_query_param, self.page.next_cursor)
+
+    def get_paginated_response(self, data):
+        return Response({'next': self.get_next_link(), 'results': data})
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'properties': {
+                'next': {'type': 'string', 'nullable': True},
+                'results': schema,
+            },
+        }
+
+
+def before_q(created, pk):
+    # created <= bounds the index range, (created, id) < (cursor) alone would scan it from the end
+    return Q(created__lte=created) & (Q(created__lt=created) | Q(pk__lt=pk))
+
+
+def paginate_backwards(queryset, cursor=None, page_size=MESSAGES_PAGE_SIZE):
+    """
+    Fetches ``page_size`` rows before ``cursor`` ordered by (created, id), the newest first,
+    for the history of a conversation (the message_conversation_idx index).
+    Raises InvalidCursor if the cursor is broken.
+    """
+    queryset = queryset.order_by('-created', '-pk')
+    if cursor:
+        created, pk = decode_cursor(cursor)
+        if created is None:
+            raise InvalidCursor(cursor)
+        queryset = queryset.filter(before_q(created, pk))
+    object_list = list(queryset[:page_size + 1])
+    next_cursor = None
+    if len(object_list) > page_size:
+        object_list = object_list[:page_size]
+        next_cursor = encode_cursor(object_list[-1].created, object_list[-1].pk)
+    return CursorPage(object_list, next_cursor, cursor)
+
+
+class MessageCursorPagination(ProfileCursorPagination):
+    # ``next`` is the page of older messages
+    page_size = MESSAGES_PAGE_SIZE
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        try:
+            self.page = paginate_backwards(queryset, request.query_params.get(self.cursor_query_param),
+                                           self.page_size)
+        except InvalidCursor:
+            raise NotFound('Invalid cursor')
+        return self.page.object_list
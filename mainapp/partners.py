@@ -0,0 +1,123 @@
+from datetime import date
+
+from django.db import connection, transaction
+from django.db.models import Exists, Q
+
+from .models import Partner, Profile
+
+# relationship of the viewer to another profile
+NONE = 'none'
+REQUESTED = 'requested'    # viewer asked the profile to practice, no answer yet
+INCOMING = 'incoming'      # the profile asked the viewer, no answer yet
+PARTNERS = 'partners'      # request was accepted
+
+
+class Relations:
+    """
+    All partner rows of the viewer, loaded with one query over both directions.
+    Knows the viewer's pending requests, partners and the state with any profile.
+    """
+    def __init__(self, viewer_id, rows):
+        self.viewer_id = viewer_id
+        self.requests = []
+        self.partners = []
+        self.states = {}
+        for row in rows:
+            viewer_is_follower = row.follower_id == viewer_id
+            other = row.followed if viewer_is_follower else row.follower
+            if row.response_date is not None:
+                self.states[other.pk] = PARTNERS
+                self.partners.append(other)
+            elif self.states.get(other.pk) != PARTNERS:
+                self.states[other.pk] = REQUESTED if viewer_is_follower else INCOMING
+                if not viewer_is_follower:
+                    self.requests.append(row)
+        self.partners.sort(key=lambda profile: profile.user.last_login.timestamp()
+                           if profile.user.last_login else 0, reverse=True)
+
+    def state(self, profile_id):
+        return self.states.get(profile_id, NONE)
+
+
+def get_relations(viewer_id):
+    if viewer_id is None:
+        return Relations(None, [])
+    rows = (Partner.objects
+            .filter(Q(followed_id=viewer_id) | Q(follower_id=viewer_id))
+            .select_related('follower__user', 'followed__user')
+            .order_by('-request_date', '-pk'))
+    return Relations(viewer_id, rows)
+
+
+# requests, accepts and rejects work with ids only, every change is one statement
+# (a request locks the pair first where the database has row locks)
+def pair_q(a, b):
+    return Q(follower_id=a, followed_id=b) | Q(follower_id=b, followed_id=a)
+
+
+def lock_pair(a, b):
+    # crossing requests of the same moment would both miss the row of the other one,
+    # both profiles are locked in one order; sqlite has no row locks and one writer
+    if connection.features.has_select_for_update:
+        list(Profile.objects.select_for_update().filter(pk__in=[a, b]).order_by('pk').values_list('pk', flat=True))
+
+
+def send_request(follower_id, followed_id):
+    """
+    INSERT ... ON CONFLICT DO NOTHING of the request row, double clicks
+    and parallel requests can't create a second row or fail. The same statement
+    inserts nothing when there is a row of the other direction: if it is a pending
+    request to the sender, both asked each other and it is accepted instead.
+    Returns True if the request is new or accepted, False if it exists or there is no such profile.
+    """
+    if follower_id == followed_id:
+        return False
+    qn = connection.ops.quote_name
+    sql = ('INSERT INTO {table} ({follower}, {followed}, {request_date}, {response_date}) '
+           'SELECT %s, {pk}, %s, NULL FROM {profiles} WHERE {pk} = %s '
+           'AND NOT EXISTS (SELECT 1 FROM {table} WHERE {follower} = %s AND {followed} = %s) '
+           'ON CONFLICT ({followed}, {follower}) DO NOTHING').format(
+        table=qn(Partner._meta.db_table), profiles=qn(Profile._meta.db_table), pk=qn(Profile._meta.pk.column),
+        follower=qn('follower_id'), followed=qn('followed_id'),
+        request_date=qn('request_date'), response_date=qn('response_date'))
+    with transaction.atomic():
+        lock_pair(follower_id, followed_id)
+        with connection.cursor() as cursor:
+            cursor.execute(sql, [follower_id, date.today(), followed_id, followed_id, follower_id])
+            if cursor.rowcount == 1:
+                return True
+        return accept_request(follower_id, followed_id)
+
+
+def accept_request(viewer_id, requester_id):
+    """
+    One UPDATE of the rows of both directions, only when ``requester_id``
+    asked the viewer. Returns True if they became partners.
+    """
+    incoming = Partner.objects.filter(follower_id=requester_id, followed_id=viewer_id)
+    with transaction.atomic():
+        return bool(Partner.objects.filter(pair_q(viewer_id, requester_id), response_date__isnull=True)
+                    .filter(Exists(incoming)).update(response_date=date.today()))
+
+
+def reject_request(viewer_id, other_id):
+    # one DELETE of both directions: rejects a request, cancels the viewer's one or ends a partnership
+    with transaction.atomic():
+        deleted, _ = Partner.objects.filter(pair_q(viewer_id, other_id)).delete()
+    return bool(deleted)
+
+
+ACTIONS = {'request': send_request,
+           'accept': accept_request,
+           'reject': reject_request}
+
+
+def get_state(viewer_id, profile_id):
+    # relationship with one profile, without loading profiles
+    rows = Partner.objects.filter(pair_q(viewer_id, profile_id)).values_list('follower_id', 'response_date')
+    state = NONE
+    for follower_id, response_date in rows:
+        if response_date is not None:
+            return PARTNERS
+        state = REQUESTED if follower_id == viewer_id else INCOMING
+    return state
@@ -0,0 +1,143 @@
+"""
+Profile views and the "popular this week" list.
+
+A view of a profile page adds one to a counter in the memory of the process,
+there is no write per view. At most every VIEWS_FLUSH_INTERVAL seconds the
+request that comes then hands the counters to a background task (mainapp.tasks,
+one Task row with the database backend), ``save_view_counts`` writes them as
+hourly rollups (ProfileViewHour) with one INSERT ... ON CONFLICT DO UPDATE SET
+views = views + n per 300 rows, sorted, so parallel flushes of several processes
+lock rows in the same order. A popular profile costs one row update per process
+and interval however many views it gets. Counts of the last interval of a
+process are lost when it stops: nothing is written at exit, the database may be
+gone by then (tests) and it is no place to block a shutdown.
+
+``popular_profiles`` sums the rollups of the last days, the list is cached for
+POPULAR_CACHE_TIMEOUT. ``prune_profile_views`` deletes rollups older than VIEWS_KEEP_DAYS.
+"""
+import logging
+import threading
+import time
+from collections import Counter
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DatabaseError, connection, transaction
+from django.db.models import Sum
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from .models import Profile, ProfileViewHour
+from .tasks import enqueue
+
+VIEWS_FLUSH_INTERVAL = getattr(settings, 'VIEWS_FLUSH_INTERVAL', 10)
+VIEWS_KEEP_DAYS = getattr(settings, 'VIEWS_KEEP_DAYS', 30)
+POPULAR_DAYS = getattr(settings, 'POPULAR_DAYS', 7)
+POPULAR_COUNT = getattr(settings, 'POPULAR_COUNT', 5)
+POPULAR_CACHE_TIMEOUT = getattr(settings, 'POPULAR_CACHE_TIMEOUT', 60 * 10)
+# 3 parameters a row, under the 999 of old sqlite versions
+SAVE_BATCH_SIZE = 300
+
+logger = logging.getLogger(__name__)
+
+
+def hour_of(moment):
+    return moment.replace(minute=0, second=0, microsecond=0)
+
+
+def save_views(counts):
+    # adds {(profile id, hour): views} to the rollups
+    if not counts:
+        return
+    qn = connection.ops.quote_name
+    names = dict(table=qn(ProfileViewHour._meta.db_table), profile=qn('profile_id'), hour=qn('hour'),
+                 views=qn('views'), profiles=qn(Profile._meta.db_table), pk=qn(Profile._meta.pk.column))
+    rows = sorted(counts.items())
+    with transaction.atomic():
+        with connection.cursor() as cursor:
+            for start in range(0, len(rows), SAVE_BATCH_SIZE):
+                batch = rows[start:start + SAVE_BATCH_SIZE]
+                # views of profiles deleted meanwhile are left out instead of failing the batch
+                sql = ('INSERT INTO {table} ({profile}, {hour}, {views}) '
+                       'SELECT column1, column2, column3 FROM (VALUES {values}) AS counts '
+                       'WHERE EXISTS (SELECT 1 FROM {profiles} WHERE {profiles}.{pk} = counts.column1) '
+                       'ON CONFLICT ({profile}, {hour}) DO UPDATE SET {views} = {table}.{views} + excluded.{views}'
+                       ).format(values=', '.join(['(%s, %s, %s)'] * len(batch)), **names)
+                params = []
+                for (profile_id, moment), count in batch:
+                    params += [profile_id, connection.ops.adapt_datetimefield_value(moment), count]
+                cursor.execute(sql, params)
+
+
+class ViewCounter:
+    def __init__(self, interval=VIEWS_FLUSH_INTERVAL):
+        self.interval = interval
+        self.counts = Counter()
+        self.lock = threading.Lock()
+        self.next_flush = time.monotonic() + interval
+
+    def add(self, profile_id, now=None):
+        key = (profile_id, hour_of(now or timezone.now()))
+        with self.lock:
+            self.counts[key] += 1
+            if time.monotonic() < self.next_flush:
+                return
+            counts = self.take()
+        self.save(counts)
+
+    def take(self):
+        counts, self.counts = self.counts, Counter()
+        self.next_flush = time.monotonic() + self.interval
+        return counts
+
+    def save(self, counts):
+        if not counts:
+            return
+        try:
+            enqueue(save_view_counts, [[profile_id, moment.isoformat(), count]
+                                       for (profile_id, moment), count in counts.items()])
+        except DatabaseError:
+            # views aren't worth failing a page for
+            logger.exception('%s profile views were not saved', sum(counts.values()))
+
+    def flush(self):
+        with self.lock:
+            counts = self.take()
+        self.save(counts)
+
+
+def save_view_counts(rows):
+    # task of ViewCounter.save, [[profile id, hour, views], ...]
+    save_views({(profile_id, parse_datetime(moment)): count for profile_id, moment, count in rows})
+
+
+counter = ViewCounter()
+
+
+def record_view(profile_id):
+    counter.add(profile_id)
+
+
+def popular_key(days):
+    return 'popular-profiles-%s' % days
+
+
+def popular_profiles(days=POPULAR_DAYS, count=POPULAR_COUNT):
+    # [(profile id, views), ...] of the most viewed profiles of the last days
+    key = popular_key(days)
+    popular = cache.get(key)
+    if popular is None:
+        since = hour_of(timezone.now()) - timedelta(days=days)
+        popular = list(ProfileViewHour.objects
+                       .filter(hour__gte=since)
+                       .values('profile_id')
+                       .annotate(total=Sum('views'))
+                       .order_by('-total', 'profile_id')
+                       .values_list('profile_id', 'total')[:count])
+        cache.set(key, popular, POPULAR_CACHE_TIMEOUT)
+    return popular
+
+
+def prune_views(days=VIEWS_KEEP_DAYS):
+    return ProfileViewHour.objects.filter(hour__lt=hour_of(timezone.now()) - timedelta(days=days)).delete()[0]
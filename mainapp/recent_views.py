@@ -0,0 +1,33 @@
+"""
+"Recently visited profiles" of a user: a ring of the last profile ids in the cache,
+one get and at most one set per profile view, nothing goes to the session.
+"""
+from django.conf import settings
+from django.core.cache import cache
+
+RECENT_VIEWS_MAX = getattr(settings, 'RECENT_VIEWS_MAX', 5)
+RECENT_VIEWS_TIMEOUT = getattr(settings, 'RECENT_VIEWS_TIMEOUT', 60 * 60 * 24 * 30)
+
+
+def recent_views_key(request):
+    if request.user.is_authenticated:
+        return 'recent-views-user-%s' % request.user.pk
+    # anonymous visitors are tracked only if they already have a session
+    if request.session.session_key:
+        return 'recent-views-session-%s' % request.session.session_key
+    return None
+
+
+def push_recent_view(request, profile_id):
+    """
+    Remembers the profile view, returns ids of profiles visited before it, the latest first.
+    """
+    key = recent_views_key(request)
+    if key is None:
+        return []
+    ids = cache.get(key, [])
+    previous = [pk for pk in ids if pk != profile_id][:RECENT_VIEWS_MAX]
+    ring = [profile_id] + previous
+    if ring != ids:
+        cache.set(key, ring, RECENT_VIEWS_TIMEOUT)
+    return previous
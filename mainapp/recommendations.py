@@ -0,0 +1,244 @@
+"""
+Language exchange partner recommendations.
+
+A match is somebody native in a language the viewer studies, or studying a
+language the viewer is native in, best of all both (reciprocal). Shared tags
+add a little. Scoring runs over an in-memory inverted index:
+
+    language -> natives, language -> {learner: level}, tag -> profiles
+
+Every process keeps its own index. It is built from three values_list queries,
+kept up to date by signals for changes made in the same process and rebuilt
+when it is older than RECOMMENDATIONS_INDEX_TTL or when ``rebuild_recommendations``
+bumps the shared version.
+
+Requests never build it: ``recommend(..., wait=False)`` answers from the index
+there is, even a stale one, and starts a build in a thread of the process when
+it is missing or stale (no recommendations until the first build is done).
+gotalk.wsgi/asgi start the first build when the server starts.
+"""
+import heapq
+import logging
+import threading
+import time
+from collections import defaultdict
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connections
+from django.db.models import Q
+
+from .models import LanguageLevel, Partner, Profile
+
+RECOMMENDATIONS_INDEX_TTL = getattr(settings, 'RECOMMENDATIONS_INDEX_TTL', 60 * 10)
+RECOMMENDATIONS_COUNT = getattr(settings, 'RECOMMENDATIONS_COUNT', 10)
+VERSION_KEY = 'recommendations-index-version'
+# False leaves stale or missing indexes of requests alone (tests)
+BUILD_IN_BACKGROUND = getattr(settings, 'RECOMMENDATIONS_BUILD_IN_BACKGROUND', True)
+
+logger = logging.getLogger(__name__)
+
+# learners of higher levels are better partners to talk with
+LEVEL_WEIGHTS = {'A1': 0.5, 'A2': 0.6, 'B1': 0.8, 'B2': 0.9, 'C1': 1.0, 'C2': 1.0}
+NATIVE_LEVEL = 'NV'
+RECIPROCAL_BONUS = 2.0
+TAG_WEIGHT = 0.1
+
+
+class MatchIndex:
+    def __init__(self):
+        self.natives = defaultdict(set)         # language id -> profile ids
+        self.learners = defaultdict(dict)       # language id -> {profile id: level}
+        self.tagged = defaultdict(set)          # tag id -> profile ids
+        self.profile_natives = defaultdict(set)
+        self.profile_study = defaultdict(dict)
+        self.profile_tags = defaultdict(set)
+        self.lock = threading.Lock()
+
+    @classmethod
+    def build(cls):
+        index = cls()
+        for profile_id, language_id in Profile.native_in.through.objects.values_list('profile_id', 'language_id'):
+            index.add_native(profile_id, language_id)
+        for profile_id, language_id, level in LanguageLevel.objects.values_list('profile_id', 'language_id', 'level'):
+            index.add_level(profile_id, language_id, level)
+        for profile_id, tag_id in Profile.tags.through.objects.values_list('profile_id', 'tag_id'):
+            index.profile_tags[profile_id].add(tag_id)
+            index.tagged[tag_id].add(profile_id)
+        return index
+
+    def add_native(self, profile_id, language_id):
+        self.profile_natives[profile_id].add(language_id)
+        self.natives[language_id].add(profile_id)
+
+    def add_level(self, profile_id, language_id, level):
+        if level == NATIVE_LEVEL:
+            self.add_native(profile_id, language_id)
+        else:
+            self.profile_study[profile_id][language_id] = level
+            self.learners[language_id][profile_id] = level
+
+    def remove_profile(self, profile_id):
+        with self.lock:
+            for language_id in self.profile_natives.pop(profile_id, ()):
+                self.natives[language_id].discard(profile_id)
+            for language_id in self.profile_study.pop(profile_id, {}):
+                self.learners[language_id].pop(profile_id, None)
+            for tag_id in self.profile_tags.pop(profile_id, ()):
+                self.tagged[tag_id].discard(profile_id)
+
+    def update_profile(self, profile_id):
+        natives = list(Profile.native_in.through.objects.filter(profile_id=profile_id)
+                       .values_list('language_id', flat=True))
+        levels = list(LanguageLevel.objects.filter(profile_id=profile_id).values_list('language_id', 'level'))
+        tags = list(Profile.tags.through.objects.filter(profile_id=profile_id).values_list('tag_id', flat=True))
+        self.remove_profile(profile_id)
+        with self.lock:
+            for language_id in natives:
+                self.add_native(profile_id, language_id)
+            for language_id, level in levels:
+                self.add_level(profile_id, language_id, level)
+            for tag_id in tags:
+                self.profile_tags[profile_id].add(tag_id)
+                self.tagged[tag_id].add(profile_id)
+
+    def scores(self, profile_id):
+        """
+        {candidate id: score} of everybody sharing a language with the profile
+        """
+        teach = defaultdict(float)   # candidate is native in what the profile studies
+        learn = defaultdict(float)   # candidate studies what the profile is native in
+        with self.lock:
+            for language_id in self.profile_study.get(profile_id, {}):
+                for candidate in self.natives.get(language_id, ()):
+                    teach[candidate] += 1.0
+            for language_id in self.profile_natives.get(profile_id, ()):
+                for candidate, level in self.learners.get(language_id, {}).items():
+                    learn[candidate] += LEVEL_WEIGHTS.get(level, 0.5)
+            candidates = teach.keys() | learn.keys()
+            shared_tags = defaultdict(int)
+            for tag_id in self.profile_tags.get(profile_id, ()):
+                for candidate in self.tagged.get(tag_id, ()):
+                    if candidate in candidates:
+                        shared_tags[candidate] += 1
+        scores = {}
+        for candidate in candidates:
+            score = teach.get(candidate, 0.0) + learn.get(candidate, 0.0)
+            if candidate in teach and candidate in learn:
+                score += RECIPROCAL_BONUS
+            scores[candidate] = score + TAG_WEIGHT * shared_tags.get(candidate, 0)
+        scores.pop(profile_id, None)
+        return scores
+
+
+_index = None
+_index_version = None
+_index_built = 0
+_build_lock = threading.Lock()
+_builder = None
+
+
+def current_version():
+    version = cache.get(VERSION_KEY)
+    if version is None:
+        version = time.time()
+        if not cache.add(VERSION_KEY, version, None):
+            version = cache.get(VERSION_KEY, version)
+    return version
+
+
+def is_fresh(version):
+    return _index is not None and version == _index_version and time.time() - _index_built <= RECOMMENDATIONS_INDEX_TTL
+
+
+def build_index():
+    global _index, _index_version, _index_built
+    started = time.time()
+    version = current_version()
+    index = MatchIndex.build()
+    with _build_lock:
+        # a build which started later may have finished first
+        if started >= _index_built:
+            _index, _index_version, _index_built = index, version, started
+    return index
+
+
+def build_in_background():
+    global _builder
+
+    def run():
+        try:
+            build_index()
+        except Exception:
+            logger.exception('recommendations index was not built')
+        finally:
+            connections.close_all()
+
+    with _build_lock:
+        if _builder is not None and _builder.is_alive():
+            return _builder
+        _builder = threading.Thread(target=run, name='recommendations-index', daemon=True)
+        _builder.start()
+        return _builder
+
+
+def warm_index():
+    # the first build of a server process, before its first request
+    if BUILD_IN_BACKGROUND:
+        build_in_background()
+
+
+def get_index(wait=True):
+    """
+    The index of this process. ``wait=False`` (requests) returns the index there is,
+    None before the first build, and builds a missing or stale one in the background.
+    """
+    version = current_version()
+    if is_fresh(version):
+        return _index
+    if not wait:
+        if BUILD_IN_BACKGROUND:
+            build_in_background()
+        return _index
+    with _build_lock:
+        if is_fresh(version):
+            return _index
+    return build_index()
+
+
+def bump_index_version():
+    # every process builds its index again on the next use
+    cache.set(VERSION_KEY, time.time(), None)
+
+
+def update_profile(profile_id):
+    if _index is not None:
+        _index.update_profile(profile_id)
+
+
+def remove_profile(profile_id):
+    if _index is not None:
+        _index.remove_profile(profile_id)
+
+
+def partner_ids(profile_id):
+    links = Partner.objects.filter(Q(follower_id=profile_id) | Q(followed_id=profile_id)) \
+        .values_list('follower_id', 'followed_id')
+    return {pk for link in links for pk in link} - {profile_id}
+
+
+def recommend(profile_id, k=RECOMMENDATIONS_COUNT, wait=True):
+    """
+    [(profile id, score), ...] of the best ``k`` matches for the profile,
+    profiles with a Partner row in any direction are left out.
+    With ``wait=False`` nothing is built, [] while there is no index yet.
+    """
+    index = get_index(wait)
+    if index is None:
+        return []
+    scores = index.scores(profile_id)
+    if not scores:
+        return []
+    for pk in partner_ids(profile_id):
+        scores.pop(pk, None)
+    return heapq.nlargest(k, scores.items(), key=lambda item: (item[1], -item[0]))
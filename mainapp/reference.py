@@ -0,0 +1,101 @@
+"""
+Reference data (countries, languages, tags) served as pre-serialized JSON.
+
+Every process keeps the rendered blobs in memory. A version of each set lives
+in the shared cache, so a save in one worker makes the other workers render
+their blob again on the next request.
+"""
+import hashlib
+import math
+import threading
+import time
+
+from django.core.cache import cache
+from django.db.models import Prefetch
+from rest_framework.renderers import JSONRenderer
+
+from .models import Country, Language, Tag, TagsArea
+from .serializers import CountrySerializer, LanguageSerializer, TagsAreaSerializer
+
+
+def countries():
+    return CountrySerializer(Country.objects.order_by('name'), many=True).data
+
+
+def languages():
+    return LanguageSerializer(Language.objects.all(), many=True).data
+
+
+def tags():
+    areas = TagsArea.objects.order_by('area').prefetch_related(
+        Prefetch('tag_set', queryset=Tag.objects.order_by('tag')))
+    return TagsAreaSerializer(areas, many=True).data
+
+
+REFERENCE_DATA = {'countries': countries,
+                  'languages': languages,
+                  'tags': tags}
+
+# model -> reference data sets to render again when it changes
+REFERENCE_MODELS = {Country: ('countries',),
+                    Language: ('languages',),
+                    TagsArea: ('tags',),
+                    Tag: ('tags',)}
+
+
+class ReferenceBlob:
+    def __init__(self, body, version):
+        self.body = body
+        self.version = version
+        self.etag = '"%s"' % hashlib.md5(body).hexdigest()
+        # versions are whole seconds of the last change
+        self.last_modified = int(version)
+
+
+_blobs = {}
+_lock = threading.Lock()
+
+
+def version_key(name):
+    return 'reference-data-version-%s' % name
+
+
+def new_version(previous=None):
+    # Last-Modified has whole seconds: rounded up and after the previous version, two
+    # changes within a second must not have the same date (If-Modified-Since would 304)
+    version = math.ceil(time.time())
+    if previous is not None:
+        version = max(version, int(previous) + 1)
+    return version
+
+
+def get_version(name):
+    version = cache.get(version_key(name))
+    if version is None:
+        version = new_version()
+        if not cache.add(version_key(name), version, None):
+            version = cache.get(version_key(name), version)
+    return version
+
+
+def get_reference_blob(name):
+    """
+    JSON of the reference data set ``name``, rendered again only when its version changes.
+    """
+    version = get_version(name)
+    blob = _blobs.get(name)
+    if blob is None or blob.version != version:
+        with _lock:
+            blob = _blobs.get(name)
+            if blob is None or blob.version != version:
+                body = JSONRenderer().render(REFERENCE_DATA[name]())
+                blob = _blobs[name] = ReferenceBlob(body, version)
+    return blob
+
+
+def invalidate_reference(*names):
+    previous = cache.get_many([version_key(name) for name in names])
+    cache.set_many({version_key(name): new_version(previous.get(version_key(name))) for name in names}, None)
+    with _lock:
+        for name in names:
+            _blobs.pop(name, None)
@@ -1,8 +1,56 @@
 from rest_framework import serializers
-from .models import Country
+from .models import Country, Language, Message, ProfileSummary, Tag, TagsArea
 
 
 class CountrySerializer(serializers.ModelSerializer):
         class Meta:
             model = Country
-            fields = '__all__'
\ No newline at end of file
+            fields = '__all__'
+
+
+class ProfileSummarySerializer(serializers.ModelSerializer):
+        # a profile for the API, read from the ProfileSummary row only
+        id = serializers.IntegerField(source='profile_id', read_only=True)
+        gender = serializers.CharField(source='gender_display', read_only=True)
+        country = serializers.SerializerMethodField()
+        avatar = serializers.SerializerMethodField()
+
+        class Meta:
+            model = ProfileSummary
+            fields = ('id', 'first_name', 'last_name', 'last_login', 'age', 'gender',
+                      'country', 'avatar', 'study', 'native_in', 'tags')
+
+        def get_country(self, summary):
+            return summary.country or None
+
+        def get_avatar(self, summary):
+            if not summary.avatar:
+                return None
+            request = self.context.get('request')
+            return request.build_absolute_uri(summary.avatar) if request else summary.avatar
+
+
+class LanguageSerializer(serializers.ModelSerializer):
+        class Meta:
+            model = Language
+            fields = ('id', 'name')
+
+
+class TagSerializer(serializers.ModelSerializer):
+        class Meta:
+            model = Tag
+            fields = ('id', 'tag')
+
+
+class TagsAreaSerializer(serializers.ModelSerializer):
+        tags = TagSerializer(source='tag_set', many=True, read_only=True)
+
+        class Meta:
+            model = TagsArea
+            fields = ('id', 'area', 'tags')
+
+
+class MessageSerializer(serializers.ModelSerializer):
+        class Meta:
+            model = Message
+            fields = ('id', 'sender', 'text', 'created')
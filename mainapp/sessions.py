@@ -0,0 +1,30 @@
+from django.conf import settings
+from django.contrib.sessions.backends.cached_db import KEY_PREFIX
+from django.contrib.sessions.models import Session
+from django.core.cache import caches
+from django.utils import timezone
+
+SESSIONS_DELETE_BATCH = getattr(settings, 'SESSIONS_DELETE_BATCH', 1000)
+
+
+def delete_sessions(queryset, batch_size=SESSIONS_DELETE_BATCH):
+    """
+    Deletes sessions of ``queryset`` by batches of primary keys, so neither
+    the rows nor a huge DELETE are held at once. Cached copies of cached_db
+    sessions go too, otherwise they would stay valid. Returns the number deleted.
+    """
+    cache = caches[settings.SESSION_CACHE_ALIAS]
+    clear_cache = settings.SESSION_ENGINE == 'django.contrib.sessions.backends.cached_db'
+    deleted = 0
+    while True:
+        keys = list(queryset.order_by().values_list('pk', flat=True)[:batch_size])
+        if not keys:
+            return deleted
+        # no relations or signals, one DELETE without fetching the rows
+        deleted += Session.objects.filter(pk__in=keys).delete()[0]
+        if clear_cache:
+            cache.delete_many([KEY_PREFIX + key for key in keys])
+
+
+def expired_sessions():
+    return Session.objects.filter(expire_date__lt=timezone.now())
@@ -1,8 +1,16 @@
-from django.db.models.signals import post_save
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_save
 from django.core.signals import request_finished
 from django.dispatch import receiver
 from django.contrib.auth.models import User
-from .models import Profile
+from .avatars import avatar_changed, release_avatar, replace_avatar, schedule_thumbnails, stored_avatar
+from .cards import bump_card_version
+from .current_profile import invalidate_current_profile
+from .facets import invalidate_facets
+from .models import Country, Language, LanguageLevel, Profile, ProfileSummary, Tag, TagsArea
+from .recommendations import remove_profile, update_profile
+from .reference import REFERENCE_MODELS, invalidate_reference
+from .summaries import create_summaries, rebuild_renamed_summaries, refresh_summaries, update_last_login
+from .tasks import enqueue
 
 
 @receiver(post_save, sender=User)
@@ -10,6 +18,161 @@ def post_save_create_profile(sender, instance, created, **kwargs):
     if created:
         Profile.objects.create(user=instance)
 
+
+@receiver(post_save, sender=Profile)
+@receiver(post_delete, sender=Profile)
+def invalidate_cached_profile(sender, instance, **kwargs):
+    invalidate_current_profile(instance.user_id)
+
+
+# profile cards
+@receiver(post_save, sender=Profile)
+def bump_profile_card(sender, instance, **kwargs):
+    bump_card_version(instance.pk)
+
+
+@receiver(post_save, sender=LanguageLevel)
+@receiver(post_delete, sender=LanguageLevel)
+def bump_language_level_card(sender, instance, **kwargs):
+    bump_card_version(instance.profile_id)
+
+
+@receiver(m2m_changed, sender=Profile.tags.through)
+@receiver(m2m_changed, sender=Profile.native_in.through)
+def bump_m2m_card(sender, instance, action, reverse, pk_set, **kwargs):
+    if not action.startswith('post_'):
+        return
+    if reverse:
+        # tag.profile_set.add(...), pk_set are profiles
+        bump_card_version(*(pk_set or ()))
+    else:
+        bump_card_version(instance.pk)
+
+
+@receiver(post_save, sender=User)
+def bump_user_card(sender, instance, created, **kwargs):
+    # names and last_login, new users get a profile and its card later
+    if not created:
+        bump_card_version(*Profile.objects.filter(user_id=instance.pk).values_list('pk', flat=True))
+
+
+# reference data API
+@receiver(post_save, sender=Country)
+@receiver(post_delete, sender=Country)
+@receiver(post_save, sender=Language)
+@receiver(post_delete, sender=Language)
+@receiver(post_save, sender=TagsArea)
+@receiver(post_delete, sender=TagsArea)
+@receiver(post_save, sender=Tag)
+@receiver(post_delete, sender=Tag)
+def invalidate_reference_data(sender, **kwargs):
+    invalidate_reference(*REFERENCE_MODELS[sender])
+
+
+# recommendations index
+@receiver(post_save, sender=LanguageLevel)
+@receiver(post_delete, sender=LanguageLevel)
+def update_index_languages(sender, instance, **kwargs):
+    update_profile(instance.profile_id)
+
+
+@receiver(m2m_changed, sender=Profile.tags.through)
+@receiver(m2m_changed, sender=Profile.native_in.through)
+def update_index_m2m(sender, instance, action, reverse, pk_set, **kwargs):
+    if not action.startswith('post_'):
+        return
+    for profile_id in (pk_set or ()) if reverse else (instance.pk,):
+        update_profile(profile_id)
+
+
+@receiver(post_delete, sender=Profile)
+def remove_from_index(sender, instance, **kwargs):
+    remove_profile(instance.pk)
+
+
+# index facets, the summary of a deleted profile goes by the cascade
+@receiver(post_delete, sender=Profile)
+def invalidate_deleted_facets(sender, instance, **kwargs):
+    invalidate_facets()
+
+
+# profile summaries
+@receiver(post_save, sender=Profile)
+def refresh_profile_summary(sender, instance, created, **kwargs):
+    if created:
+        create_summaries([instance.pk])
+    else:
+        refresh_summaries([instance.pk])
+
+
+@receiver(post_save, sender=LanguageLevel)
+@receiver(post_delete, sender=LanguageLevel)
+def refresh_language_level_summary(sender, instance, **kwargs):
+    refresh_summaries([instance.profile_id])
+
+
+@receiver(m2m_changed, sender=Profile.tags.through)
+@receiver(m2m_changed, sender=Profile.native_in.through)
+def refresh_m2m_summary(sender, instance, action, reverse, pk_set, **kwargs):
+    if not action.startswith('post_'):
+        return
+    refresh_summaries((pk_set or ()) if reverse else [instance.pk])
+
+
+@receiver(post_save, sender=User)
+def refresh_user_summary(sender, instance, created, update_fields, **kwargs):
+    if created:
+        return
+    if update_fields and set(update_fields) == {'last_login'}:
+        update_last_login(instance)
+    else:
+        refresh_summaries(Profile.objects.filter(user_id=instance.pk).values_list('pk', flat=True))
+
+
+@receiver(post_save, sender=Country)
+def rename_summaries_country(sender, instance, created, **kwargs):
+    if not created:
+        ProfileSummary.objects.filter(profile__country=instance).update(country=instance.name)
+        # cards of the country's profiles
+        enqueue(rebuild_renamed_summaries, sender._meta.model_name, instance.pk)
+
+
+@receiver(post_save, sender=Language)
+@receiver(post_save, sender=Tag)
+def refresh_renamed_summaries(sender, instance, created, **kwargs):
+    # summaries and cards of every profile with the language or tag, in the background
+    if not created:
+        enqueue(rebuild_renamed_summaries, sender._meta.model_name, instance.pk)
+
+
+# avatar files and thumbnails
+@receiver(pre_save, sender=Profile)
+def reset_avatar_thumbnails(sender, instance, update_fields=None, **kwargs):
+    if update_fields is not None and 'avatar' not in update_fields:
+        return
+    stored = stored_avatar(instance)
+    if avatar_changed(instance, stored):
+        # the file is saved after pre_save, its name is known in post_save
+        instance._replaced_avatar = stored
+        instance.avatar_thumbnails = {}
+
+
+@receiver(post_save, sender=Profile)
+def schedule_avatar_thumbnails(sender, instance, **kwargs):
+    replaced = getattr(instance, '_replaced_avatar', None)
+    if replaced is None:
+        return
+    del instance._replaced_avatar
+    replace_avatar(replaced, instance.avatar.name or '')
+    if instance.avatar:
+        schedule_thumbnails(instance.pk, instance.avatar.name)
+
+
+@receiver(post_delete, sender=Profile)
+def release_deleted_avatar(sender, instance, **kwargs):
+    if instance.avatar:
+        release_avatar(instance.avatar.name)
+
 #    education example
 # @receiver(request_finished)
 # def my_callback(sender, **kwargs):
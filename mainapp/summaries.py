@@ -0,0 +1,97 @@
+"""
+ProfileSummary read model: what listings show of a profile, denormalized
+into one row. Signals (mainapp.signals) call ``create_summaries`` for new
+profiles and ``refresh_summaries`` for the touched ones,
+``rebuild_profile_summaries`` refills the whole table. A renamed language or
+tag is in the summaries of many profiles, those are rebuilt by a background
+task (``rebuild_renamed_summaries``), which bumps their cached cards too.
+Bulk writes which skip signals (load_profiles) refresh summaries themselves.
+"""
+from itertools import islice
+
+from django.db import transaction
+from django.db.models import Q
+
+from .cards import bump_card_version
+from .facets import invalidate_facets
+from .models import Country, Language, Profile, ProfileSummary
+
+SUMMARY_FIELDS = ('first_name', 'last_name', 'last_login', 'date_of_birth', 'gender', 'gender_display',
+                  'country', 'avatar', 'avatar_thumbnails', 'study', 'native_in', 'tags')
+
+
+def summary_for(profile):
+    # profile comes from Profile.objects.for_cards()
+    user = profile.user
+    return ProfileSummary(profile_id=profile.pk, user_id=profile.user_id,
+                          first_name=user.first_name, last_name=user.last_name, last_login=user.last_login,
+                          date_of_birth=profile.date_of_birth, gender=profile.gender,
+                          gender_display=str(profile.get_gender_display()),
+                          country=profile.country.name if profile.country else '',
+                          avatar=profile.avatar.url if profile.avatar else '',
+                          avatar_thumbnails=profile.avatar_thumbnails,
+                          # sorted in Python, the same as the 0018 migration and whatever the collation
+                          study=sorted(language.name for language in profile.study.all()),
+                          native_in=sorted(language.name for language in profile.native_in.all()),
+                          tags=sorted(tag.tag for tag in profile.tags.all()))
+
+
+def create_summaries(profile_ids):
+    # (re)writes whole rows, for new profiles and rebuilds
+    profile_ids = list(profile_ids)
+    if not profile_ids:
+        return
+    summaries = [summary_for(profile) for profile in Profile.objects.for_cards().filter(pk__in=profile_ids)]
+    with transaction.atomic():
+        ProfileSummary.objects.filter(profile_id__in=profile_ids).delete()
+        ProfileSummary.objects.bulk_create(summaries)
+    invalidate_facets()
+
+
+def refresh_summaries(profile_ids):
+    # updates existing rows only: signals of a cascade delete (LanguageLevel post_delete, ...)
+    # come after the summary is deleted and must not bring it back
+    summaries = [summary_for(profile) for profile in Profile.objects.for_cards().filter(pk__in=list(profile_ids))]
+    if summaries:
+        ProfileSummary.objects.bulk_update(summaries, SUMMARY_FIELDS)
+        invalidate_facets()
+
+
+def update_last_login(user):
+    # logins only change last_login, no need to read the profile again
+    ProfileSummary.objects.filter(user_id=user.pk).update(last_login=user.last_login)
+
+
+def rebuild_summaries(profile_ids=None, batch_size=1000, progress=None):
+    """
+    Refills ProfileSummary of ``profile_ids`` (all profiles by default) by batches,
+    calls ``progress(done)`` after every batch.
+    """
+    if profile_ids is None:
+        profile_ids = Profile.objects.order_by('pk').values_list('pk', flat=True)
+    # ids only, the summaries are written while going through them
+    profile_ids = iter(list(profile_ids))
+    done = 0
+    while True:
+        batch = list(islice(profile_ids, batch_size))
+        if not batch:
+            break
+        create_summaries(batch)
+        done += len(batch)
+        if progress:
+            progress(done)
+    return done
+
+
+def rebuild_renamed_summaries(model_name, pk):
+    # task of a renamed country, language or tag; country summaries are updated by the signal
+    if model_name == Country._meta.model_name:
+        profiles = Profile.objects.filter(country=pk)
+    elif model_name == Language._meta.model_name:
+        profiles = Profile.objects.filter(Q(study=pk) | Q(native_in=pk))
+    else:
+        profiles = Profile.objects.filter(tags=pk)
+    profile_ids = list(profiles.values_list('pk', flat=True).distinct())
+    if model_name != Country._meta.model_name:
+        rebuild_summaries(profile_ids)
+    bump_card_version(*profile_ids)
@@ -0,0 +1,244 @@
+"""
+Background tasks: work which doesn't have to be done before the response.
+
+    from .tasks import enqueue
+    enqueue('mainapp.avatars.build_profile_thumbnails', profile.pk, name)
+
+A task is the dotted path of a function and its JSON arguments. A failing task
+is tried again up to ``max_attempts`` times, waiting retry_delay * 2 ** n seconds,
+then it is kept as failed with the traceback (admin). Defaults are TASK_MAX_ATTEMPTS
+and TASK_RETRY_DELAY, a function can have its own:
+
+    @task(max_attempts=1)
+    def send_digest(profile_id): ...
+
+Backends (TASK_BACKEND):
+    mainapp.tasks.DatabaseBackend  - Task rows, no broker. A row is inserted in the transaction
+                                     of the caller: the task exists if and only if its data was
+                                     committed. ``run_workers`` claims due rows by batches with
+                                     one UPDATE, tasks of a worker that died are run again after
+                                     TASK_LEASE seconds.
+    mainapp.tasks.LocalBackend     - thread pool of this process, tasks are submitted on commit,
+                                     nothing survives a restart. Development, single process servers.
+"""
+import json
+import threading
+import traceback
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connections, transaction
+from django.db.models import F
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from gotalk.db import close_old_connections
+
+from .models import Task
+
+TASK_BACKEND = getattr(settings, 'TASK_BACKEND', 'mainapp.tasks.DatabaseBackend')
+TASK_MAX_ATTEMPTS = getattr(settings, 'TASK_MAX_ATTEMPTS', 5)
+TASK_RETRY_DELAY = getattr(settings, 'TASK_RETRY_DELAY', 10)
+# seconds a claimed batch belongs to a worker, longer than a batch takes
+TASK_LEASE = getattr(settings, 'TASK_LEASE', 60 * 5)
+TASK_BATCH_SIZE = getattr(settings, 'TASK_BATCH_SIZE', 50)
+TASK_POLL_INTERVAL = getattr(settings, 'TASK_POLL_INTERVAL', 1.0)
+TASK_LOCAL_WORKERS = getattr(settings, 'TASK_LOCAL_WORKERS', 2)
+
+
+def task(max_attempts=None, retry_delay=None):
+    def decorator(function):
+        function.task_options = {'max_attempts': max_attempts, 'retry_delay': retry_delay}
+        return function
+    return decorator
+
+
+def task_option(function, name):
+    value = getattr(function, 'task_options', {}).get(name)
+    return value if value is not None else {'max_attempts': TASK_MAX_ATTEMPTS, 'retry_delay': TASK_RETRY_DELAY}[name]
+
+
+def task_name(function):
+    return function if isinstance(function, str) else '{}.{}'.format(function.__module__, function.__qualname__)
+
+
+def execute(name, args, kwargs):
+    # None or the traceback of the failure
+    try:
+        import_string(name)(*args, **kwargs)
+    except Exception:
+        return traceback.format_exc()
+
+
+def reset_connections():
+    # a worker thread keeps its connection between tasks, unless a task broke it
+    for connection in connections.all():
+        if connection.connection is None or connection.in_atomic_block or not connection.errors_occurred:
+            continue
+        if connection.is_usable():
+            connection.errors_occurred = False
+        else:
+            connection.close()
+
+
+def retry_delay(name, attempts):
+    # seconds before the next attempt, None if there is none
+    try:
+        function = import_string(name)
+    except ImportError:
+        return None
+    if attempts >= task_option(function, 'max_attempts'):
+        return None
+    return task_option(function, 'retry_delay') * 2 ** (attempts - 1)
+
+
+class DatabaseBackend:
+    def enqueue(self, name, args, kwargs):
+        Task.objects.create(name=name, args=list(args), kwargs=kwargs)
+
+    def enqueue_many(self, name, calls, batch_size=1000):
+        Task.objects.bulk_create([Task(name=name, args=list(args)) for args in calls], batch_size=batch_size)
+
+
+class LocalBackend:
+    def __init__(self, workers=TASK_LOCAL_WORKERS):
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='tasks')
+
+    def enqueue(self, name, args, kwargs):
+        # the same arguments a task of the database would get
+        args, kwargs = json.loads(json.dumps([list(args), kwargs]))
+        transaction.on_commit(lambda: self.executor.submit(self.run, name, args, kwargs, 1))
+
+    def enqueue_many(self, name, calls, batch_size=None):
+        for args in calls:
+            self.enqueue(name, args, {})
+
+    def run(self, name, args, kwargs, attempts):
+        close_old_connections()
+        try:
+            error = execute(name, args, kwargs)
+        finally:
+            close_old_connections()
+        if error is None:
+            return
+        delay = retry_delay(name, attempts)
+        if delay is not None:
+            timer = threading.Timer(delay, self.executor.submit, [self.run, name, args, kwargs, attempts + 1])
+            timer.daemon = True
+            timer.start()
+
+
+_backend = None
+_backend_lock = threading.Lock()
+
+
+def get_backend():
+    global _backend
+    if _backend is None:
+        with _backend_lock:
+            if _backend is None:
+                _backend = import_string(TASK_BACKEND)()
+    return _backend
+
+
+def enqueue(function, *args, **kwargs):
+    # function or its dotted path, arguments must be JSON serializable
+    get_backend().enqueue(task_name(function), args, kwargs)
+
+
+def enqueue_many(function, calls):
+    # [(args, ...), ...] of one function, one INSERT per 1000 tasks with the database
+    get_backend().enqueue_many(task_name(function), calls)
+
+
+# workers of the database backend
+def claim(batch_size=TASK_BATCH_SIZE, lease=TASK_LEASE):
+    """
+    Due tasks for this worker: the lease token and run_at moved by ``lease`` seconds
+    are set by one UPDATE, parallel workers can't claim the same row.
+    """
+    now = timezone.now()
+    due = Task.objects.filter(state=Task.QUEUED, run_at__lte=now)
+    ids = list(due.order_by('run_at').values_list('pk', flat=True)[:batch_size])
+    if not ids:
+        return []
+    token = uuid.uuid4().hex
+    due.filter(pk__in=ids).update(lease=token, run_at=now + timedelta(seconds=lease), attempts=F('attempts') + 1)
+    return list(Task.objects.filter(pk__in=ids, lease=token))
+
+
+def finish(results):
+    """
+    [(task, None or traceback), ...]: done tasks are deleted by one statement,
+    failed ones wait for the next attempt or stay failed
+    """
+    done = [task.pk for task, error in results if error is None]
+    if done:
+        Task.objects.filter(pk__in=done).delete()
+    now = timezone.now()
+    for task, error in results:
+        if error is None:
+            continue
+        delay = retry_delay(task.name, task.attempts)
+        changes = {'error': error, 'lease': ''}
+        if delay is None:
+            changes['state'] = Task.FAILED
+        else:
+            changes['run_at'] = now + timedelta(seconds=delay)
+        Task.objects.filter(pk=task.pk, lease=task.lease).update(**changes)
+
+
+class Worker:
+    """
+    Claims batches of due tasks and runs them in a pool of ``threads``
+    (in this thread with 1), until ``stop()`` or, with ``once``, until none is due.
+    """
+    def __init__(self, threads=1, batch_size=TASK_BATCH_SIZE, poll_interval=TASK_POLL_INTERVAL, lease=TASK_LEASE):
+        self.threads = threads
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self.lease = lease
+        self.stopped = threading.Event()
+        self.done = 0
+        self.failed = 0
+
+    def stop(self):
+        self.stopped.set()
+
+    def execute(self, task):
+        try:
+            return execute(task.name, task.args, task.kwargs)
+        finally:
+            reset_connections()
+
+    def run_batch(self, map_function=map):
+        tasks = claim(self.batch_size, self.lease)
+        results = list(zip(tasks, map_function(self.execute, tasks)))
+        finish(results)
+        failed = sum(1 for task, error in results if error is not None)
+        self.done += len(results) - failed
+        self.failed += failed
+        return len(results)
+
+    def run(self, once=False):
+        pool = ThreadPoolExecutor(max_workers=self.threads, thread_name_prefix='worker') if self.threads > 1 else None
+        try:
+            while not self.stopped.is_set():
+                if self.run_batch(pool.map if pool else map):
+                    continue
+                if once:
+                    break
+                self.stopped.wait(self.poll_interval)
+        finally:
+            if pool:
+                pool.shutdown()
+            close_old_connections()
+
+
+def run_pending(threads=1, batch_size=TASK_BATCH_SIZE):
+    # runs the due tasks and returns (done, failed)
+    worker = Worker(threads, batch_size)
+    worker.run(once=True)
+    return worker.done, worker.failed
@@ -0,0 +1,30 @@
+from django import template
+from django.db.models.fields.files import FieldFile
+
+register = template.Library()
+
+
+def srcset(urls):
+    # [1x url, 2x url] -> "url 1x, url 2x"
+    return ', '.join('{} {}x'.format(url, density) for density, url in enumerate(urls, 1))
+
+
+@register.inclusion_tag('mainapp/avatar.html')
+def avatar(profile, variant='card', css_class='', loading='lazy'):
+    """
+    {% load avatars %}
+    {% avatar profile 'card' 'card-img-top' %}
+
+    <picture> of a thumbnail of the avatar (see mainapp.thumbnails): WebP with
+    a JPEG fallback, 1x and 2x, loaded lazily. The original is shown until the
+    thumbnails are made. ``profile`` is a Profile or a ProfileSummary.
+    """
+    original = profile.avatar
+    if isinstance(original, FieldFile):
+        original = original.url if original else ''
+    context = {'src': original, 'class': css_class, 'loading': loading}
+    thumbnail = (profile.avatar_thumbnails or {}).get(variant)
+    if original and thumbnail:
+        context.update(src=thumbnail['jpeg'][0], srcset=srcset(thumbnail['jpeg']),
+                       webp_srcset=srcset(thumbnail['webp']), width=thumbnail['width'], height=thumbnail['height'])
+    return context
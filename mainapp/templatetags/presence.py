@@ -0,0 +1,16 @@
+from django import template
+
+from gotalk.presence import get_online_user_ids
+
+register = template.Library()
+
+
+@register.filter
+def is_online(user_id, request):
+    """
+    {% load presence %}
+    {% if profile.user_id|is_online:request %}ONLINE{% endif %}
+
+    Online ids are fetched once per request, so it costs no queries per card.
+    """
+    return user_id in get_online_user_ids(request)
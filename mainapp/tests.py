@@ -1,3 +1,1249 @@
-from django.test import TestCase
+import asyncio
+import json
+import shutil
+import tempfile
+import threading
+from datetime import date, datetime, timedelta
+from io import BytesIO, StringIO
+from unittest import skipUnless
 
-# Create your tests here.
+from asgiref.sync import sync_to_async
+from asgiref.testing import ApplicationCommunicator
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.contrib.sessions.models import Session
+from django.core.cache import cache
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import connection, transaction
+from django.db.models import F, Sum
+from django.http import HttpResponse
+from django.template import Context, Template
+from django.test import AsyncClient, Client, RequestFactory, TestCase, TransactionTestCase, override_settings, skipUnlessDBFeature
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from django.utils.module_loading import import_string
+from PIL import Image
+
+from gotalk.chat_layers import InMemoryChannelLayer
+from gotalk.middleware import CurrentProfileMiddleware, OnlineNowMiddleware
+from gotalk.presence import LocalPresenceBackend, get_presence
+from gotalk.storage import get_avatar_storage, is_content_addressed, serve_media
+from .avatars import build_profile_thumbnails, collect_avatars, rehash_avatars
+from .cards import bump_card_version, card_cache_stats, reset_card_cache_stats, with_cards
+from .chat import (CLOSE_FORBIDDEN, CLOSE_TRY_AGAIN_LATER, ChatApplication, MessageWriter, conversation_group,
+                   session_profile_id)
+from .conversations import open_conversation, save_messages, unread_field
+from .current_profile import get_current_profile
+from .filters import AGE_GROUP_LABELS, years_ago
+from .importer import ProfileImporter, read_rows
+from .models import *
+from .partners import (INCOMING, PARTNERS, REQUESTED, accept_request, get_relations, get_state,
+                       reject_request, send_request)
+from .popularity import VIEWS_FLUSH_INTERVAL, ViewCounter, counter, hour_of, popular_profiles, prune_views, save_views
+from . import recommendations
+from .recommendations import build_in_background, recommend
+from .sessions import delete_sessions, expired_sessions
+from .summaries import rebuild_summaries
+from .tasks import LocalBackend, claim, enqueue, run_pending, task
+from .thumbnails import make_thumbnails
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+def make_profiles(count, languages, tags, prefix='user'):
+    for i in range(count):
+        user = User.objects.create_user(username=f'{prefix}{i}', first_name='First', last_name=str(i))
+        profile = user.profile
+        profile.tags.set(tags)
+        profile.native_in.set(languages[:1])
+        for language in languages:
+            LanguageLevel.objects.create(profile=profile, language=language, level='B1')
+
+
+class ProfilesViewQueriesTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.country = Country.objects.create(abbreviation='UA', name='Ukraine')
+        self.languages = [Language.objects.create(name=name) for name in ('English', 'Greek', 'Italian')]
+        area = TagsArea.objects.create(area='Sport')
+        self.tags = [Tag.objects.create(tag=name, tag_area=area) for name in ('Tennis', 'Football')]
+
+    def test_index_query_count_does_not_depend_on_page_size(self):
+        make_profiles(3, self.languages, self.tags)
+        Profile.objects.update(country=self.country)
+        rebuild_summaries()
+        # page of profile summaries + 4 facets + popular this week
+        with self.assertNumQueries(6):
+            response = self.client.get(reverse('index'))
+        self.assertEqual(response.status_code, 200)
+
+        cache.clear()
+        User.objects.all().delete()
+        make_profiles(25, self.languages, self.tags)
+        Profile.objects.update(country=self.country)
+        rebuild_summaries()
+        with self.assertNumQueries(6):
+            response = self.client.get(reverse('index'))
+        self.assertEqual(len(response.context['profile_list']), 20)
+
+    def test_facets_count_the_whole_list(self):
+        make_profiles(25, self.languages, self.tags)
+        Profile.objects.filter(pk__in=Profile.objects.all()[:5].values('pk')).update(
+            gender='f', date_of_birth=years_ago(date.today(), 50))
+        rebuild_summaries()  # update() doesn't send signals
+        response = self.client.get(reverse('index'))
+        self.assertEqual([(f['value'], f['count']) for f in response.context['languages']],
+                         [('English', 25), ('Greek', 25), ('Italian', 25)])
+        self.assertEqual([(f['value'], f['count']) for f in response.context['genders']],
+                         [('f', 5), ('n', 20)])
+        self.assertEqual([(f['value'], f['count']) for f in response.context['age_groups']],
+                         [('45-60', 5)])
+        # facets are served from cache on the next page, COUNT(*) and the page
+        with self.assertNumQueries(2):
+            self.client.get(reverse('index'), {'page': 2})
+
+        # a changed profile changes the counts at once, not after FACETS_TIMEOUT
+        profile = Profile.objects.filter(gender='n').first()
+        profile.gender = 'm'
+        profile.save()
+        response = self.client.get(reverse('index'))
+        self.assertEqual([(f['value'], f['count']) for f in response.context['genders']],
+                         [('m', 1), ('f', 5), ('n', 19)])
+        profile.user.delete()
+        response = self.client.get(reverse('index'))
+        self.assertEqual([(f['value'], f['count']) for f in response.context['genders']],
+                         [('f', 5), ('n', 19)])
+
+
+class ProfileFilterTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.languages = [Language.objects.create(name=name) for name in ('English', 'Greek')]
+        area = TagsArea.objects.create(area='Sport')
+        self.tags = [Tag.objects.create(tag=name, tag_area=area) for name in ('Tennis', 'Football')]
+        make_profiles(4, self.languages[:1], self.tags[:1])
+        make_profiles(2, self.languages, self.tags, prefix='greek')
+        Profile.objects.filter(user__username='greek0').update(gender='f', date_of_birth=years_ago(date.today(), 30))
+        rebuild_summaries()  # update() doesn't send signals
+
+    def test_index_and_api_filter_by_query_string(self):
+        query = {'language': 'Greek', 'tag': ['Football', 'Chess']}
+        response = self.client.get(reverse('index'), query)
+        self.assertEqual(len(response.context['profile_list']), 2)
+        response = self.client.get('/api/v1/profiles/', query)
+        self.assertEqual(len(response.json()['results']), 2)
+
+        response = self.client.get(reverse('index'), {'gender': 'f', 'age_group': '25-35'})
+        self.assertEqual([p.user.username for p in response.context['profile_list']], ['greek0'])
+        self.assertEqual([(f['value'], f['count']) for f in response.context['age_groups']],
+                         [('25-35', 1)])
+        # the gender facet still counts the other genders
+        response = self.client.get(reverse('index'), {'gender': 'f'})
+        self.assertEqual([(f['value'], f['count']) for f in response.context['genders']],
+                         [('f', 1), ('n', 5)])
+        response = self.client.get(reverse('index'), {'min_age': 31})
+        self.assertEqual(len(response.context['profile_list']), 0)
+
+    def test_default_form_keeps_all_profiles(self):
+        response = self.client.get(reverse('index'))
+        self.assertEqual(len(response.context['profile_list']), 6)
+        # nothing is checked, PICK sends no gender or age group
+        self.assertNotContains(response, 'checked>')
+        response = self.client.get(reverse('index'), {})
+        self.assertEqual(len(response.context['profile_list']), 6)
+        # every age group (a bookmarked query) keeps the profiles without a date of birth
+        response = self.client.get(reverse('index'), {'age_group': AGE_GROUP_LABELS})
+        self.assertEqual(len(response.context['profile_list']), 6)
+
+
+class CursorPaginationTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        make_profiles(45, [], [])
+        users = list(User.objects.order_by('pk'))
+        # pairs of users with the same last_login and a few who never logged in
+        for i, user in enumerate(users[:40]):
+            user.last_login = timezone.make_aware(datetime(2022, 4, 1)) + timedelta(hours=i // 2)
+        User.objects.bulk_update(users, ['last_login'])
+        rebuild_summaries()
+        self.expected = [p.pk for p in Profile.objects.order_by(F('user__last_login').desc(nulls_last=True),
+                                                                 '-user_id')]
+
+    def test_index_walks_all_profiles_by_cursor(self):
+        seen = []
+        query = {}
+        while True:
+            with self.assertNumQueries(1 if seen else 6):
+                response = self.client.get(reverse('index'), query)
+            page = response.context['page_obj']
+            seen += [p.pk for p in page]
+            if not page.has_next():
+                break
+            query = {'cursor': page.next_cursor}
+        self.assertEqual(seen, self.expected)
+
+    def test_old_page_links_walk_all_profiles_once(self):
+        seen = []
+        for number in range(1, 4):
+            response = self.client.get(reverse('index'), {'page': number})
+            seen += [p.pk for p in response.context['page_obj']]
+        self.assertFalse(response.context['page_obj'].has_next())
+        self.assertEqual(seen, self.expected)
+
+    def test_api_walks_all_profiles_by_cursor(self):
+        seen = []
+        url = '/api/v1/profiles/'
+        while url:
+            data = self.client.get(url).json()
+            seen += [p['id'] for p in data['results']]
+            url = data['next']
+        self.assertEqual(seen, self.expected)
+        self.assertEqual(self.client.get('/api/v1/profiles/', {'cursor': 'broken'}).status_code, 404)
+
+
+class PresenceTest(TestCase):
+    def test_local_backend_throttles_and_expires(self):
+        presence = LocalPresenceBackend(threshold=100, touch_interval=10)
+        self.assertTrue(presence.touch(1, now=1000))
+        self.assertTrue(presence.touch(2, now=1005))
+        self.assertFalse(presence.touch(1, now=1009))
+        self.assertTrue(presence.touch(1, now=1010))
+        self.assertEqual(presence.online_ids(now=1010), [1, 2])
+        self.assertEqual(presence.online_ids(now=1106), [1])
+        self.assertEqual(presence.online_ids(now=1111), [])
+
+
+class OnlineBadgeQueriesTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        get_presence().clear()
+        recommendations._index = None
+
+    def test_online_badges_cost_no_queries(self):
+        make_profiles(25, [], [])
+        viewer = User.objects.get(username='user0')
+        for user in User.objects.all()[:10]:
+            get_presence().touch(user.pk)
+        self.client.force_login(viewer)
+        # user, viewer's profile, page of profile summaries, 4 facets, popular this week,
+        # the request doesn't build the recommendations index (the session comes from the cache)
+        with self.assertNumQueries(8):
+            response = self.client.get(reverse('index'))
+        self.assertContains(response, 'ONLINE')
+
+
+class PartnerRelationsTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        make_profiles(12, [], [])
+        self.profiles = list(Profile.objects.order_by('pk'))
+        self.viewer = self.profiles[0]
+
+    def connect(self, partners, requests):
+        for profile in partners:
+            Partner.objects.create(follower=profile, followed=self.viewer, response_date=date.today())
+        for profile in requests:
+            Partner.objects.create(follower=profile, followed=self.viewer)
+
+    def test_relationship_states(self):
+        self.connect(self.profiles[1:2], self.profiles[2:3])
+        Partner.objects.create(follower=self.viewer, followed=self.profiles[3])
+        partner_name = str(self.profiles[1])
+        with self.assertNumQueries(1):
+            relations = get_relations(self.viewer.pk)
+            # names of both sides are loaded with the rows
+            self.assertEqual([str(row) for row in relations.requests], ['First-First'])
+            self.assertEqual([str(profile) for profile in relations.partners], [partner_name])
+        self.assertEqual(relations.state(self.profiles[1].pk), PARTNERS)
+        self.assertEqual(relations.state(self.profiles[2].pk), INCOMING)
+        self.assertEqual(relations.state(self.profiles[3].pk), REQUESTED)
+
+    def test_profile_page_queries_do_not_depend_on_partners(self):
+        self.client.force_login(self.viewer.user)
+        self.connect(self.profiles[1:2], self.profiles[2:3])
+        url = reverse('profile', kwargs={'profile_id': self.viewer.pk})
+        self.client.get(url)
+        with CaptureQueriesContext(connection) as few:
+            self.client.get(url)
+        self.connect(self.profiles[3:8], self.profiles[8:12])
+        with CaptureQueriesContext(connection) as many:
+            response = self.client.get(url)
+        self.assertEqual(len(few), len(many))
+        self.assertEqual(len(response.context['partners']), 6)
+        self.assertEqual(len(response.context['followers_requests_queryset']), 5)
+
+
+class CurrentProfileTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        make_profiles(1, [], [])
+        self.user = User.objects.get(username='user0')
+
+    def test_profile_is_cached_until_saved(self):
+        with self.assertNumQueries(1):
+            self.assertEqual(get_current_profile(self.user).pk, self.user.profile.pk)
+        with self.assertNumQueries(0):
+            profile = get_current_profile(self.user)
+        profile.gender = 'f'
+        profile.save()
+        with self.assertNumQueries(1):
+            self.assertEqual(get_current_profile(self.user).gender, 'f')
+
+    def test_views_resolve_profile_once_per_request(self):
+        self.client.force_login(self.user)
+        url = reverse('profile-redacting', kwargs={'profile_id': self.user.profile.pk})
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(url)
+        lookups = [q for q in queries if 'FROM "mainapp_profile" WHERE "mainapp_profile"."user_id"' in q['sql']]
+        self.assertEqual(len(lookups), 1)
+
+
+class ProfileCardsCacheTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        area = TagsArea.objects.create(area='Sport')
+        self.tag = Tag.objects.create(tag='Tennis', tag_area=area)
+        make_profiles(5, [], [])
+
+    def render(self):
+        return ''.join(card for profile, card in with_cards(list(Profile.objects.select_related('user'))))
+
+    def test_cards_are_rendered_again_after_changes_only(self):
+        self.render()
+        reset_card_cache_stats()
+        # profiles only
+        with self.assertNumQueries(1):
+            self.render()
+        self.assertEqual(card_cache_stats()['hits'], 5)
+
+        profile = Profile.objects.first()
+        profile.native_in.add(Language.objects.create(name='Greek'))
+        LanguageLevel.objects.create(profile=profile, language=Language.objects.get(name='Greek'), level='A1')
+        # profiles and one missed card with its prefetches
+        with self.assertNumQueries(5):
+            html = self.render()
+        self.assertIn('would talk in: Greek,', html)
+        self.assertEqual(card_cache_stats()['misses'], 1)
+
+        self.tag.profile_set.add(*Profile.objects.all())
+        User.objects.filter(pk=profile.user_id).update(first_name='Changed')
+        profile.user.refresh_from_db()
+        profile.user.save()
+        self.assertIn('Changed', self.render())
+        self.assertEqual(card_cache_stats()['misses'], 6)
+
+        # renames bump the cards of their profiles in the background
+        country = Country.objects.create(abbreviation='GR', name='Greece')
+        Profile.objects.filter(pk=profile.pk).update(country=country)
+        bump_card_version(profile.pk)
+        self.render()
+        Language.objects.filter(name='Greek').update(name='Modern Greek')
+        language = Language.objects.get(name='Modern Greek')
+        language.save()
+        country.name = 'Hellas'
+        country.save()
+        self.assertNotIn('Modern Greek', self.render())
+        run_pending()
+        html = self.render()
+        self.assertIn('would talk in: Modern Greek,', html)
+        self.assertIn('from: Hellas', html)
+
+
+class ReferenceDataTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        Country.objects.create(abbreviation='UA', name='Ukraine')
+
+    def test_conditional_get_and_invalidation(self):
+        url = reverse('reference-countries')
+        response = self.client.get(url)
+        self.assertEqual(response.json(), [{'id': Country.objects.get().pk, 'abbreviation': 'UA', 'name': 'Ukraine'}])
+        etag = response['ETag']
+        with self.assertNumQueries(0):
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        response = self.client.get(url, HTTP_IF_MODIFIED_SINCE=response['Last-Modified'])
+        self.assertEqual(response.status_code, 304)
+
+        Country.objects.create(abbreviation='GR', name='Greece')
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([c['name'] for c in response.json()], ['Greece', 'Ukraine'])
+        # another change within the same second has a later Last-Modified
+        last_modified = response['Last-Modified']
+        Country.objects.create(abbreviation='IT', name='Italy')
+        response = self.client.get(url, HTTP_IF_MODIFIED_SINCE=last_modified)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()), 3)
+
+
+class RecentViewsTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        make_profiles(8, [], [])
+        self.profiles = list(Profile.objects.order_by('pk'))
+        self.client.force_login(self.profiles[0].user)
+
+    def view(self, profile):
+        return self.client.get(reverse('profile', kwargs={'profile_id': profile.pk}))
+
+    def test_recent_views_keep_order_without_session_writes(self):
+        for profile in self.profiles[1:8]:
+            self.view(profile)
+        self.view(self.profiles[4])
+        with CaptureQueriesContext(connection) as queries:
+            response = self.view(self.profiles[2])
+        self.assertEqual([p.pk for p in response.context['viewed_profiles']],
+                         [p.pk for p in (self.profiles[4], self.profiles[7], self.profiles[6],
+                                         self.profiles[5], self.profiles[3])])
+        self.assertFalse([q for q in queries if 'django_session' in q['sql'] and 'SELECT' not in q['sql']])
+
+
+class DeleteSessionsTest(TestCase):
+    def test_sessions_are_deleted_by_batches_with_cached_copies(self):
+        make_profiles(5, [], [])
+        clients = []
+        for user in User.objects.all():
+            client = Client()
+            client.force_login(user)
+            clients.append(client)
+        Session.objects.filter(pk__in=list(Session.objects.values_list('pk', flat=True)[:2])).update(
+            expire_date=timezone.now() - timedelta(days=1))
+
+        with self.assertNumQueries(2 * 2 + 1):
+            self.assertEqual(delete_sessions(expired_sessions(), batch_size=1), 2)
+        self.assertEqual(delete_sessions(Session.objects.all(), batch_size=2), 3)
+        # cached copies are gone too
+        response = clients[-1].get(reverse('index'))
+        self.assertFalse(response.context['user'].is_authenticated)
+
+
+class ExportProfilesTest(TestCase):
+    def test_staff_streams_profiles_with_partners(self):
+        make_profiles(3, [Language.objects.create(name='Greek')], [])
+        first, second, third = Profile.objects.order_by('pk')
+        Partner.objects.create(follower=first, followed=second, response_date=date.today())
+        Partner.objects.create(follower=third, followed=first)
+        url = reverse('export-profiles-jsonl')
+        self.client.force_login(first.user)
+        self.assertEqual(self.client.get(url).status_code, 302)
+
+        User.objects.filter(pk=first.user_id).update(is_staff=True)
+        response = self.client.get(url)
+        rows = [json.loads(line) for line in b''.join(response.streaming_content).splitlines()]
+        self.assertEqual([(row['username'], row['partners'], row['requested']) for row in rows],
+                         [('user0', [second.pk], []), ('user1', [first.pk], []), ('user2', [], [first.pk])])
+        self.assertEqual(rows[0]['study'], {'Greek': 'B1'})
+
+
+class LoadProfilesTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        Country.objects.create(abbreviation='UA', name='Ukraine')
+        Language.objects.create(name='English')
+        self.errors = []
+
+    def load(self, rows, fmt, batch_size=2):
+        importer = ProfileImporter(batch_size=batch_size)
+        return importer.run(read_rows(StringIO(rows), fmt), error=lambda *error: self.errors.append(error))
+
+    def test_csv_batches_with_related_rows(self):
+        rows = (
+            'username,first_name,password,date_of_birth,gender,phone,country,native_in,study,tags\n'
+            'anna,Anna,secret,1990-05-01,f,+380501111111,UA,English,Greek:B2;English:c1,Tennis;Chess\n'
+            'boris,Boris,secret,,m,,greece,Greek,English:,\n'
+            'anna,Again,,,,,,,,\n'
+            'chris,Chris,,1990-02-30,m,,,,,\n'
+            'dana,Dana,,,f,+380501111111,,,,\n'
+            'eva,Eva,other,,x,+380502222222,Ukraine,,,Tennis\n')
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.load(rows, 'csv'), (3, 3))
+        self.assertEqual(self.errors, [(4, "invalid date_of_birth: '1990-02-30'"), (5, 'phone +380501111111 is taken')])
+        anna = Profile.objects.get(user__username='anna')
+        self.assertEqual((anna.gender, anna.country.name, anna.date_of_birth), ('f', 'Ukraine', date(1990, 5, 1)))
+        self.assertEqual(sorted(anna.languagelevel_set.values_list('language__name', 'level')),
+                         [('English', 'C1'), ('Greek', 'B2')])
+        self.assertEqual(sorted(anna.tags.values_list('tag', flat=True)), ['Chess', 'Tennis'])
+        boris = Profile.objects.get(user__username='boris')
+        self.assertEqual((boris.country, list(boris.languagelevel_set.values_list('level', flat=True))), (None, ['A1']))
+        self.assertEqual(Profile.objects.get(user__username='eva').gender, 'n')
+        self.assertEqual(Language.objects.count(), 2)
+        self.assertEqual(ProfileSummary.objects.get(profile=anna).tags, ['Chess', 'Tennis'])
+        # equal passwords, a salt of their own
+        self.assertTrue(anna.user.check_password('secret'))
+        self.assertTrue(boris.user.check_password('secret'))
+        self.assertNotEqual(anna.user.password, boris.user.password)
+        self.assertFalse(User.objects.get(username='eva').check_password('secret'))
+        # rows are inserted by batches, not one by one
+        self.assertEqual(sum('INSERT INTO "auth_user"' in query['sql'] for query in queries), 2)
+
+    def test_jsonl_bad_input_is_reported_by_row(self):
+        rows = '\n'.join([
+            json.dumps({'username': 'anna', 'study': {'English': None}, 'native_in': ['English']}),
+            '{not json',
+            json.dumps(['anna']),
+            json.dumps({'username': 'boris', 'study': [['English']], 'tags': 'Tennis'}),
+            json.dumps({'username': 'chris', 'tags': [1]}),
+            json.dumps({'username': 'dana', 'phone': 'call me'}),
+            json.dumps({'first_name': 'Nobody'}),
+        ])
+        self.assertEqual(self.load(rows, 'jsonl', batch_size=10), (2, 5))
+        self.assertEqual([number for number, message in self.errors], [2, 3, 5, 6, 7])
+        self.assertTrue(self.errors[0][1].startswith('invalid JSON'))
+        self.assertEqual(list(LanguageLevel.objects.order_by('profile__user__username')
+                              .values_list('profile__user__username', 'level')),
+                         [('anna', 'A1'), ('boris', 'A1')])
+        self.assertFalse(User.objects.get(username='anna').has_usable_password())
+
+
+class MatchProfilesTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.english, self.greek, self.italian = [Language.objects.create(name=name)
+                                                  for name in ('English', 'Greek', 'Italian')]
+        self.viewer = self.make_profile('viewer', self.english, {self.greek: 'B1'})
+        self.reciprocal = self.make_profile('reciprocal', self.greek, {self.english: 'B2'})
+        self.teacher = self.make_profile('teacher', self.greek, {self.italian: 'B2'})
+        self.learner = self.make_profile('learner', self.italian, {self.english: 'A2'})
+        self.make_profile('stranger', self.italian, {self.italian: 'C1'})
+
+    def make_profile(self, username, native, study):
+        profile = User.objects.create_user(username=username).profile
+        profile.native_in.set([native])
+        for language, level in study.items():
+            LanguageLevel.objects.create(profile=profile, language=language, level=level)
+        return profile
+
+
+class RecommendationsTest(MatchProfilesTestCase):
+    def test_reciprocal_matches_come_first(self):
+        ranked = [pk for pk, score in recommend(self.viewer.pk)]
+        self.assertEqual(ranked, [self.reciprocal.pk, self.teacher.pk, self.learner.pk])
+
+    def test_partners_are_left_out(self):
+        recommend(self.viewer.pk)  # the index is built
+        Partner.objects.create(follower=self.viewer, followed=self.reciprocal)
+        ranked = [pk for pk, score in recommend(self.viewer.pk)]
+        self.assertNotIn(self.reciprocal.pk, ranked)
+
+    def test_index_follows_language_changes(self):
+        recommend(self.viewer.pk)
+        self.reciprocal.native_in.clear()
+        ranked = [pk for pk, score in recommend(self.viewer.pk)]
+        self.assertEqual(ranked, [self.teacher.pk, self.reciprocal.pk, self.learner.pk])
+
+
+class RecommendationsWarmupTest(MatchProfilesTestCase):
+    def setUp(self):
+        super().setUp()
+        recommendations._index = None
+
+    def test_requests_dont_build_the_index(self):
+        self.client.force_login(self.viewer.user)
+        response = self.client.get(reverse('index'))
+        self.assertEqual(list(response.context['recommended_cards']), [])
+        self.assertIsNone(recommendations._index)
+        self.assertEqual(recommend(self.viewer.pk, wait=False), [])
+
+    def test_stale_index_is_served_until_rebuilt(self):
+        expected = recommend(self.viewer.pk)
+        index = recommendations._index
+        recommendations.bump_index_version()
+        # partners of the viewer only, no build
+        with self.assertNumQueries(1):
+            self.assertEqual(recommend(self.viewer.pk, wait=False), expected)
+        recommend(self.viewer.pk)
+        self.assertIsNot(recommendations._index, index)
+
+
+class BackgroundRecommendationsTest(TransactionTestCase):
+    def setUp(self):
+        cache.clear()
+        recommendations._index = None
+        english, greek = Language.objects.create(name='English'), Language.objects.create(name='Greek')
+        self.viewer = User.objects.create_user(username='viewer').profile
+        self.viewer.native_in.set([english])
+        LanguageLevel.objects.create(profile=self.viewer, language=greek, level='B1')
+        self.match = User.objects.create_user(username='match').profile
+        self.match.native_in.set([greek])
+        LanguageLevel.objects.create(profile=self.match, language=english, level='B2')
+
+    def test_index_is_built_by_a_thread(self):
+        build_in_background().join()
+        self.assertEqual([pk for pk, score in recommend(self.viewer.pk, wait=False)], [self.match.pk])
+
+
+@skipUnless(numpy, 'needs numpy')
+class BuildRecommendationsTest(MatchProfilesTestCase):
+    def test_batch_scores_match_the_index(self):
+        from .match_scoring import build_recommendations
+
+        Partner.objects.create(follower=self.viewer, followed=self.teacher)
+        build_recommendations(block_size=2)
+        for profile in Profile.objects.all():
+            stored = list(Recommendation.objects.filter(profile=profile).values_list('candidate_id', 'score'))
+            expected = recommend(profile.pk)
+            self.assertEqual([pk for pk, score in stored], [pk for pk, score in expected])
+            for (pk, score), (expected_pk, expected_score) in zip(stored, expected):
+                self.assertAlmostEqual(score, expected_score, places=5)
+
+    def test_ties_go_to_the_lower_id(self):
+        from .match_scoring import MatchMatrices
+
+        scores = numpy.array([[0] + [1] * 31, [0] * 32], dtype=numpy.float32)
+        scores[0, 6] = 2
+        (best, values), (none, no_values) = MatchMatrices.top(None, scores, 3)
+        self.assertEqual(best.tolist(), [6, 1, 2])
+        self.assertEqual(values.tolist(), [2, 1, 1])
+        self.assertEqual(none.tolist(), [])
+
+    def test_rebuild_replaces_old_rows(self):
+        from .match_scoring import build_recommendations
+
+        build_recommendations()
+        self.reciprocal.native_in.clear()
+        LanguageLevel.objects.filter(profile=self.reciprocal).delete()
+        build_recommendations()
+        self.assertFalse(Recommendation.objects.filter(candidate=self.reciprocal).exists())
+
+
+class ProfileSummaryTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.country = Country.objects.create(abbreviation='UA', name='Ukraine')
+        self.greek = Language.objects.create(name='Greek')
+        area = TagsArea.objects.create(area='Sport')
+        self.tennis = Tag.objects.create(tag='Tennis', tag_area=area)
+        self.user = User.objects.create_user(username='summary', first_name='First', last_name='Last')
+        self.profile = self.user.profile
+
+    def summary(self):
+        return ProfileSummary.objects.get(profile=self.profile)
+
+    def test_signals_keep_the_summary_current(self):
+        self.assertEqual(self.summary().first_name, 'First')
+        self.profile.country = self.country
+        self.profile.gender = 'f'
+        self.profile.save()
+        LanguageLevel.objects.create(profile=self.profile, language=self.greek, level='B1')
+        self.profile.native_in.add(self.greek)
+        self.tennis.profile_set.add(self.profile)
+        summary = self.summary()
+        self.assertEqual((summary.country, summary.gender_display), ('Ukraine', 'female'))
+        self.assertEqual((summary.study, summary.native_in, summary.tags), (['Greek'], ['Greek'], ['Tennis']))
+
+        self.country.name = 'Україна'
+        self.country.save()
+        self.greek.name = 'Modern Greek'
+        self.greek.save()
+        # profiles of a renamed language are rebuilt by a task, cards of the country's profiles bumped by another
+        self.assertEqual(run_pending(), (2, 0))
+        self.user.last_name = 'Changed'
+        self.user.save()
+        self.client.force_login(self.user)
+        summary = self.summary()
+        self.assertEqual((summary.country, summary.study, summary.last_name), ('Україна', ['Modern Greek'], 'Changed'))
+        self.assertIsNotNone(summary.last_login)
+
+    def test_deleted_profiles_leave_no_summary(self):
+        LanguageLevel.objects.create(profile=self.profile, language=self.greek, level='B1')
+        self.user.delete()
+        self.assertFalse(ProfileSummary.objects.exists())
+
+    def test_api_reads_summaries_only(self):
+        LanguageLevel.objects.create(profile=self.profile, language=self.greek, level='B1')
+        with self.assertNumQueries(1):
+            data = self.client.get('/api/v1/profiles/').json()
+        self.assertEqual(data['results'], [{
+            'id': self.profile.pk, 'first_name': 'First', 'last_name': 'Last', 'last_login': None,
+            'age': None, 'gender': 'prefer not to respond', 'country': None, 'avatar': None,
+            'study': ['Greek'], 'native_in': [], 'tags': []}])
+
+
+class PartnerWorkflowTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        make_profiles(3, [], [])
+        self.alice, self.bob, self.carol = Profile.objects.order_by('pk')
+
+    def test_request_accept_reject(self):
+        self.assertTrue(send_request(self.alice.pk, self.bob.pk))
+        self.assertFalse(send_request(self.alice.pk, self.bob.pk))
+        self.assertEqual(Partner.objects.count(), 1)
+        # nobody can accept their own request
+        self.assertFalse(accept_request(self.alice.pk, self.bob.pk))
+        self.assertEqual(get_state(self.alice.pk, self.bob.pk), REQUESTED)
+        self.assertEqual(get_state(self.bob.pk, self.alice.pk), INCOMING)
+        with CaptureQueriesContext(connection) as queries:
+            self.assertTrue(accept_request(self.bob.pk, self.alice.pk))
+        self.assertEqual(len([q for q in queries if 'SAVEPOINT' not in q['sql']]), 1)
+        self.assertEqual(get_state(self.alice.pk, self.bob.pk), PARTNERS)
+        with CaptureQueriesContext(connection) as queries:
+            self.assertTrue(reject_request(self.bob.pk, self.alice.pk))
+        self.assertEqual(len([q for q in queries if 'SAVEPOINT' not in q['sql']]), 1)
+        self.assertFalse(Partner.objects.exists())
+        self.assertFalse(send_request(self.alice.pk, 0))
+
+    def test_crossing_requests_make_partners(self):
+        self.assertTrue(send_request(self.bob.pk, self.alice.pk))
+        # alice asks bob back instead of accepting: no second pending row
+        self.assertTrue(send_request(self.alice.pk, self.bob.pk))
+        self.assertEqual(list(Partner.objects.values_list('follower_id', 'followed_id')), [(self.bob.pk, self.alice.pk)])
+        self.assertEqual(get_state(self.alice.pk, self.bob.pk), PARTNERS)
+        self.assertFalse(send_request(self.alice.pk, self.bob.pk))
+        self.assertFalse(send_request(self.bob.pk, self.alice.pk))
+        self.assertEqual(Partner.objects.count(), 1)
+
+    def test_profile_page_and_api(self):
+        self.client.force_login(self.alice.user)
+        url = reverse('profile', kwargs={'profile_id': self.bob.pk})
+        response = self.client.post(url, {'followed': self.bob.pk, 'follower': self.alice.pk,
+                                          'follow_request': 'Request to practice'})
+        self.assertRedirects(response, url)
+        self.assertEqual(get_state(self.alice.pk, self.bob.pk), REQUESTED)
+
+        self.client.force_login(self.bob.user)
+        response = self.client.post(reverse('partner-action', args=[self.alice.pk, 'accept']))
+        self.assertEqual(response.json(), {'profile': self.alice.pk, 'state': PARTNERS, 'changed': True})
+        response = self.client.post(reverse('partner-action', args=[self.carol.pk, 'accept']))
+        self.assertEqual(response.json()['changed'], False)
+        self.assertEqual(self.client.post(reverse('partner-action', args=[0, 'request'])).status_code, 404)
+        self.assertEqual(self.client.post(reverse('partner-action', args=[self.bob.pk, 'request'])).status_code, 400)
+
+
+@skipUnlessDBFeature('test_db_allows_multiple_connections')
+class PartnerConcurrencyTest(TransactionTestCase):
+    def setUp(self):
+        cache.clear()
+        make_profiles(2, [], [])
+        self.alice, self.bob = Profile.objects.order_by('pk')
+
+    def run_in_threads(self, function, *args, count=8):
+        barrier = threading.Barrier(count)
+        results, errors = [], []
+
+        def target():
+            try:
+                barrier.wait()
+                results.append(function(*args))
+            except Exception as e:
+                errors.append(e)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=target) for _ in range(count)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return results, errors
+
+    def test_double_clicks_create_one_request_and_accept_once(self):
+        results, errors = self.run_in_threads(send_request, self.alice.pk, self.bob.pk)
+        self.assertEqual(errors, [])
+        self.assertEqual(results.count(True), 1)
+        self.assertEqual(Partner.objects.count(), 1)
+
+        results, errors = self.run_in_threads(accept_request, self.bob.pk, self.alice.pk)
+        self.assertEqual(errors, [])
+        self.assertEqual(results.count(True), 1)
+        self.assertEqual(get_state(self.alice.pk, self.bob.pk), PARTNERS)
+
+    def test_crossing_requests_of_the_same_moment(self):
+        barrier = threading.Barrier(2)
+        errors = []
+
+        def request(follower, followed):
+            try:
+                barrier.wait()
+                send_request(follower.pk, followed.pk)
+            except Exception as e:
+                errors.append(e)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=request, args=pair)
+                   for pair in ((self.alice, self.bob), (self.bob, self.alice))]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(errors, [])
+        self.assertEqual(Partner.objects.count(), 1)
+        self.assertEqual(get_state(self.alice.pk, self.bob.pk), PARTNERS)
+
+
+class AsyncViewsTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        make_profiles(25, [Language.objects.create(name='Greek')], [])
+
+    def test_middleware_is_not_adapted_under_asgi(self):
+        # a sync-only middleware would put every async request through a thread
+        for path in settings.MIDDLEWARE:
+            self.assertTrue(getattr(import_string(path), 'async_capable', False), path)
+
+        async def view(request):
+            return HttpResponse()
+
+        middleware = OnlineNowMiddleware(view, presence=LocalPresenceBackend())
+        self.assertTrue(asyncio.iscoroutinefunction(middleware))
+
+    async def test_async_views_read_the_profile_in_the_event_loop(self):
+        async def view(request):
+            # no DB query from here, it would raise SynchronousOnlyOperation
+            return HttpResponse(request.profile and request.profile.pk)
+
+        user = await sync_to_async(User.objects.get)(username='user0')
+        profile_id = await sync_to_async(lambda: user.profile.pk)()
+        middleware = CurrentProfileMiddleware(view)
+        request = RequestFactory().get('/')
+        request.COOKIES[settings.SESSION_COOKIE_NAME] = 'session'
+        request.user = user
+        self.assertEqual((await middleware(request)).content, str(profile_id).encode())
+        self.assertEqual((await middleware(RequestFactory().get('/'))).content, b'None')
+
+    async def test_async_endpoints_answer_as_the_sync_ones(self):
+        client = AsyncClient()
+        response = await client.get('/api/async/profiles/', {'language': 'Greek'})
+        data = response.json()
+        self.assertEqual(len(data['results']), 20)
+        sync_data = (await sync_to_async(self.client.get)('/api/v1/profiles/', {'language': 'Greek'})).json()
+        self.assertEqual(data['results'], sync_data['results'])
+        response = await client.get(data['next'])
+        self.assertEqual(len(response.json()['results']), 5)
+
+        profile_id = data['results'][0]['id']
+        response = await client.get(reverse('async-profile', args=[profile_id]))
+        self.assertEqual(response.json(), data['results'][0])
+        self.assertEqual((await client.get(reverse('async-profile', args=[0]))).status_code, 404)
+
+        response = await client.get(reverse('async-reference', args=['languages']))
+        self.assertEqual([language['name'] for language in response.json()], ['Greek'])
+        # AsyncClient of Django 4.0 takes header names as they are
+        response = await client.get(reverse('async-reference', args=['languages']),
+                                    **{'If-None-Match': response['ETag']})
+        self.assertEqual(response.status_code, 304)
+
+
+class ChatTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        make_profiles(3, [], [])
+        self.alice, self.bob, self.carol = Profile.objects.order_by('pk')
+        send_request(self.alice.pk, self.bob.pk)
+        accept_request(self.bob.pk, self.alice.pk)
+        self.app = ChatApplication(layer=InMemoryChannelLayer(), writer=MessageWriter(interval=60))
+
+    async def connect(self, profile, partner):
+        communicator = ApplicationCommunicator(self.app, {
+            'type': 'websocket', 'path': '/ws/chat/%s/' % partner.pk, 'headers': [], 'profile_id': profile.pk})
+        await communicator.send_input({'type': 'websocket.connect'})
+        return communicator, await communicator.receive_output()
+
+    async def test_partners_chat(self):
+        alice, accepted = await self.connect(self.alice, self.bob)
+        self.assertEqual(accepted, {'type': 'websocket.accept'})
+        bob, accepted = await self.connect(self.bob, self.alice)
+        self.assertEqual(accepted, {'type': 'websocket.accept'})
+        carol, closed = await self.connect(self.carol, self.alice)
+        self.assertEqual(closed, {'type': 'websocket.close', 'code': CLOSE_FORBIDDEN})
+
+        await alice.send_input({'type': 'websocket.receive', 'text': json.dumps({'text': ' hi ', 'ref': 1})})
+        for communicator in (alice, bob):
+            event = await communicator.receive_output()
+            message = json.loads(event['text'])
+            self.assertEqual((message['sender'], message['text'], message['ref']), (self.alice.pk, 'hi', 1))
+        await bob.send_input({'type': 'websocket.receive', 'text': '{"message": "hi"}'})
+        self.assertIn('error', json.loads((await bob.receive_output())['text']))
+
+        # nothing is written before the flush
+        self.assertEqual(await sync_to_async(Message.objects.count)(), 0)
+        self.assertEqual(await self.app.writer.flush(), 1)
+        message = await sync_to_async(Message.objects.select_related('conversation').get)()
+        self.assertEqual((message.sender_id, message.text), (self.alice.pk, 'hi'))
+        # the counter of bob, alice has read her own message
+        self.assertEqual((message.conversation.unread_min, message.conversation.unread_max), (0, 1))
+        for communicator in (alice, bob):
+            await communicator.send_input({'type': 'websocket.disconnect', 'code': 1000})
+            await communicator.wait()
+        self.assertFalse(self.app.layer.groups)
+
+    async def test_unpartnered_chat_is_closed_by_the_flush(self):
+        alice, accepted = await self.connect(self.alice, self.bob)
+        bob, accepted = await self.connect(self.bob, self.alice)
+        await sync_to_async(reject_request)(self.bob.pk, self.alice.pk)
+        await alice.send_input({'type': 'websocket.receive', 'text': json.dumps({'text': 'still there?'})})
+        for communicator in (alice, bob):
+            await communicator.receive_output()
+        self.assertEqual(await self.app.writer.flush(), 0)
+        self.assertEqual(await sync_to_async(Message.objects.count)(), 0)
+        for communicator in (alice, bob):
+            self.assertEqual(await communicator.receive_output(), {'type': 'websocket.close', 'code': CLOSE_FORBIDDEN})
+            await communicator.send_input({'type': 'websocket.disconnect', 'code': CLOSE_FORBIDDEN})
+            await communicator.wait()
+        self.assertFalse(self.app.connections)
+        # a new connection isn't accepted either
+        alice, closed = await self.connect(self.alice, self.bob)
+        self.assertEqual(closed, {'type': 'websocket.close', 'code': CLOSE_FORBIDDEN})
+
+    async def test_slow_consumer_is_disconnected(self):
+        self.app.queue_size = 2
+        alice, accepted = await self.connect(self.alice, self.bob)
+        group = conversation_group(self.alice.pk, self.bob.pk)
+        # the connection doesn't get a chance to send anything meanwhile
+        for i in range(3):
+            self.app.layer.fan_out(group, json.dumps({'text': str(i)}))
+        self.assertEqual(await alice.receive_output(), {'type': 'websocket.close', 'code': CLOSE_TRY_AGAIN_LATER})
+        self.assertEqual(self.app.dropped, 1)
+        await alice.send_input({'type': 'websocket.disconnect', 'code': 1013})
+        await alice.wait()
+
+    def test_session_profile(self):
+        self.client.force_login(self.alice.user)
+        cookie = '%s=%s' % (settings.SESSION_COOKIE_NAME, self.client.cookies[settings.SESSION_COOKIE_NAME].value)
+        scope = {'headers': [(b'cookie', cookie.encode()), (b'origin', b'http://testserver')]}
+        self.assertEqual(session_profile_id(scope), self.alice.pk)
+        # a page of another site can't chat in the user's name
+        scope = {'headers': [(b'cookie', cookie.encode()), (b'origin', b'http://example.com')]}
+        self.assertIsNone(session_profile_id(scope))
+        self.assertIsNone(session_profile_id({'headers': [(b'origin', b'http://testserver')]}))
+
+
+class ConversationHistoryTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        make_profiles(3, [], [])
+        self.alice, self.bob, self.carol = Profile.objects.order_by('pk')
+        send_request(self.alice.pk, self.bob.pk)
+        accept_request(self.bob.pk, self.alice.pk)
+        self.conversation_id = open_conversation(self.bob.pk, self.alice.pk)
+
+    def test_open_conversation(self):
+        self.assertEqual(open_conversation(self.alice.pk, self.bob.pk), self.conversation_id)
+        self.assertIsNone(open_conversation(self.alice.pk, self.carol.pk))
+        conversation = Conversation.objects.get()
+        self.assertEqual((conversation.min_profile_id, conversation.max_profile_id), (self.alice.pk, self.bob.pk))
+
+    def test_history_pages_backwards(self):
+        start = timezone.now()
+        # pages of 50, two messages a second, pairs with the same time are told apart by id
+        save_messages([(self.conversation_id, self.alice.pk, str(i), start + timedelta(seconds=i // 2),
+                         unread_field(self.bob.pk, self.alice.pk)) for i in range(120)])
+        save_messages([(self.conversation_id, self.bob.pk, 'reply', start + timedelta(seconds=60),
+                         unread_field(self.alice.pk, self.bob.pk))])
+        self.client.force_login(self.bob.user)
+        response = self.client.get(reverse('conversations'))
+        self.assertEqual(response.json(), [{'profile': self.alice.pk, 'unread': 120}])
+
+        url = reverse('conversation-messages', args=[self.alice.pk])
+        texts = []
+        pages = 0
+        while url:
+            with CaptureQueriesContext(connection) as queries:
+                data = self.client.get(url).json()
+            # conversation + page, no COUNT(*) or OFFSET
+            self.assertEqual(len([q for q in queries if 'mainapp_' in q['sql']]), 2)
+            self.assertFalse([q for q in queries if 'OFFSET' in q['sql'] or 'COUNT(' in q['sql']])
+            texts += [message['text'] for message in data['results']]
+            url = data['next']
+            pages += 1
+        self.assertEqual(pages, 3)
+        self.assertEqual(texts, ['reply'] + [str(i) for i in reversed(range(120))])
+        self.assertEqual(self.client.get(reverse('conversation-messages', args=[self.alice.pk]),
+                                         {'cursor': 'broken'}).status_code, 404)
+
+        self.assertEqual(self.client.post(reverse('conversation-read', args=[self.alice.pk])).status_code, 200)
+        self.assertEqual(self.client.get(reverse('conversations')).json(), [{'profile': self.alice.pk, 'unread': 0}])
+        self.client.force_login(self.alice.user)
+        self.assertEqual(self.client.get(reverse('conversations')).json(), [{'profile': self.bob.pk, 'unread': 1}])
+
+        # nobody else reads the history
+        self.client.force_login(self.carol.user)
+        self.assertEqual(self.client.get(reverse('conversation-messages', args=[self.alice.pk])).status_code, 404)
+        self.assertEqual(self.client.post(reverse('conversation-read', args=[self.alice.pk])).status_code, 404)
+
+    def test_history_is_read_by_partners_only(self):
+        save_messages([(self.conversation_id, self.alice.pk, 'hi', timezone.now(),
+                        unread_field(self.bob.pk, self.alice.pk))])
+        url = reverse('conversation-messages', args=[self.alice.pk])
+        self.client.force_login(self.bob.user)
+        self.assertEqual(len(self.client.get(url).json()['results']), 1)
+        reject_request(self.bob.pk, self.alice.pk)
+        self.assertEqual(self.client.get(url).status_code, 404)
+        # nor are the messages marked read
+        self.assertEqual(self.client.post(reverse('conversation-read', args=[self.alice.pk])).status_code, 404)
+        self.assertEqual(Conversation.objects.get().unread_max, 1)
+        # partners again, the history is back
+        send_request(self.alice.pk, self.bob.pk)
+        accept_request(self.bob.pk, self.alice.pk)
+        self.assertEqual(self.client.get(url).json()['results'][0]['text'], 'hi')
+
+
+def image_file(name, size, color='red', image_format='JPEG'):
+    buffer = BytesIO()
+    Image.new('RGB', size, color).save(buffer, image_format)
+    return SimpleUploadedFile(name, buffer.getvalue())
+
+
+class MediaTestCase(TestCase):
+    # uploads go to a temporary MEDIA_ROOT
+    def setUp(self):
+        cache.clear()
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root)
+        settings_override = override_settings(MEDIA_ROOT=self.media_root)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.profile = User.objects.create_user(username='avatar').profile
+
+    def upload(self, name, size, color='red', profile=None):
+        profile = profile or self.profile
+        profile.avatar = image_file(name, size, color)
+        tasks = Task.objects.filter(name='mainapp.avatars.build_profile_thumbnails')
+        count = tasks.count()
+        profile.save()
+        self.assertEqual(tasks.count(), count + 1)
+        return profile.avatar.name
+
+
+class ThumbnailsTest(MediaTestCase):
+    def test_make_thumbnails(self):
+        name = self.upload('wide.jpg', (1600, 1000))
+        thumbnails = make_thumbnails(name)
+        self.assertEqual({variant: (entry['width'], entry['height'], len(entry['jpeg']), len(entry['webp']))
+                          for variant, entry in thumbnails.items()},
+                         {'list': (64, 64, 2, 2), 'card': (320, 320, 2, 2), 'detail': (640, 400, 2, 2)})
+        self.assertTrue(thumbnails['card']['webp'][1].endswith('-card%402x.webp'))
+
+        # no 2x copy larger than the original
+        small = make_thumbnails(self.upload('small.jpg', (400, 300)))
+        self.assertEqual((len(small['card']['jpeg']), len(small['list']['jpeg'])), (1, 2))
+
+    def test_avatar_changes(self):
+        name = self.upload('face.jpg', (800, 800))
+        self.assertEqual(run_pending(), (1, 0))
+        self.profile.refresh_from_db()
+        self.assertEqual(set(self.profile.avatar_thumbnails), {'list', 'card', 'detail'})
+        self.assertEqual(ProfileSummary.objects.get(profile=self.profile).avatar_thumbnails,
+                         self.profile.avatar_thumbnails)
+        html = Template("{% load avatars %}{% avatar profile 'card' %}").render(Context({'profile': self.profile}))
+        self.assertIn('<source type="image/webp"', html)
+        self.assertIn('width="320" height="320"', html)
+
+        # other fields keep the thumbnails, a new avatar drops them until its own are made
+        self.profile.gender = 'f'
+        self.profile.save()
+        self.assertEqual((Task.objects.count(), bool(self.profile.avatar_thumbnails)), (0, True))
+        self.upload('other.jpg', (800, 800), 'blue')
+        self.assertEqual(self.profile.avatar_thumbnails, {})
+        # thumbnails of the old avatar aren't saved
+        self.assertFalse(build_profile_thumbnails(self.profile.pk, name))
+        html = Template("{% load avatars %}{% avatar profile 'card' %}").render(Context({'profile': self.profile}))
+        self.assertIn(self.profile.avatar.url, html)
+        self.assertNotIn('srcset', html)
+
+        self.profile.avatar = SimpleUploadedFile('broken.jpg', b'not an image')
+        self.profile.save()
+        self.assertFalse(build_profile_thumbnails(self.profile.pk, self.profile.avatar.name))
+
+
+class AvatarStorageTest(MediaTestCase):
+    def refcount(self, name):
+        return AvatarFile.objects.filter(name=name).values_list('refcount', flat=True).first()
+
+    def test_same_image_is_one_file(self):
+        other = User.objects.create_user(username='same').profile
+        name = self.upload('photo.jpg', (400, 400))
+        self.assertTrue(is_content_addressed(name) and name.startswith('avatars/'))
+        self.assertEqual(self.upload('copy.JPG', (400, 400), profile=other), name)
+        self.assertEqual(self.refcount(name), 2)
+        self.assertTrue(build_profile_thumbnails(self.profile.pk, name))
+        # the second profile reuses the thumbnails
+        thumbnails = Profile.objects.get(pk=self.profile.pk).avatar_thumbnails
+        self.assertTrue(build_profile_thumbnails(other.pk, name))
+        self.assertEqual(Profile.objects.get(pk=other.pk).avatar_thumbnails, thumbnails)
+
+        storage = get_avatar_storage()
+        response = serve_media(RequestFactory().get('/media/' + name), name, storage.location)
+        self.assertEqual(response['Cache-Control'], 'public, max-age=31536000, immutable')
+        card = thumbnails['card']['webp'][0][len(settings.MEDIA_URL):].replace('%40', '@')
+        self.assertIn('immutable', serve_media(RequestFactory().get('/'), card, storage.location)['Cache-Control'])
+
+        # replaced and deleted avatars release the file, it is deleted after the grace time
+        self.upload('new.jpg', (400, 400), 'green')
+        self.assertEqual(self.refcount(name), 1)
+        self.assertEqual(collect_avatars(grace=0), [])
+        other.user.delete()
+        self.assertEqual(self.refcount(name), 0)
+        self.assertEqual(collect_avatars(grace=60), [])
+        self.assertEqual(collect_avatars(grace=0), [name])
+        self.assertFalse(storage.exists(name) or storage.exists(card))
+        self.assertIsNone(self.refcount(name))
+        self.assertTrue(storage.exists(self.profile.avatar.name))
+
+    def test_edit_view_counts_the_upload(self):
+        self.client.force_login(self.profile.user)
+        url = reverse('profile-redacting', kwargs={'profile_id': self.profile.pk})
+        response = self.client.post(url, {'gender': 'f', 'phone': '+380501234567',
+                                          'avatar': image_file('photo.jpg', (400, 400))})
+        self.assertEqual(response.status_code, 302)
+        name = Profile.objects.get(pk=self.profile.pk).avatar.name
+        self.assertTrue(is_content_addressed(name))
+        self.assertEqual(self.refcount(name), 1)
+
+    def test_old_uploads(self):
+        storage = get_avatar_storage()
+        # two uploads of the same image under old names, one of them replaced by now
+        for name in ('users/2022/03/29/a.jpeg', 'users/2022/03/29/a_G1GRG5x.jpeg', 'users/2022/03/29/b.jpeg'):
+            default_storage.save(name, image_file(name, (100, 100), 'blue' if 'b.' in name else 'red'))
+        other = User.objects.create_user(username='old').profile
+        Profile.objects.filter(pk=self.profile.pk).update(avatar='users/2022/03/29/a.jpeg')
+        Profile.objects.filter(pk=other.pk).update(avatar='users/2022/03/29/a_G1GRG5x.jpeg')
+
+        moved = rehash_avatars()
+        self.assertEqual(len(moved), 2)
+        self.assertEqual(len(set(moved.values())), 1)
+        new = moved['users/2022/03/29/a.jpeg']
+        self.assertEqual(set(Profile.objects.values_list('avatar', flat=True)), {new})
+        self.assertEqual(self.refcount(new), 2)
+        self.assertEqual(sorted(collect_avatars(grace=0, scan=['users'])),
+                         ['users/2022/03/29/a.jpeg', 'users/2022/03/29/a_G1GRG5x.jpeg', 'users/2022/03/29/b.jpeg'])
+        self.assertEqual(storage.listdir('users/2022/03/29'), ([], []))
+        self.assertTrue(storage.exists(new))
+
+
+task_calls = []
+
+
+@task(max_attempts=2, retry_delay=0)
+def flaky_task(key, fail=0):
+    task_calls.append(key)
+    if task_calls.count(key) <= fail:
+        raise ValueError(key)
+
+
+class TaskTest(TestCase):
+    def setUp(self):
+        task_calls.clear()
+
+    def test_tasks_of_rolled_back_transactions_are_dropped(self):
+        try:
+            with transaction.atomic():
+                enqueue(flaky_task, 'lost')
+                raise ValueError
+        except ValueError:
+            pass
+        enqueue('mainapp.tests.flaky_task', 'kept')
+        self.assertEqual(list(Task.objects.values_list('name', 'args')), [('mainapp.tests.flaky_task', ['kept'])])
+
+    def test_retries(self):
+        enqueue(flaky_task, 'ok')
+        enqueue(flaky_task, 'retried', fail=1)
+        enqueue(flaky_task, 'failed', fail=5)
+        # failed attempts are counted, the retried task is done by its second one
+        self.assertEqual(run_pending(), (2, 3))
+        self.assertEqual(sorted(task_calls), ['failed', 'failed', 'ok', 'retried', 'retried'])
+        failed = Task.objects.get()
+        self.assertEqual((failed.args, failed.state, failed.attempts), (['failed'], Task.FAILED, 2))
+        self.assertIn('ValueError: failed', failed.error)
+        self.assertEqual(run_pending(), (0, 0))
+
+    def test_claimed_tasks_belong_to_one_worker(self):
+        for key in 'abc':
+            enqueue(flaky_task, key)
+        first, second = claim(2), claim(2)
+        self.assertEqual((len(first), len(second), claim(2)), (2, 1, []))
+        self.assertNotEqual(first[0].lease, second[0].lease)
+        # a worker that died leaves them to others after the lease
+        Task.objects.update(run_at=timezone.now())
+        self.assertEqual(len(claim(5)), 3)
+
+    def test_local_backend(self):
+        backend = LocalBackend(workers=1)
+        with self.captureOnCommitCallbacks(execute=True):
+            backend.enqueue('mainapp.tests.flaky_task', ['local'], {})
+            self.assertEqual(task_calls, [])
+        backend.executor.shutdown()
+        self.assertEqual(task_calls, ['local'])
+
+
+class PopularityTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        # views buffered by the other tests
+        counter.take()
+        make_profiles(3, [], [])
+        self.alice, self.bob, self.carol = Profile.objects.order_by('pk')
+
+    def views(self):
+        return dict(ProfileViewHour.objects.values('profile_id').annotate(total=Sum('views'))
+                    .values_list('profile_id', 'total'))
+
+    def test_views_are_buffered(self):
+        views = ViewCounter(interval=3600)
+        for profile in (self.alice, self.alice, self.alice, self.bob):
+            views.add(profile.pk)
+        self.assertEqual(self.views(), {})
+        with self.assertNumQueries(1):
+            # a task row, no write of the rollups on the request
+            views.flush()
+        self.assertEqual(self.views(), {})
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(run_pending(), (1, 0))
+        self.assertEqual(len([q for q in queries if 'INSERT INTO "mainapp_profileviewhour"' in q['sql']]), 1)
+        self.assertEqual(self.views(), {self.alice.pk: 3, self.bob.pk: 1})
+        views.add(self.alice.pk)
+        views.add(self.alice.pk, now=timezone.now() - timedelta(hours=1))
+        deleted = self.carol.pk
+        views.add(deleted)
+        views.flush()
+        self.carol.user.delete()
+        with self.assertNumQueries(0):
+            # nothing buffered, nothing enqueued
+            views.flush()
+        run_pending()
+        self.assertEqual(self.views(), {self.alice.pk: 5, self.bob.pk: 1})
+        self.assertEqual(ProfileViewHour.objects.filter(profile=self.alice).count(), 2)
+
+        # a counter with no interval hands over every view
+        views = ViewCounter(interval=0)
+        views.add(self.bob.pk)
+        run_pending()
+        self.assertEqual(self.views()[self.bob.pk], 2)
+
+    def test_popular_this_week(self):
+        now = timezone.now()
+        save_views({(self.alice.pk, now): 2, (self.bob.pk, now): 5, (self.alice.pk, now - timedelta(days=8)): 10})
+        self.assertEqual(popular_profiles(), [(self.bob.pk, 5), (self.alice.pk, 2)])
+        self.assertEqual(prune_views(days=7), 1)
+
+        # own profile isn't counted
+        self.client.force_login(self.alice.user)
+        self.client.get(reverse('profile', args=[self.alice.pk]))
+        self.client.get(reverse('profile', args=[self.carol.pk]))
+        self.assertEqual(dict(counter.take()), {(self.carol.pk, hour_of(timezone.now())): 1})
+
+        response = self.client.get(reverse('index'))
+        self.assertContains(response, 'Popular this week')
+        self.assertContains(response, '5 views')
+
+
+def setUpModule():
+    # profile pages opened by the tests are counted but never flushed in the middle
+    # of an assertNumQueries, PopularityTest flushes counters of its own
+    counter.interval = 3600
+    counter.take()
+    # the tests build recommendation indexes themselves, no thread touches their databases
+    recommendations.BUILD_IN_BACKGROUND = False
+
+
+def tearDownModule():
+    counter.interval = VIEWS_FLUSH_INTERVAL
+    counter.take()
+    recommendations.BUILD_IN_BACKGROUND = True
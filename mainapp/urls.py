@@ -1,10 +1,12 @@
 from django.urls import path, include, re_path
 from .views import *
+from . import async_views
 from rest_framework import routers
 
 
 router = routers.DefaultRouter()
 router.register(r'country', CountryAPIViewSet)
+router.register(r'profiles', ProfileAPIViewSet)
 
 
 urlpatterns = [
@@ -17,7 +19,22 @@ urlpatterns = [
     path('profile-language-level/<int:profile_id>/<int:language>/', LanguageLevelUpdateView.as_view(), name='profile-language-level'),
 
     #API pathes
+    path('api/v1/reference/countries/', ReferenceDataView.as_view(name='countries'), name='reference-countries'),
+    path('api/v1/reference/languages/', ReferenceDataView.as_view(name='languages'), name='reference-languages'),
+    path('api/v1/reference/tags/', ReferenceDataView.as_view(name='tags'), name='reference-tags'),
+    path('api/v1/partners/<int:profile_id>/', PartnerAPIView.as_view(), name='partner'),
+    path('api/v1/partners/<int:profile_id>/<str:action>/', PartnerAPIView.as_view(), name='partner-action'),
+    path('api/v1/conversations/', ConversationsAPIView.as_view(), name='conversations'),
+    path('api/v1/conversations/<int:profile_id>/messages/', ConversationMessagesAPIView.as_view(), name='conversation-messages'),
+    path('api/v1/conversations/<int:profile_id>/read/', ConversationReadAPIView.as_view(), name='conversation-read'),
+    path('api/v1/recommendations/', RecommendationsAPIView.as_view(), name='recommendations'),
+    path('api/v1/export/profiles.jsonl', export_profiles, {'fmt': 'jsonl'}, name='export-profiles-jsonl'),
+    path('api/v1/export/profiles.csv', export_profiles, {'fmt': 'csv'}, name='export-profiles-csv'),
     path('api/v1/', include(router.urls)),
+    # async twins of the hot read paths, for ASGI
+    path('api/async/profiles/', async_views.profiles, name='async-profiles'),
+    path('api/async/profiles/<int:profile_id>/', async_views.profile, name='async-profile'),
+    path('api/async/reference/<str:name>/', async_views.reference, name='async-reference'),
     path('api/v1/auth/', include('djoser.urls')),
     re_path(r'auth/', include('djoser.urls.authtoken'))
 
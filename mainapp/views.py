@@ -1,184 +1,132 @@
+from django.contrib import messages
 from django.contrib.auth import logout, login
 from django.contrib.auth.forms import AuthenticationForm
 from django.contrib.auth.mixins import LoginRequiredMixin
 from django.contrib.auth.views import LoginView
-from django.core.exceptions import ObjectDoesNotExist
-from django.http import Http404
+from django.contrib.admin.views.decorators import staff_member_required
+from django.db import transaction
+from django.http import Http404, HttpResponse, StreamingHttpResponse
 from django.shortcuts import redirect
 from django.urls import reverse_lazy
-from django.utils.timezone import now
-from django.views.generic import CreateView, DetailView, UpdateView, ListView
-from rest_framework import viewsets
-from rest_framework.permissions import IsAuthenticatedOrReadOnly
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
+from django.views.generic import CreateView, DetailView, UpdateView, ListView, View
+from rest_framework import generics, viewsets
+from rest_framework.permissions import IsAuthenticated, IsAuthenticatedOrReadOnly
+from rest_framework.response import Response
+from rest_framework.views import APIView
 from .forms import *
 from .models import *
 from django.contrib.messages.views import *
-from .serializers import CountrySerializer
+from .cards import with_cards
+from .exporter import RENDERERS, export_rows
+from .facets import get_facets
+from .filters import filter_profiles, selected_filters
+from .popularity import popular_profiles, record_view
+from .pagination import InvalidCursor, MessageCursorPagination, ProfileCursorPagination, keyset_order, paginate_by_cursor
+from . import conversations, partners
+from .partners import get_relations
+from .recent_views import push_recent_view
+from .recommendations import recommend
+from .reference import get_reference_blob
+from .serializers import CountrySerializer, MessageSerializer, ProfileSummarySerializer
 
 
 class GenerateContentMixin:
     def get_context_data(self, *, object_list=None, **kwargs):
         context = super().get_context_data(**kwargs)
-        if self.request.user.pk:
-            # to find user's profile id
-            try:
-                profile_id = Profile.objects.get(user_id=self.request.user.pk).id
-            except ObjectDoesNotExist:
-                pass
-            context['profile_id'] = profile_id
+        # logined user's profile id, request.profile comes from CurrentProfileMiddleware
+        if self.request.profile:
+            context['profile_id'] = self.request.profile.pk
         return context
 
-class GetLoginedProfileId:
-    def get_logined_profile_id(self):
-        try:
-            return Profile.objects.get(user_id=self.request.user.pk).id
-        except:
-            return None
-
 
 class PartnerDataGenerateMixin:
-    def get_partners_queryset(self, logined_id):
-        try:
-            partners1 = Partner.objects.filter(followed_id=logined_id, response_date__isnull=False).values('follower_id')
-            partners2 = Partner.objects.filter(follower_id=logined_id, response_date__isnull=False).values('followed_id')
-            partners = partners1.union(partners2)
-            return Profile.objects.filter(pk__in=partners)
-        except:
-            return None
-
-    def get_followers_requests_queryset(self, profile_pk):
-        return Partner.objects.filter(followed_id=profile_pk,
-                                      response_date__isnull=True)
-
-    def is_follow_request(self, logined_id, profile_pk):
-        try:
-            Partner.objects.get(follower_id=profile_pk, followed_id=logined_id, response_date__isnull=True)
-            return True
-        except:
-            return False
-
-    def is_follower(self, logined_id, profile_pk):
-        is_follower = Partner.objects.filter(follower_id=profile_pk,
-                                             followed_id=logined_id,
-                                             response_date__isnull=False)
-        is_followed = Partner.objects.filter(followed_id=profile_pk,
-                                             follower_id=logined_id,
-                                             response_date__isnull=False)
-        if is_follower.exists() or is_followed.exists():
-            return True
+    # submit button name of the profile page forms -> partners action
+    PARTNER_ACTIONS = {'follow_request': 'request',
+                       'follow_accept': 'accept',
+                       'follow_reject': 'reject'}
 
     def post_handler(self):
-        followed = Profile.objects.get(pk=self.request.POST['followed'])
-        follower = Profile.objects.get(pk=self.request.POST['follower'])
-
-        # add following request
-        if 'follow_request' in request.POST:
-            obj, created = Partner.objects.update_or_create(
-                followed=followed, follower=follower)
-            if created:
-                messages.success(request, 'Request was sent. You will be able to chat after confirming the request')
+        viewer_id = self.request.profile.pk
+        action = next((action for name, action in self.PARTNER_ACTIONS.items() if name in self.request.POST), None)
+        try:
+            # the forms send both sides, the other one is whoever isn't the viewer
+            ids = {int(self.request.POST['followed']), int(self.request.POST['follower'])}
+        except (KeyError, ValueError):
+            return
+        other_id = (ids - {viewer_id}).pop() if len(ids) == 2 and viewer_id in ids else None
+        if action is None or other_id is None:
+            return
+        changed = partners.ACTIONS[action](viewer_id, other_id)
+        if action == 'request':
+            if changed:
+                messages.success(self.request, 'Request was sent. You will be able to chat after confirming the request')
             else:
-                messages.success(request, """You have already sent request. 
-                                             Request was updated. 
-                                             You will be able to chat after confirming the request""")
-        if 'follow_accept' in request.POST:
-            Partner.objects.filter(followed=followed, follower=follower).update(response_date=now())
-            Partner.objects.filter(follower=followed, followed=follower).update(response_date=now())
-        if 'follow_reject' in request.POST:
-            Partner.objects.filter(followed=followed, follower=follower).delete()
-            Partner.objects.filter(follower=followed, followed=follower).delete()
-
-
-class SessionMixin:
-    def get_visited_profiles(self, profile_pk, context):
-        # make queryset of visited profiles
-        if 'visited_profiles' in self.request.session:
-            if profile_pk in self.request.session['visited_profiles']:
-                self.request.session['visited_profiles'].remove(profile_pk)
-            profiles = self.model.objects.filter(pk__in=self.request.session['visited_profiles'])
-            viewed_profiles = sorted(profiles,
-                                     key=lambda x: self.request.session['visited_profiles'].index(x.pk))
-            context['viewed_profiles'] = viewed_profiles[:5]
-
-            self.request.session['visited_profiles'].insert(0, profile_pk)
-            if len(self.request.session['visited_profiles']) > 6:
-                self.request.session['visited_profiles'].pop()
-        else:
-            self.request.session['visited_profiles'] = [profile_pk]
-        self.request.session.modified = True
-
-
+                messages.info(self.request, 'You have already sent request. '
+                                            'You will be able to chat after confirming the request')
+        elif action == 'accept' and changed:
+            messages.success(self.request, 'Request was accepted, now you are partners')
 
 
+class RecentViewsMixin:
+    def get_visited_profiles(self, profile_pk, context):
+        # recently visited profiles in the order of visits
+        visited = push_recent_view(self.request, profile_pk)
+        profiles = self.model.objects.select_related('user').in_bulk(visited)
+        context['viewed_profiles'] = [profiles[pk] for pk in visited if pk in profiles]
+        context['viewed_cards'] = with_cards(context['viewed_profiles'], 'small')
 
 
 class ProfilesView(GenerateContentMixin, ListView):
     model = Profile
+    context_object_name = 'profile_list'  # of ProfileSummary
     template_name = 'mainapp/index.html'
     paginate_by = 20
     extra_context = {'title': 'Would talk with you'}
 
-    # def get_queryset(self):
-    #     queryset = super().get_queryset()
-    #     print(queryset)
-    #     print(self.request.GET)
-    #     queryset = queryset.filter(gender__in=['m', 'f', 'n'],
-    #                                study__name__in=['English', 'Greek', 'Italian', 'Turkish'],
-    #                                tags__tag__in=['Youtube']).distinct()
-    #     return queryset
+    def get_queryset(self):
+        # a page is read from ProfileSummary rows only, see mainapp.summaries
+        return filter_profiles(ProfileSummary.objects.all(), self.request.GET)
+
+    def get_recommended_profiles(self):
+        # the index is built in the background, not by this request
+        ids = [pk for pk, score in recommend(self.request.profile.pk, k=5, wait=False)]
+        profiles = self.model.objects.select_related('user').in_bulk(ids)
+        return [profiles[pk] for pk in ids if pk in profiles]
+
+    def get_popular_profiles(self):
+        popular = popular_profiles()
+        profiles = self.model.objects.select_related('user').in_bulk([pk for pk, views in popular])
+        for pk, views in popular:
+            if pk in profiles:
+                profiles[pk].week_views = views
+        return [profiles[pk] for pk, views in popular if pk in profiles]
+
+    def paginate_queryset(self, queryset, page_size):
+        # old ?page= links keep OFFSET pagination, otherwise pages go by cursor
+        if self.page_kwarg in self.request.GET:
+            # in the cursor order, an unordered OFFSET could repeat or skip profiles between pages
+            return super().paginate_queryset(keyset_order(queryset, 'last_login'), page_size)
+        try:
+            page = paginate_by_cursor(queryset, self.request.GET.get('cursor'), page_size, 'last_login')
+        except InvalidCursor:
+            raise Http404('Invalid cursor')
+        return None, page, page.object_list, page.has_other_pages()
 
     def get_context_data(self, *, object_list=None, **kwargs):
         context = super().get_context_data(**kwargs)
-
-        profiles = []
-        for profile in context['profile_list']:
-            study = [lang.name for lang in profile.study.all()]
-            tags = [tag.tag for tag in profile.tags.all()]
-            profiles.append({'id': profile.id,
-                             'age': profile.age,
-                             'gender': profile.get_gender_display(),
-                             'study': study,
-                             'tags': tags
-                             })
-        context['profiles'] = profiles
-
-        # uniq list of languages:
-        languages = [profile['study'] for profile in profiles]
-        languages = [item for sublist in languages for item in sublist]
-        languages = list(set(languages))
-        context['languages'] = languages
-
-        # uniq list of tags:
-        tags = [profile['tags'] for profile in profiles]
-        tags = [item for sublist in tags for item in sublist]
-        tags = list(set(tags))
-        context['tags'] = tags
-
-        # uniq list of genders:
-        genders = [profile['gender'] for profile in profiles]
-        genders = list(set(genders))
-        context['genders'] = genders
-
-        # uniq list of ages:
-        ages = [profile['age'] for profile in profiles]
-        ages = [x for x in ages if x is not None]
-        ages.sort()
-        context['ages'] = ages
-        age_groups = {}
-        for age in ages:
-            if age <= 25:
-                age_groups['<25'] = True
-            elif age <= 35:
-                age_groups['25-35'] = True
-            elif age <= 45:
-                age_groups['35-45'] = True
-            elif age <= 60:
-                age_groups['45-60'] = True
-            elif age > 60:
-                age_groups['60+'] = True
-        age_groups = age_groups.keys()
-        context['age_groups'] = age_groups
-
+        if self.request.profile:
+            context['recommended_cards'] = with_cards(self.get_recommended_profiles(), 'small')
+        context['popular_cards'] = with_cards(self.get_popular_profiles(), 'small')
+        # languages, tags, genders and age groups of the whole list, not only of the page
+        context.update(get_facets(ProfileSummary.objects.all(), self.request.GET))
+        context['selected'] = selected_filters(self.request.GET)
+        # to keep filters in pagination links
+        query = self.request.GET.copy()
+        query.pop('page', None)
+        query.pop('cursor', None)
+        context['filter_query'] = query.urlencode()
         return context
 
 
@@ -217,9 +165,8 @@ def logout_user(request):
 
 
 class ProfileView(GenerateContentMixin,
-                  GetLoginedProfileId,
                   PartnerDataGenerateMixin,
-                  SessionMixin,
+                  RecentViewsMixin,
                   DetailView):
     model = Profile
     template_name = 'mainapp/profile.html'
@@ -232,25 +179,30 @@ class ProfileView(GenerateContentMixin,
     extra_context = {'title': 'profile', 'age': age}
 
     def post(self, request, *args, **kwargs):
-        self.object = self.get_object()
+        if not request.profile:
+            return redirect('login')
         self.post_handler()
-        context = self.get_context_data(object=self.object)
-        return self.render_to_response(context)
+        # back to GET, so reloading the page doesn't send the form again
+        return redirect(request.path)
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
         profile_pk = context['object'].pk  # id of seek profile
-        logined_id = self.get_logined_profile_id()
+        logined_id = context.get('profile_id')
+        if profile_pk != logined_id:
+            # counted in memory, see mainapp.popularity
+            record_view(profile_pk)
         #make queryset of recently visited profiles
         self.get_visited_profiles(profile_pk, context)
-        # make queryset of followers requests:
-        context['followers_requests_queryset'] = self.get_followers_requests_queryset(logined_id)
-        # queryset of partners:
-        context['partners'] = self.get_partners_queryset(logined_id)
+        # requests, partners and relationship with the seek profile in one query
+        relations = get_relations(logined_id)
+        context['relationship'] = relations.state(profile_pk)
+        context['followers_requests_queryset'] = relations.requests
+        context['partners'] = relations.partners
         # check if profile sent request to logined profile:
-        context['is_requested'] = self.is_follow_request(logined_id, profile_pk)
+        context['is_requested'] = context['relationship'] == partners.INCOMING
         # check if user is follower:
-        context['is_follower'] = self.is_follower(logined_id, profile_pk)
+        context['is_follower'] = context['relationship'] == partners.PARTNERS
         return context
 
 
@@ -265,7 +217,9 @@ class ProfileUpdateView(LoginRequiredMixin, GenerateContentMixin, UpdateView):
     extra_context = {'title': 'redacting'}
 
     def get_object(self, queryset=None):
-        edit_profile_id = self.model.objects.get(user_id=self.request.user.pk).id
+        if not self.request.profile:
+            raise Http404()
+        edit_profile_id = self.request.profile.pk
 
         if queryset is None:
             queryset = self.get_queryset()
@@ -277,6 +231,11 @@ class ProfileUpdateView(LoginRequiredMixin, GenerateContentMixin, UpdateView):
             raise Http404()
         return obj
 
+    def form_valid(self, form):
+        # the avatar refcounts of the post_save signal commit or roll back with the profile
+        with transaction.atomic():
+            return super().form_valid(form)
+
 
 class LanguageLevelUpdateView(LoginRequiredMixin, GenerateContentMixin, UpdateView):
     model = LanguageLevel
@@ -288,14 +247,17 @@ class LanguageLevelUpdateView(LoginRequiredMixin, GenerateContentMixin, UpdateVi
     extra_context = {'title': 'language-redacting'}
 
     def get_object(self, queryset=None):
+        if not self.request.profile:
+            raise Http404()
         language_id = self.kwargs['language']
-        profile_id = Profile.objects.get(user=self.request.user.pk).pk
-        obj = self.model.objects.get(language=language_id, profile=profile_id)
+        try:
+            obj = self.model.objects.get(language=language_id, profile=self.request.profile.pk)
+        except self.model.DoesNotExist:
+            raise Http404()
         return obj
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        context['profile_id'] = Profile.objects.get(user=self.request.user.pk).pk
         context['language_id'] = self.kwargs['language']
 
         return context
@@ -306,3 +268,124 @@ class CountryAPIViewSet(viewsets.ModelViewSet):
     queryset = Country.objects.all()
     serializer_class = CountrySerializer
     permission_classes = (IsAuthenticatedOrReadOnly,)
+
+
+class ProfileAPIViewSet(viewsets.ReadOnlyModelViewSet):
+    queryset = ProfileSummary.objects.all()
+    serializer_class = ProfileSummarySerializer
+    pagination_class = ProfileCursorPagination
+
+    def get_queryset(self):
+        # the same query string filters as on the index page
+        return filter_profiles(ProfileSummary.objects.all(), self.request.query_params)
+
+
+class RecommendationsAPIView(APIView):
+    # best language exchange matches for the logined user, ?count=10
+    permission_classes = (IsAuthenticated,)
+
+    def get(self, request):
+        try:
+            count = min(int(request.query_params.get('count', 10)), 50)
+        except ValueError:
+            count = 10
+        if not request.profile:
+            return Response([])
+        scores = dict(recommend(request.profile.pk, k=count, wait=False))
+        summaries = ProfileSummary.objects.in_bulk(scores)
+        data = []
+        for pk, score in scores.items():
+            if pk in summaries:
+                item = ProfileSummarySerializer(summaries[pk], context={'request': request}).data
+                item['score'] = round(score, 3)
+                data.append(item)
+        return Response(data)
+
+
+class PartnerAPIView(APIView):
+    """
+    GET  /api/v1/partners/<profile_id>/           relationship with the profile
+    POST /api/v1/partners/<profile_id>/<action>/  request, accept or reject, see mainapp.partners
+    """
+    permission_classes = (IsAuthenticated,)
+
+    def get(self, request, profile_id):
+        if not request.profile:
+            raise Http404()
+        return Response({'profile': profile_id, 'state': partners.get_state(request.profile.pk, profile_id)})
+
+    def post(self, request, profile_id, action):
+        if not request.profile or action not in partners.ACTIONS:
+            raise Http404()
+        if profile_id == request.profile.pk:
+            return Response({'detail': 'It is your own profile'}, status=400)
+        changed = partners.ACTIONS[action](request.profile.pk, profile_id)
+        state = partners.get_state(request.profile.pk, profile_id)
+        if action == 'request' and state == partners.NONE:
+            raise Http404()
+        return Response({'profile': profile_id, 'state': state, 'changed': changed})
+
+
+class ConversationsAPIView(APIView):
+    # unread messages of every conversation of the logined user, read from the counters
+    permission_classes = (IsAuthenticated,)
+
+    def get(self, request):
+        if not request.profile:
+            return Response([])
+        return Response(conversations.unread_counts(request.profile.pk))
+
+
+class ConversationMessagesAPIView(generics.ListAPIView):
+    # GET /api/v1/conversations/<profile_id>/messages/  chat history with the profile, the newest first,
+    # ``next`` is the page of older messages
+    serializer_class = MessageSerializer
+    pagination_class = MessageCursorPagination
+    permission_classes = (IsAuthenticated,)
+
+    def get_queryset(self):
+        conversation = self.request.profile and conversations.get_conversation(self.request.profile.pk,
+                                                                               self.kwargs['profile_id'])
+        if not conversation:
+            raise Http404()
+        return Message.objects.filter(conversation_id=conversation.pk)
+
+
+class ConversationReadAPIView(APIView):
+    # POST /api/v1/conversations/<profile_id>/read/  resets the unread counter of the logined user
+    permission_classes = (IsAuthenticated,)
+
+    def post(self, request, profile_id):
+        if not request.profile or not conversations.mark_read(request.profile.pk, profile_id):
+            raise Http404()
+        return Response({'profile': profile_id, 'unread': 0})
+
+
+class ReferenceDataView(View):
+    """
+    Read-only countries, languages and tags, see mainapp.reference.
+    Answers 304 to If-None-Match / If-Modified-Since of the current version.
+    """
+    name = None
+
+    def get(self, request, *args, **kwargs):
+        return reference_response(request, get_reference_blob(self.name))
+
+
+def reference_response(request, blob):
+    response = get_conditional_response(request, etag=blob.etag, last_modified=blob.last_modified)
+    if response is None:
+        response = HttpResponse(blob.body, content_type='application/json')
+    response['ETag'] = blob.etag
+    response['Last-Modified'] = http_date(blob.last_modified)
+    response['Cache-Control'] = 'no-cache'
+    return response
+
+
+@staff_member_required
+def export_profiles(request, fmt):
+    # whole profiles table, streamed with constant memory, see mainapp.exporter
+    render, content_type = RENDERERS[fmt]
+    response = StreamingHttpResponse(render(export_rows()), content_type=content_type)
+    response['Content-Disposition'] = 'attachment; filename="profiles.%s"' % fmt
+    return response